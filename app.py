@@ -6,13 +6,36 @@
 
 import streamlit as st
 import requests
+import numpy as np
 import pandas as pd
-import requests
-import pandas as pd
-import json
+import os
 from datetime import datetime
-from utils.calculations import calculate_tax_at_vest, calculate_capital_gains_tax, calculate_gains_at_sale
-from utils.data_handling import export_data, import_data
+from utils.cache import SHARED_MAX_BYTES, InternPool, ResultCache, cached_view
+from utils.changes import diff_editor_rows, has_changes, editor_rows, date_column, derive_vest_fields, derive_sale_fields
+from utils.data_handling import export_data, import_data, import_broker_statements, import_price_history, import_fx_rates
+from utils.facts import lot_facts, build_summary_table
+from utils.fx import BASE_CURRENCY, missing_fx_rates
+from utils.history import History
+from utils.memory import DEFAULT_SESSION_MAX_BYTES, enforce_budget, session_footprint
+from utils.portfolio import Portfolio
+from utils.prices import backfill_prices, fill_editor_prices
+from utils.reconciliation import reconcile
+from utils import profiling
+from utils.profiling import timed
+from utils.scenarios import SALE_STRATEGIES, compare_sale_strategies, open_lots, plan_sale, what_if_grid
+from utils.serialization import iter_grants, parse_iso_date
+from utils.store import DEFAULT_PORTFOLIO, PortfolioStore
+from utils.validation import validate_grants, validate_vests, validate_sales, blocking_errors, saved_rows
+from utils.reports import (
+    CHART_DETAIL_LIMIT,
+    chart_rows,
+    tax_years,
+    tax_year_summary,
+    generate_tax_breakdown_table,
+    generate_capital_gains_table,
+    generate_net_gains_table,
+    generate_stock_performance_table,
+)
 from utils.visualization import (
     display_rsu_details_table,
     display_totals,
@@ -20,42 +43,154 @@ from utils.visualization import (
     plot_capital_gains_by_vest,
     plot_net_gains,
     plot_stock_performance,
-    generate_tax_breakdown_table,
-    generate_capital_gains_table,
-    generate_net_gains_table,
-    generate_stock_performance_table,
+    plot_what_if_grid,
+    display_stage_timings,
 )
 
 # Set page configuration (wide mode)
 st.set_page_config(layout="wide")
 
+SAMPLE_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample.json")
+# Set to a SQLite file to keep portfolios across sessions (e.g. RSU_DB_PATH=rsu.db)
+STORE_PATH_ENV = "RSU_DB_PATH"
+# Share ledger issues listed in the Summary; the rest are counted
+LEDGER_ISSUE_LIMIT = 20
+# Memory limits in MB: each session's data and cached tables (older undo versions
+# and cached tables are dropped beyond it), and the view cache all sessions share
+SESSION_MAX_MB_ENV = "RSU_SESSION_MAX_MB"
+SHARED_CACHE_MAX_MB_ENV = "RSU_SHARED_CACHE_MB"
+
 # Parse dates when using requests URL
 def parse_dates(data):
     for grant in data:
-        grant['grant_date'] = datetime.strptime(grant['grant_date'], '%Y-%m-%d').date()
+        grant['grant_date'] = parse_iso_date(grant['grant_date'])
         for vest in grant['vests']:
-            vest['vest_date'] = datetime.strptime(vest['vest_date'], '%Y-%m-%d').date()
+            vest['vest_date'] = parse_iso_date(vest['vest_date'])
         for sale in grant['sales']:
-            sale['sale_date'] = datetime.strptime(sale['sale_date'], '%Y-%m-%d').date()
+            sale['sale_date'] = parse_iso_date(sale['sale_date'])
     return data
+
+@st.cache_resource
+def portfolio_store(path):
+    """The SQLite portfolio store at `path`, shared by every session."""
+    return PortfolioStore(path)
+
+def open_store():
+    """The portfolio store, or None unless RSU_DB_PATH names its file."""
+    path = os.environ.get(STORE_PATH_ENV)
+    return portfolio_store(path) if path else None
+
+def edit_history():
+    """The session's undo/redo History."""
+    if "history" not in st.session_state:
+        st.session_state["history"] = History()
+    return st.session_state["history"]
+
+def _megabytes(env, default_bytes):
+    value = os.environ.get(env)
+    return int(float(value) * 1024 * 1024) if value else default_bytes
+
+@st.cache_resource
+def shared_portfolios():
+    """Portfolios of every session by content, so equal ones (e.g. the sample data) are held once."""
+    return InternPool()
+
+def share_portfolio(portfolio):
+    """The instance of `portfolio` other sessions already hold, if any, with its cached tables."""
+    # The FX store is part of the key by identity, so a session keeps its own and with_fx isn't re-run
+    return shared_portfolios().intern((portfolio.fingerprint(), id(portfolio.fx)), portfolio)
+
+def set_portfolio(portfolio, record=True):
+    """Make `portfolio` the session's portfolio, writing the grants it changed through to the store.
+
+    The version it replaces is kept for undo unless `record` is False or the content is the same.
+    """
+    portfolio = share_portfolio(portfolio)
+    current = st.session_state.get("portfolio")
+    if record and current is not None and portfolio is not current and portfolio.fingerprint() != current.fingerprint():
+        edit_history().record(current)
+    st.session_state["portfolio"] = portfolio
+    store = open_store()
+    if store is not None and "store_loaded" in st.session_state:
+        store.save(portfolio, st.session_state["store_loaded"])
+
+@timed
+def add_store_section(store):
+    # Opening a saved portfolio loads it; a new name saves the session's data under it
+    st.sidebar.header("Saved Portfolio")
+    name = st.sidebar.text_input("Portfolio Name", value=DEFAULT_PORTFOLIO, key="store_portfolio").strip() or DEFAULT_PORTFOLIO
+    if st.session_state.get("store_loaded") != name:
+        st.session_state["store_loaded"] = name
+        if name in store.portfolios():
+            st.session_state["portfolio"] = share_portfolio(store.load(name))
+            # Edits of another portfolio can't be undone on this one
+            edit_history().clear()
+            st.session_state["data_loaded"] = True
+        elif st.session_state["portfolio"]:
+            store.save(st.session_state["portfolio"], name)
+    else:
+        # Another session may have saved edits to this portfolio; only the grants it changed are loaded.
+        # Caught up before this session saves, its next save won't write back stale grants.
+        current = st.session_state["portfolio"]
+        portfolio = store.refresh(current, name)
+        if portfolio is not current:
+            st.session_state["portfolio"] = share_portfolio(portfolio)
+            # Undo would put back the other session's grants as they were, and pending
+            # editor edits are relative to the rows they were shown
+            edit_history().clear()
+            _clear_editor_state()
+    st.sidebar.caption(f"Changes are saved to '{name}' as they are made.")
+
+def _clear_editor_state():
+    # The editors keep their edits as widget state, relative to the rows they were
+    # shown; after an undo or redo those rows have changed, so the edits are dropped
+    for key in list(st.session_state):
+        if key == "grants_editor" or key.startswith(("vests_editor_", "sales_editor_")):
+            del st.session_state[key]
+
+def _step_history(step):
+    # on_click callback of the Undo/Redo buttons; runs before the rerun builds the editors
+    portfolio = step(st.session_state["portfolio"])
+    set_portfolio(portfolio, record=False)
+    _clear_editor_state()
+
+def add_history_controls():
+    history = edit_history()
+    undo_column, redo_column, _ = st.columns([1, 1, 6])
+    undo_column.button("Undo", key="undo", disabled=not history.can_undo(), on_click=_step_history, args=(history.undo,), use_container_width=True)
+    redo_column.button("Redo", key="redo", disabled=not history.can_redo(), on_click=_step_history, args=(history.redo,), use_container_width=True)
+
+def keep_lot_currency(row, original):
+    # The editors don't show a lot's own currency; an edited lot keeps the one it had
+    if original and original.get("currency"):
+        return {**row, "currency": original["currency"]}
+    return row
     
+@timed
 def load_sample_data():
-    """Load sample JSON data from a URL."""
+    """Load the sample JSON data bundled with the app, or from a URL if it is missing."""
     sample_data_url = "https://github.com/binaryzer0/rsu-calculator/raw/449666f16b5ab1c356f3746077863f5de722432d/sample.json" 
     try:
-        response = requests.get(sample_data_url)
-        response.raise_for_status()  # Raise an error for bad status codes
-        sample_data = response.json()
-        st.session_state["grants"] = parse_dates(sample_data)
+        if os.path.exists(SAMPLE_DATA_PATH):
+            with open(SAMPLE_DATA_PATH, "rb") as f:
+                portfolio = Portfolio.from_grants(iter_grants(f))
+        else:
+            response = requests.get(sample_data_url)
+            response.raise_for_status()  # Raise an error for bad status codes
+            sample_data = response.json()
+            portfolio = Portfolio.from_grants(parse_dates(sample_data))
+        set_portfolio(portfolio.with_derived_fields())
         st.session_state["data_loaded"] = True
         st.success("Sample data loaded successfully!")
     except Exception as e:
         st.error(f"Failed to load sample data: {e}")
 
+@timed
 def add_grant_form():
     with st.expander("Add/Edit Grants", expanded=not st.session_state.get("data_loaded", False)):
-        if "grants" not in st.session_state:
-            st.session_state["grants"] = []
+        if "portfolio" not in st.session_state:
+            st.session_state["portfolio"] = Portfolio()
+        portfolio = st.session_state["portfolio"]
 
         st.info("Add, edit, or delete grants directly in the table below. Ensure 'Grant ID' is unique.")
 
@@ -66,8 +201,9 @@ def add_grant_form():
                 "Grant Date": grant["grant_date"],
                 "Symbol": grant["symbol"],
                 "Number of Stocks": grant["num_stocks"],
+                "Currency": grant.get("currency"),
             }
-            for grant in st.session_state["grants"]
+            for grant in portfolio.grants.values()
         ]
         grants_df_orig = pd.DataFrame(grant_data_for_editor)
 
@@ -81,108 +217,69 @@ def add_grant_form():
                  "Grant Date": st.column_config.DateColumn(required=True),
                  "Symbol": st.column_config.TextColumn(required=True),
                  "Number of Stocks": st.column_config.NumberColumn(required=True, min_value=1, step=1),
+                 "Currency": st.column_config.TextColumn(help=f"Currency the grant's shares are priced in (e.g. USD). Leave blank for {BASE_CURRENCY}."),
             },
             use_container_width=True
         )
 
-        # --- State Update Logic ---
-        # Convert current state to a dictionary for easy lookup and modification
-        grants_dict = {g["grant_id"]: g for g in st.session_state["grants"]}
-        edited_grants_dict = {}
-        edited_ids = set()
-        validation_passed = True
-        error_messages = []
-
-        for index, row in edited_df.iterrows():
-            grant_id_edited = row["Grant ID"]
-            is_existing_row = index < len(grants_df_orig) # Check if the index corresponds to an original row
-
-            # --- ID Immutability Check ---
-            if is_existing_row:
-                original_grant_id = grants_df_orig.loc[index, "Grant ID"]
-                if grant_id_edited != original_grant_id:
-                    error_messages.append(f"Row {index+1}: Cannot change the Grant ID ('{original_grant_id}' to '{grant_id_edited}') of an existing grant. Delete and re-add if necessary.")
-                    validation_passed = False
-                    # Continue validation for other fields if needed, but block state update later
-            # --- End ID Immutability Check ---
-
-            # Use the validated/original ID for further checks and dict keys
-            grant_id = original_grant_id if is_existing_row else grant_id_edited
-
-            # Basic Validation (using grant_id)
-            if not grant_id or pd.isna(grant_id):
-                 # This case should primarily catch empty IDs in new rows now
-                error_messages.append(f"Row {index+1}: Grant ID cannot be empty.")
-                # If it was an existing row where ID change was attempted, we already flagged validation_passed as False
-                validation_passed = False
-                continue # Skip further processing for this row if ID is invalid
-
-            # Check for duplicates using the final grant_id
-            if grant_id in edited_ids:
-                 error_messages.append(f"Row {index+1}: Duplicate Grant ID '{grant_id}' found in the table. Please ensure all Grant IDs are unique.")
-                 validation_passed = False
-                 # Continue validation for other fields if needed
-
-            # Other field validations
-            grant_date_val = row["Grant Date"].date() if isinstance(row["Grant Date"], pd.Timestamp) else row["Grant Date"]
-            num_stocks_val = int(row["Number of Stocks"]) if not pd.isna(row["Number of Stocks"]) else None
-            if pd.isna(grant_date_val) or pd.isna(row["Symbol"]) or num_stocks_val is None or num_stocks_val < 1:
-                 error_messages.append(f"Row {index+1} (Grant ID: {grant_id}): Missing or invalid required fields (Grant Date, Symbol, Number of Stocks >= 1).")
-                 # If validation failed earlier (e.g., ID change attempt), this ensures it stays failed
-                 validation_passed = False
-                 # Do not continue to adding to edited_ids or grants_dict if basic fields invalid
-
-            # Only add valid IDs to the set for duplicate checks and final list creation
-            if validation_passed or grant_id not in edited_ids: # Avoid adding duplicates if validation failed mid-row
-                 edited_ids.add(grant_id)
-
-            # If validation for *this specific row* has passed so far...
-            if validation_passed:
-                # Check if it's a new grant or an existing one being edited (using the final grant_id)
-                if grant_id in grants_dict:
-                    # Existing grant: Update fields (ID change was blocked above)
-                    grants_dict[grant_id].update({
-                        "grant_date": grant_date_val,
-                        "symbol": row["Symbol"],
-                        "num_stocks": num_stocks_val,
-                    })
-                    edited_grants_dict[grant_id] = grants_dict[grant_id]
-                else:
-                    # New grant: Create entry
-                    edited_grants_dict[grant_id] = {
-                        "grant_id": grant_id,
-                        "grant_date": grant_date_val,
-                        "symbol": row["Symbol"],
-                        "num_stocks": num_stocks_val,
-                        "vests": [],  # Initialize empty lists for new grants
-                        "sales": [],
-                    }
+        # --- Validation ---
+        # Checks run column-wise over the whole table (ID immutability, empty/duplicate IDs, required fields)
+        errors = validate_grants(grants_df_orig, edited_df)
 
         # --- Final State Update Decision ---
-        if not validation_passed:
+        if not errors.empty:
             # Display all collected error messages
-            for msg in error_messages:
+            for msg in errors["message"]:
                 st.error(msg)
             # Crucially, DO NOT update the session state if validation failed
             st.warning("Changes not saved due to validation errors.")
         else:
-            # Update session state only if all rows passed validation
-            # Convert the edited dictionary back to a list
-            # Only keep grants that are present in the final valid edited_ids set (handles deletions)
-            st.session_state["grants"] = [edited_grants_dict[gid] for gid in edited_ids if gid in edited_grants_dict]
+            # Update session state only if all rows passed validation and something changed
+            # Only inserted/updated rows are rebuilt; unchanged grants keep their stored rows
+            changes = diff_editor_rows(grants_df_orig, edited_df)
+            if has_changes(changes):
+                def build_grants(rows):
+                    grant_rows = pd.DataFrame({
+                        "grant_id": rows["Grant ID"],
+                        "grant_date": date_column(rows["Grant Date"]),
+                        "symbol": rows["Symbol"],
+                        "num_stocks": rows["Number of Stocks"].astype(int),
+                        "currency": rows["Currency"].fillna("").astype(str).str.strip().str.upper(),
+                    }).to_dict("records")
+                    # Existing grants keep any other fields they had; their vests and sales are kept too.
+                    # A blank currency means AUD and is not stored.
+                    grants = []
+                    for row in grant_rows:
+                        grant = {**(portfolio.grant(row["grant_id"]) or {}), **row}
+                        if not grant["currency"]:
+                            del grant["currency"]
+                        grants.append(grant)
+                    return grants
+
+                # Grants missing from the edited table are dropped (handles deletions)
+                edited_grants = editor_rows(edited_df, changes, list(portfolio.grants.values()), build_grants)
+                edited = portfolio.with_grants(edited_grants)
+                # Grants priced in another currency now have their stored taxes recalculated in AUD
+                repriced = [
+                    row["grant_id"] for row in edited_grants
+                    if row["grant_id"] in portfolio.grants and row.get("currency") != portfolio.grants[row["grant_id"]].get("currency")
+                ]
+                set_portfolio(edited.with_derived_fields(repriced) if repriced else edited)
             # Optional: Add a success message, but might be too noisy for dynamic editing
             # st.success("Grants updated!") # Consider if this is needed
 
     st.write("---")
 
 
+@timed
 def add_vest_form():
     with st.expander("Add/Edit Vests", expanded=not st.session_state.get("data_loaded", False)):
-        if "grants" not in st.session_state or not st.session_state["grants"]:
+        portfolio = st.session_state.get("portfolio")
+        if not portfolio:
             st.warning("No grants available. Please add a grant first.")
             return
 
-        grant_options = [g["grant_id"] for g in st.session_state["grants"]]
+        grant_options = list(portfolio.grants)
         if not grant_options:
              st.warning("No grants available to add vests to.")
              return
@@ -198,7 +295,7 @@ def add_vest_form():
             st.info(f"Add, edit, or delete vests for Grant ID '{selected_grant_id}' directly in the table below. Ensure 'Vest ID' is unique within this grant.")
 
             # Find the selected grant
-            grant = next((g for g in st.session_state["grants"] if g["grant_id"] == selected_grant_id), None)
+            grant = portfolio.grant(selected_grant_id)
             if not grant:
                 st.error(f"Selected Grant ID '{selected_grant_id}' not found in session state. This should not happen.")
                 return # Should not happen if options are derived from state
@@ -213,10 +310,13 @@ def add_vest_form():
                     "Tax Rate at Vest (%)": vest["tax_rate_vest"] * 100,
                     # "Tax at Vest": vest.get("tax_at_vest", 0) # Display calculated tax, but disable editing
                 }
-                for vest in grant.get("vests", [])
+                for vest in portfolio.vests.get(selected_grant_id, {}).values()
             ]
             vests_df_orig = pd.DataFrame(vest_data_for_editor)
 
+            # With a price history loaded, a blank Vest Price is filled with the close on the vest date
+            price_store = st.session_state.get("price_store")
+
             edited_vest_df = st.data_editor(
                 vests_df_orig,
                 key=f"vests_editor_{selected_grant_id}", # Unique key per grant
@@ -225,98 +325,70 @@ def add_vest_form():
                     "Vest ID": st.column_config.TextColumn(required=True),
                     "Vest Date": st.column_config.DateColumn(required=True),
                     "Shares Vested": st.column_config.NumberColumn(required=True, min_value=1, step=1),
-                    "Vest Price": st.column_config.NumberColumn(required=True, min_value=0.0, format="%.2f"),
+                    "Vest Price": st.column_config.NumberColumn(required=price_store is None, min_value=0.0, format="%.2f"),
                     "Tax Rate at Vest (%)": st.column_config.NumberColumn(required=True, min_value=0.0, max_value=100.0, format="%.2f"),
                     # "Tax at Vest": st.column_config.NumberColumn(disabled=True, format="$%.2f"), # Display only
                 },
                 use_container_width=True
             )
 
-            # --- State Update Logic ---
-            # Get the original vests for comparison
-            original_vests_dict = {v["vest_id"]: v for v in grant.get("vests", [])}
-            edited_vests_list = []
-            edited_vest_ids = set()
-            validation_passed = True
-            error_messages = []
-
-            for index, row in edited_vest_df.iterrows():
-                vest_id_edited = row["Vest ID"]
-                is_existing_row = index < len(vests_df_orig)
-
-                # --- ID Immutability Check ---
-                if is_existing_row:
-                    original_vest_id = vests_df_orig.loc[index, "Vest ID"]
-                    if vest_id_edited != original_vest_id:
-                        error_messages.append(f"Row {index+1}: Cannot change the Vest ID ('{original_vest_id}' to '{vest_id_edited}') of an existing vest. Delete and re-add if necessary.")
-                        validation_passed = False
-                        # Continue validation for other fields if needed
-                # --- End ID Immutability Check ---
-
-                # Use the validated/original ID for further checks and dict keys
-                vest_id = original_vest_id if is_existing_row else vest_id_edited
-
-                # Basic Validation (using vest_id)
-                if not vest_id or pd.isna(vest_id):
-                    error_messages.append(f"Row {index+1}: Vest ID cannot be empty.")
-                    validation_passed = False
-                    continue # Skip further processing if ID is invalid
-                if vest_id in edited_vest_ids:
-                    error_messages.append(f"Row {index+1}: Duplicate Vest ID '{vest_id}' found for this grant. Please ensure Vest IDs are unique within Grant '{selected_grant_id}'.")
-                    # Continue validation for other fields if needed
-
-                # Other field validations
-                vest_date_val = row["Vest Date"].date() if isinstance(row["Vest Date"], pd.Timestamp) else row["Vest Date"]
-                shares_val = int(row["Shares Vested"]) if not pd.isna(row["Shares Vested"]) else None
-                price_val = float(row["Vest Price"]) if not pd.isna(row["Vest Price"]) else None
-                tax_rate_pct_val = float(row["Tax Rate at Vest (%)"]) if not pd.isna(row["Tax Rate at Vest (%)"]) else None
-
-                if pd.isna(vest_date_val) or shares_val is None or shares_val < 1 or price_val is None or price_val < 0 or tax_rate_pct_val is None or tax_rate_pct_val < 0 or tax_rate_pct_val > 100:
-                    error_messages.append(f"Row {index+1} (Vest ID: {vest_id}): Missing or invalid required fields (Vest Date, Shares Vested >= 1, Vest Price >= 0, Tax Rate >= 0 and <= 100).")
-                    validation_passed = False
-                    # Do not continue if basic fields invalid
-
-                # Only add valid IDs to the set
-                if validation_passed or vest_id not in edited_vest_ids:
-                    edited_vest_ids.add(vest_id)
-
-                # If validation for this row passed...
-                if validation_passed:
-                    # Prepare vest data dictionary
-                    tax_rate = tax_rate_pct_val / 100.0
-                    tax_at_vest = calculate_tax_at_vest(shares_val, price_val, tax_rate)
-
-                    vest_data = {
-                        "vest_id": vest_id,
-                        "vest_date": vest_date_val,
-                        "shares_vested": shares_val,
-                        "vest_price": price_val,
-                        "tax_rate_vest": tax_rate,
-                        "tax_at_vest": tax_at_vest, # Store calculated tax
-                    }
-                    edited_vests_list.append(vest_data) # Add to the list of vests to keep/add
+            if price_store is not None:
+                edited_vest_df = fill_editor_prices(edited_vest_df, "Vest Price", "Vest Date", grant["symbol"], price_store)
+
+            # --- Validation ---
+            errors = validate_vests(vests_df_orig, edited_vest_df, selected_grant_id)
 
             # --- Final State Update Decision ---
-            if not validation_passed:
-                for msg in error_messages:
+            if not blocking_errors(errors).empty:
+                for msg in errors["message"]:
                     st.error(msg)
                 st.warning(f"Changes for Grant '{selected_grant_id}' vests not saved due to validation errors.")
             else:
-                # Update the 'vests' list for the specific grant in session state only if all rows are valid
-                grant["vests"] = edited_vests_list
+                # Rows with a duplicate Vest ID are left out; the rest of the table is saved
+                for msg in errors["message"]:
+                    st.warning(msg)
+                edited_vest_df = saved_rows(edited_vest_df, errors)
+                # Update the vests of the specific grant in session state only if all rows are valid and something changed
+                # Only inserted/updated rows are rebuilt and recalculated; unchanged vests keep their stored rows
+                changes = diff_editor_rows(vests_df_orig, edited_vest_df)
+                if has_changes(changes):
+                    def build_vests(rows):
+                        # tax_at_vest is calculated for all changed rows at once
+                        vest_rows = derive_vest_fields(pd.DataFrame({
+                            "vest_id": rows["Vest ID"],
+                            "vest_date": date_column(rows["Vest Date"]),
+                            "shares_vested": rows["Shares Vested"].astype(int),
+                            "vest_price": rows["Vest Price"].astype(float),
+                            "tax_rate_vest": rows["Tax Rate at Vest (%)"].astype(float) / 100.0,
+                        }).to_dict("records"))
+                        return [keep_lot_currency(row, portfolio.vest(selected_grant_id, row["vest_id"])) for row in vest_rows]
+
+                    original_vests = list(portfolio.vests.get(selected_grant_id, {}).values())
+                    portfolio = portfolio.with_vests(selected_grant_id, editor_rows(edited_vest_df, changes, original_vests, build_vests))
+                    # Sales drawn from updated or deleted vests need their derived fields refreshed
+                    affected_vest_ids = {original_vests[i]["vest_id"] for i in changes.updated + changes.deleted}
+                    affected_sales = [sale for vest_id in affected_vest_ids for sale in portfolio.sales_for_vest(selected_grant_id, vest_id)]
+                    if affected_sales:
+                        portfolio = portfolio.with_sales(selected_grant_id, derive_sale_fields(selected_grant_id, affected_sales, portfolio.vests[selected_grant_id]))
+                    if portfolio.is_foreign(selected_grant_id):
+                        # Taxes of lots priced in another currency are calculated from AUD prices
+                        portfolio = portfolio.with_derived_fields([selected_grant_id])
+                    set_portfolio(portfolio)
                 # Optional: Success message (might be noisy)
                 # st.success(f"Vests for grant '{selected_grant_id}' updated!")
 
     st.write("---")
 
 
+@timed
 def add_sale_form():
     with st.expander("Add/Edit Sales", expanded=not st.session_state.get("data_loaded", False)):
-        if "grants" not in st.session_state or not st.session_state["grants"]:
+        portfolio = st.session_state.get("portfolio")
+        if not portfolio:
             st.warning("No grants available. Please add a grant first.")
             return
 
-        grant_options = {g["grant_id"]: g for g in st.session_state["grants"] if g.get("vests")} # Only grants with vests
+        grant_options = {grant_id: grant for grant_id, grant in portfolio.grants.items() if portfolio.vests.get(grant_id)} # Only grants with vests
         if not grant_options:
              st.warning("No grants with vests available to add sales to.")
              return
@@ -333,7 +405,7 @@ def add_sale_form():
              st.error("Selected grant not found.") # Should not happen
              return
 
-        vest_options = {v["vest_id"]: v for v in selected_grant.get("vests", [])}
+        vest_options = portfolio.vests[selected_grant_id]
         if not vest_options:
             st.warning(f"Grant '{selected_grant_id}' has no vests to associate sales with.")
             return
@@ -350,7 +422,7 @@ def add_sale_form():
             st.error("Selected vest not found.") # Should not happen
             return
 
-        st.info(f"Add, edit, or delete sales associated with Vest ID '{selected_vest_id}' (Grant ID: '{selected_grant_id}') directly in the table below. Ensure 'Sale ID' is unique within this grant.")
+        st.info(f"Add, edit, or delete sales associated with Vest ID '{selected_vest_id}' (Grant ID: '{selected_grant_id}') directly in the table below. Ensure 'Sale ID' is unique within this vest.")
 
         # Prepare data for the editor - ONLY for the selected grant and vest
         sale_data_for_editor = [
@@ -364,10 +436,13 @@ def add_sale_form():
                 # "Capital Gains": sale.get("capital_gains"),
                 # "Tax at Sale": sale.get("capital_gains_tax") # Or calculated tax
             }
-            for sale in selected_grant.get("sales", []) if sale.get("vest_id") == selected_vest_id
+            for sale in portfolio.sales_for_vest(selected_grant_id, selected_vest_id)
         ]
         sales_df_orig = pd.DataFrame(sale_data_for_editor)
 
+        # With a price history loaded, a blank Sale Price is filled with the close on the sale date
+        price_store = st.session_state.get("price_store")
+
         edited_sales_df = st.data_editor(
             sales_df_orig,
             key=f"sales_editor_{selected_grant_id}_{selected_vest_id}", # Unique key per grant-vest
@@ -376,197 +451,90 @@ def add_sale_form():
                 "Sale ID": st.column_config.TextColumn(required=True),
                 "Sale Date": st.column_config.DateColumn(required=True),
                 "Shares Sold": st.column_config.NumberColumn(required=True, min_value=1, step=1),
-                "Sale Price": st.column_config.NumberColumn(required=True, min_value=0.0, format="%.2f"),
+                "Sale Price": st.column_config.NumberColumn(required=price_store is None, min_value=0.0, format="%.2f"),
                 "Tax Rate at Sale (%)": st.column_config.NumberColumn(required=True, min_value=0.0, max_value=100.0, format="%.2f"),
             },
             use_container_width=True
         )
 
-        # --- State Update Logic ---
-        # Get the original sales for this specific vest for comparison
-        original_sales_dict = {s["sale_id"]: s for s in selected_grant.get("sales", []) if s.get("vest_id") == selected_vest_id}
-        edited_sales_list_for_vest = []
-        edited_sale_ids = set()
-        validation_passed = True
-        error_messages = []
+        if price_store is not None:
+            edited_sales_df = fill_editor_prices(edited_sales_df, "Sale Price", "Sale Date", selected_grant["symbol"], price_store)
 
-        # Get vest details needed for calculations
-        vest_price = selected_vest["vest_price"]
+        # --- Validation ---
+        # Get vest details needed for validation
         vest_date = selected_vest["vest_date"]
-
-        for index, row in edited_sales_df.iterrows():
-            sale_id_edited = row["Sale ID"]
-            is_existing_row = index < len(sales_df_orig)
-
-            # --- ID Immutability Check ---
-            if is_existing_row:
-                original_sale_id = sales_df_orig.loc[index, "Sale ID"]
-                if sale_id_edited != original_sale_id:
-                    error_messages.append(f"Row {index+1}: Cannot change the Sale ID ('{original_sale_id}' to '{sale_id_edited}') of an existing sale. Delete and re-add if necessary.")
-                    validation_passed = False
-                    # Continue validation for other fields if needed
-            # --- End ID Immutability Check ---
-
-            # Use the validated/original ID for further checks and dict keys
-            sale_id = original_sale_id if is_existing_row else sale_id_edited
-
-            # Basic Validation (using sale_id)
-            if not sale_id or pd.isna(sale_id):
-                error_messages.append(f"Row {index+1}: Sale ID cannot be empty.")
-                validation_passed = False
-                continue # Skip further processing if ID is invalid
-            if sale_id in edited_sale_ids:
-                error_messages.append(f"Row {index+1}: Duplicate Sale ID '{sale_id}' found for this vest. Please ensure Sale IDs are unique within Grant '{selected_grant_id}' / Vest '{selected_vest_id}'.")
-                # Continue validation for other fields if needed
-
-            # Other field validations
-            sale_date_obj = row["Sale Date"].date() if isinstance(row["Sale Date"], pd.Timestamp) else row["Sale Date"]
-            shares_val = int(row["Shares Sold"]) if not pd.isna(row["Shares Sold"]) else None
-            sale_price_val = float(row["Sale Price"]) if not pd.isna(row["Sale Price"]) else None
-            tax_rate_pct_val = float(row["Tax Rate at Sale (%)"]) if not pd.isna(row["Tax Rate at Sale (%)"]) else None
-
-            if pd.isna(sale_date_obj) or shares_val is None or shares_val < 1 or sale_price_val is None or sale_price_val < 0 or tax_rate_pct_val is None or tax_rate_pct_val < 0 or tax_rate_pct_val > 100:
-                error_messages.append(f"Row {index+1} (Sale ID: {sale_id}): Missing or invalid required fields (Sale Date, Shares Sold >= 1, Sale Price >= 0, Tax Rate >= 0 and <= 100).")
-                validation_passed = False
-                # Do not continue if basic fields invalid
-            elif sale_date_obj < vest_date:
-                 error_messages.append(f"Row {index+1} (Sale ID: {sale_id}): Sale Date ({sale_date_obj}) cannot be before Vest Date ({vest_date}).")
-                 validation_passed = False
-                 # Do not continue if date invalid
-
-            # Only add valid IDs to the set
-            if validation_passed or sale_id not in edited_sale_ids:
-                edited_sale_ids.add(sale_id)
-
-            # If validation for this row passed...
-            if validation_passed:
-                # Prepare sale data dictionary and calculate derived fields
-                tax_rate = tax_rate_pct_val / 100.0
-                holding_period = (sale_date_obj - vest_date).days
-                held_over_year = holding_period > 365
-
-                capital_gains = calculate_gains_at_sale(sale_price_val, vest_price, shares_val)
-                capital_gains_tax = calculate_capital_gains_tax(sale_price_val, vest_price, shares_val, tax_rate, held_over_year, holding_period)
-                tax_within_30_days = None
-                if holding_period <= 30:
-                    tax_within_30_days = calculate_tax_at_vest(shares_val, sale_price_val, tax_rate) # Note: Using sale price as per original logic if sold within 30 days
-
-                sale_data = {
-                    "sale_id": sale_id,
-                    "vest_id": selected_vest_id, # Explicitly link to the selected vest
-                    "sale_date": sale_date_obj,
-                    "shares_sold": shares_val,
-                    "sale_price": sale_price_val,
-                    "vest_date": vest_date, # Store associated vest date for reference/calcs
-                    "tax_rate_sale": tax_rate,
-                    "capital_gains": capital_gains,
-                    "capital_gains_tax": capital_gains_tax,
-                }
-                if tax_within_30_days is not None:
-                     sale_data["tax_within_30_days"] = tax_within_30_days
-
-                edited_sales_list_for_vest.append(sale_data) # Add to the list of sales to keep/add for this vest
+        errors = validate_sales(sales_df_orig, edited_sales_df, selected_grant_id, selected_vest_id, vest_date)
 
         # --- Final State Update Decision ---
-        if not validation_passed:
-            for msg in error_messages:
+        if not blocking_errors(errors).empty:
+            for msg in errors["message"]:
                 st.error(msg)
             st.warning(f"Changes for Grant '{selected_grant_id}', Vest '{selected_vest_id}' sales not saved due to validation errors.")
         else:
-            # Update the 'sales' list for the specific grant in session state only if all rows are valid
-            # Filter out sales related to the current vest and replace with the edited list
-            other_sales = [s for s in selected_grant.get("sales", []) if s.get("vest_id") != selected_vest_id]
-            selected_grant["sales"] = other_sales + edited_sales_list_for_vest
+            # Rows with a duplicate Sale ID are left out; the rest of the table is saved
+            for msg in errors["message"]:
+                st.warning(msg)
+            edited_sales_df = saved_rows(edited_sales_df, errors)
+            # Update the sales of the specific vest in session state only if all rows are valid and something changed
+            # Only inserted/updated rows are rebuilt and recalculated; unchanged sales keep their stored rows
+            changes = diff_editor_rows(sales_df_orig, edited_sales_df)
+            if has_changes(changes):
+                def build_sales(rows):
+                    # Capital gains, capital gains tax and the 30-day rule are calculated for all changed rows at once
+                    sale_rows = pd.DataFrame({
+                        "sale_id": rows["Sale ID"],
+                        "vest_id": selected_vest_id, # Explicitly link to the selected vest
+                        "sale_date": date_column(rows["Sale Date"]),
+                        "shares_sold": rows["Shares Sold"].astype(int),
+                        "sale_price": rows["Sale Price"].astype(float),
+                        "vest_date": vest_date, # Store associated vest date for reference/calcs
+                        "tax_rate_sale": rows["Tax Rate at Sale (%)"].astype(float) / 100.0,
+                    }).to_dict("records")
+                    sale_rows = [keep_lot_currency(row, portfolio.sale(selected_grant_id, selected_vest_id, row["sale_id"])) for row in sale_rows]
+                    return derive_sale_fields(selected_grant_id, sale_rows, {selected_vest_id: selected_vest})
+
+                original_sales = portfolio.sales_for_vest(selected_grant_id, selected_vest_id)
+                edited_sales = editor_rows(edited_sales_df, changes, original_sales, build_sales)
+                # The grant's sales for other vests are kept as they are
+                portfolio = portfolio.with_vest_sales(selected_grant_id, selected_vest_id, edited_sales)
+                if portfolio.is_foreign(selected_grant_id):
+                    # Taxes of lots priced in another currency are calculated from AUD prices
+                    portfolio = portfolio.with_derived_fields([selected_grant_id])
+                set_portfolio(portfolio)
             # Optional: Success message
             # st.success(f"Sales for grant '{selected_grant_id}', vest '{selected_vest_id}' updated!")
 
     st.write("---")
 
 
+@st.cache_resource
+def shared_view_cache(max_bytes):
+    return ResultCache(max_bytes)
+
+def view_cache():
+    """Cache of built charts and tables shared by every session, keyed by the portfolio fingerprint."""
+    return shared_view_cache(_megabytes(SHARED_CACHE_MAX_MB_ENV, SHARED_MAX_BYTES))
+
+
+@timed
 def add_summary_section():
     st.header("Summary")
-    if "grants" not in st.session_state or not st.session_state["grants"]:
+    portfolio = st.session_state.get("portfolio")
+    if not portfolio:
         st.warning("No data available. Add grants, vests, and sales to see the summary.")
         return
 
     # Display the Sales Table in the Summary section
     # st.write("**Sales Table**")
-    sale_data = []
-    for grant in st.session_state["grants"]:
-        for sale in grant.get("sales", []):
-            # Find the corresponding vest first
-            try:
-                vest = next(v for v in grant["vests"] if v["vest_id"] == sale["vest_id"])
-            except StopIteration:
-                st.error(f"Data inconsistency: Vest ID '{sale.get('vest_id')}' not found for Sale ID '{sale.get('sale_id')}' in Grant '{grant.get('grant_id')}'. Skipping this sale in summary.")
-                continue # Skip this sale if its vest is missing
-
-            # Ensure tax_at_vest is calculated if missing (Defensive check)
-            if "tax_at_vest" not in vest:
-                 vest["tax_at_vest"] = calculate_tax_at_vest(
-                     vest.get("shares_vested", 0), # Use .get for safety
-                     vest.get("vest_price", 0),
-                     vest.get("tax_rate_vest", 0)
-                 )
-                 # Note: This calculation might happen multiple times if multiple sales link to the same vest, but it's idempotent.
-
-            # Ensure capital_gains_tax and capital_gains are calculated if missing (Defensive check)
-            if "capital_gains_tax" not in sale or "capital_gains" not in sale:
-                holding_period = (sale["sale_date"] - vest["vest_date"]).days
-                held_over_year = holding_period > 365
-                sale["capital_gains_tax"] = calculate_capital_gains_tax(
-                    sale.get("sale_price", 0),
-                    vest.get("vest_price", 0),
-                    sale.get("shares_sold", 0),
-                    sale.get("tax_rate_sale", 0),
-                    held_over_year,
-                    holding_period,
-                )
-                sale["capital_gains"] = calculate_gains_at_sale(
-                    sale.get("sale_price", 0),
-                    vest.get("vest_price", 0),
-                    sale.get("shares_sold", 0)
-                )
-                # Also recalculate tax_within_30_days if applicable, as it depends on sale price
-                if holding_period <= 30:
-                    sale["tax_within_30_days"] = calculate_tax_at_vest(
-                        sale.get("shares_sold", 0),
-                        sale.get("sale_price", 0),
-                        sale.get("tax_rate_sale", 0)
-                    )
-
-
-            # Now calculate tax_at_sale using the guaranteed keys
-            holding_period = (sale["sale_date"] - vest["vest_date"]).days # Re-calc or use stored
-            if holding_period <= 30 and "tax_within_30_days" in sale:
-                tax_at_sale = sale["tax_within_30_days"]
-            else:
-                # Use .get for safety, defaulting to 0 if somehow still missing
-                tax_at_sale = sale.get("capital_gains_tax", 0)
-
-            # Append data using guaranteed keys (and .get for extra safety on calculated fields)
-            sale_data.append({
-                "Grant ID": grant["grant_id"],
-                "Grant Date": grant["grant_date"],
-                "Vest ID": vest["vest_id"],
-                "Vest Date": vest["vest_date"],
-                "Vest Price": vest.get("vest_price", 0),
-                "Tax Rate at Vest (%)": vest.get("tax_rate_vest", 0) * 100,
-                "Total vest proceeds" : vest.get("vest_price", 0) * sale.get("shares_sold", 0),
-                "Tax at Vest": vest.get("tax_at_vest", 0), # Now guaranteed by check above
-                "Vest proceeds after taxes" : (vest.get("vest_price", 0) * sale.get("shares_sold", 0) ) - vest.get("tax_at_vest", 0),
-                "Sale ID": sale["sale_id"],
-                "Sale Date": sale["sale_date"],
-                "Shares Sold": sale.get("shares_sold", 0),
-                "Sale Price": sale.get("sale_price", 0),
-                "Tax Rate at Sale (%)": sale.get("tax_rate_sale", 0) * 100,
-                "Total sale proceeds": sale.get("capital_gains", 0), # Guaranteed by check above
-                "Tax at Sale": tax_at_sale,
-                "Sale proceeds after taxes": sale.get("capital_gains", 0) - tax_at_sale,
-                "Net Gain" : ((vest.get("vest_price", 0) * sale.get("shares_sold", 0) ) - vest.get("tax_at_vest", 0)) + (sale.get("capital_gains", 0) - tax_at_sale)
-            })
-
-    sales_df = pd.DataFrame(sale_data) if sale_data else pd.DataFrame() # Handle empty case
+    # The summary is a view over the shared lot facts table (built once per data version)
+    facts = lot_facts(portfolio)
+    # Missing vests, oversold vests and over-vested grants, re-checked only for edited grants
+    issues = reconcile(portfolio)
+    for message in issues["message"][:LEDGER_ISSUE_LIMIT]:
+        st.error(message)
+    if len(issues) > LEDGER_ISSUE_LIMIT:
+        st.error(f"... and {len(issues) - LEDGER_ISSUE_LIMIT} more data inconsistencies.")
+    sales_df = view_cache().get_or_build(("summary_table", portfolio.fingerprint()), lambda: build_summary_table(facts))
     st.dataframe(sales_df,
         column_config={
             "Vest Price": st.column_config.NumberColumn(
@@ -586,15 +554,165 @@ def add_summary_section():
     )
     #st.dataframe(sales_df)
 
+    # Per financial year, served from the per-year rollups
+    years = tax_years(portfolio)
+    if years:
+        st.subheader("Financial Year")
+        col1, col2 = st.columns(2)
+        tax_year = col1.selectbox("Financial Year", options=years, index=len(years) - 1, key="summary_tax_year")
+        by = col2.radio("Totals by", options=["grant_id", "symbol"], format_func={"grant_id": "Grant", "symbol": "Symbol"}.get, horizontal=True, key="summary_tax_year_by")
+        totals, table = tax_year_summary(portfolio, tax_year, by)
+        for col, name in zip(st.columns(5), ["Tax at Vest", "Tax at Sale", "Capital Gains", "Capital Losses", "Net Gain"]):
+            col.metric(name, f"${totals[name]:,.2f}")
+        money = st.column_config.NumberColumn(format="$ %.2f")
+        st.dataframe(table, column_config={name: money for name in ["Tax at Vest", "Tax at Sale", "Capital Gains", "Capital Losses", "Net Gain"]}, hide_index=True)
+
+@timed
+def add_what_if_section():
+    st.header("Unsold Shares")
+    portfolio = st.session_state.get("portfolio")
+    lots = open_lots(portfolio) if portfolio else None
+    if lots is None or lots.empty:
+        st.info("No unsold shares. Shares vested but not yet sold will appear here.")
+        return
+
+    st.dataframe(lots, hide_index=True)
+    # Scenarios are priced in AUD: vest prices of lots in other currencies are the converted ones
+    if any(portfolio.is_foreign(grant_id) for grant_id in lots["grant_id"].unique()):
+        st.caption(f"Vest prices of lots priced in other currencies are shown in {BASE_CURRENCY}, converted at the vest date's rate. Enter sale prices below in {BASE_CURRENCY} too.")
+
+    with st.expander("What-if Sale Scenarios"):
+        st.info("Tax and net proceeds of selling all unsold shares of a symbol at a grid of sale dates and prices, using the same 30-day and CGT discount rules as recorded sales.")
+        symbol = st.selectbox("Symbol", options=sorted(lots["symbol"].unique()), key="what_if_symbol")
+        symbol_lots = lots[lots["symbol"] == symbol]
+        reference_price = float(symbol_lots["vest_price"].mean())
+
+        col1, col2, col3 = st.columns(3)
+        min_price = col1.number_input(f"Lowest Sale Price ({BASE_CURRENCY})", min_value=0.0, value=round(reference_price * 0.5, 2), key="what_if_min_price")
+        max_price = col2.number_input(f"Highest Sale Price ({BASE_CURRENCY})", min_value=0.0, value=round(reference_price * 1.5, 2), key="what_if_max_price")
+        price_steps = col3.number_input("Price Steps", min_value=2, max_value=500, value=100, step=1, key="what_if_price_steps")
+        col1, col2, col3 = st.columns(3)
+        first_date = col1.date_input("First Sale Date", value=datetime.today().date(), key="what_if_first_date")
+        months = col2.number_input("Months", min_value=1, max_value=120, value=24, step=1, key="what_if_months")
+        tax_rate = col3.number_input("Tax Rate (%)", min_value=0.0, max_value=100.0, value=round(float(symbol_lots["tax_rate_vest"].median()) * 100, 2), key="what_if_tax_rate")
+
+        sale_prices = np.linspace(min_price, max(min_price, max_price), int(price_steps))
+        sale_dates = pd.date_range(first_date, periods=int(months), freq=pd.DateOffset(months=1))
+        key = ("what_if_grid", portfolio.fingerprint(), symbol, min_price, max_price, int(price_steps), first_date, int(months), tax_rate)
+        grid = view_cache().get_or_build(key, lambda: what_if_grid(symbol_lots, sale_prices, sale_dates, tax_rate / 100.0))
+
+        value = st.radio("Show", options=["net_proceeds", "tax", "capital_gains"], horizontal=True, key="what_if_value", format_func=lambda v: v.replace("_", " ").title())
+        st.plotly_chart(plot_what_if_grid(grid, value, title=f"What-if Sale of {symbol}: {value.replace('_', ' ').title()}"))
+
+    with st.expander("Plan a Sale"):
+        st.info("Which vests a sale should draw from. Lowest Tax finds the allocation with the least tax under the 30-day and CGT discount rules; the other strategies are shown for comparison.")
+        symbol = st.selectbox("Symbol", options=sorted(lots["symbol"].unique()), key="plan_symbol")
+        symbol_lots = lots[lots["symbol"] == symbol]
+
+        col1, col2 = st.columns(2)
+        shares = col1.number_input("Shares to Sell", min_value=1, max_value=int(symbol_lots["remaining_shares"].sum()), value=int(symbol_lots["remaining_shares"].sum()), step=1, key="plan_shares")
+        sale_date = col2.date_input("Sale Date", value=datetime.today().date(), key="plan_sale_date")
+        col1, col2 = st.columns(2)
+        sale_price = col1.number_input(f"Sale Price ({BASE_CURRENCY})", min_value=0.0, value=round(float(symbol_lots["vest_price"].mean()), 2), key="plan_sale_price")
+        tax_rate = col2.number_input("Tax Rate (%)", min_value=0.0, max_value=100.0, value=round(float(symbol_lots["tax_rate_vest"].median()) * 100, 2), key="plan_tax_rate")
+
+        try:
+            comparison = compare_sale_strategies(symbol_lots, int(shares), sale_date, sale_price, tax_rate / 100.0)
+        except ValueError as e:
+            st.error(str(e))
+            return
+        st.dataframe(comparison.drop(columns="strategy"), hide_index=True)
+
+        strategy = st.radio("Lots for", options=list(SALE_STRATEGIES), format_func=SALE_STRATEGIES.get, horizontal=True, key="plan_strategy")
+        st.dataframe(plan_sale(symbol_lots, int(shares), sale_date, sale_price, tax_rate / 100.0, strategy), hide_index=True)
+
+# --- Visualizations ---
+# One function per view; a view is built only when it is opened and kept in the
+# view cache until the data changes.
+
+@timed
+def show_tax_breakdown(cache, portfolio):
+    # Large portfolios are drawn aggregated; a year can be drilled into
+    tax_year = None
+    if chart_rows(portfolio) > CHART_DETAIL_LIMIT:
+        tax_year = st.selectbox("Tax Breakdown for", options=[None] + tax_years(portfolio), format_func=lambda y: y or "All Years", key="chart_tax_year")
+    tax_breakdown_fig = cached_view(cache, plot_tax_breakdown, portfolio, tax_year)
+    if tax_breakdown_fig:
+        st.plotly_chart(tax_breakdown_fig)
+        tax_breakdown_table = cached_view(cache, generate_tax_breakdown_table, portfolio)
+        if tax_breakdown_table is not None:
+            st.write("**Tax type breakdown by Australian Financial year table**")
+            st.dataframe(tax_breakdown_table)
+
+@timed
+def show_capital_gains(cache, portfolio):
+    capital_gains_fig = cached_view(cache, plot_capital_gains_by_vest, portfolio)
+    if capital_gains_fig:
+        st.plotly_chart(capital_gains_fig)
+        capital_gains_table = cached_view(cache, generate_capital_gains_table, portfolio)
+        if capital_gains_table is not None:
+            st.write("**Capital Gains/Loss Table by Australian Financial year table**")
+            st.dataframe(capital_gains_table)
+
+@timed
+def show_net_gains(cache, portfolio):
+    net_gains_fig = cached_view(cache, plot_net_gains, portfolio)
+    if net_gains_fig:
+        st.plotly_chart(net_gains_fig)
+        net_gains_table = cached_view(cache, generate_net_gains_table, portfolio)
+        if net_gains_table is not None:
+            st.write("**Gains vs Taxes by Australian Financial year Table**")
+            st.dataframe(net_gains_table)
+
+@timed
+def show_stock_performance(cache, portfolio):
+    # Large portfolios are drawn aggregated; a grant can be drilled into
+    grant_id = None
+    if chart_rows(portfolio) > CHART_DETAIL_LIMIT:
+        grant_id = st.selectbox("Stock Performance for", options=[None] + list(portfolio.grants), format_func=lambda g: g or "All Grants", key="chart_grant_id")
+    stock_performance_fig = cached_view(cache, plot_stock_performance, portfolio, grant_id)
+    if stock_performance_fig:
+        st.plotly_chart(stock_performance_fig)
+        stock_performance_table = cached_view(cache, generate_stock_performance_table, portfolio)
+        if stock_performance_table is not None:
+            st.write("**Stock Performance (Vest Price vs. Sale Price) table**")
+            st.dataframe(stock_performance_table)
+
+@timed
+def show_rsu_details(cache, portfolio):
+    display_rsu_details_table(portfolio, cache)
+    if portfolio:
+        display_totals(portfolio)
+
+VISUALIZATIONS = {
+    "Tax Breakdown": show_tax_breakdown,
+    "Capital Gains": show_capital_gains,
+    "Net Gains": show_net_gains,
+    "Stock Performance": show_stock_performance,
+    "RSU Details": show_rsu_details,
+}
+
 def main():
+    # Stage timings of this rerun, shown with ?debug=1 (?debug=memory also traces peak allocations)
+    debug = st.query_params.get("debug")
+    if debug:
+        profiling.start(trace_memory=debug == "memory")
+    try:
+        render_app(debug)
+    finally:
+        # Streamlit ends an interrupted rerun by raising in its thread and runs the next
+        # one on another, so the recorder (and tracemalloc) is stopped here or never
+        profiling.stop()
+
+def render_app(debug):
     st.title("Aussie RSU Tax Calculator")
 
     # st.markdown("***This web app allows you to load RSU/Stocks data and calculate taxes for Australian financial year. Data is stored in the browser session so no data is sent back to server. As always, use at your own risk and this is not a financial advice at all.***")
     st.markdown("*Sample data available at:* ***https://raw.githubusercontent.com/binaryzer0/rsu-calculator/main/sample.json***")
     
 
-    if "grants" not in st.session_state:
-        st.session_state["grants"] = []
+    if "portfolio" not in st.session_state:
+        st.session_state["portfolio"] = Portfolio()
   
     # Sidebar details
     st.sidebar.header("About This App")
@@ -612,7 +730,7 @@ def main():
                 Visualize your tax breakdown, capital gains, and stock performance with interactive charts.
                 Stay in control of your RSU strategy and maximize your financial outcomes—all in one place.
                 Data is stored in the browser session so no data is sent back to server.
-                All values are assumed in a single currency.<br><br>
+                Values are in AUD unless a grant names another currency; load FX rates to convert them.<br><br>
                 As always, use at your own risk and this is not a financial advice at all.
         </div>
         """,
@@ -625,11 +743,16 @@ def main():
     #     "Visualize your tax breakdown, capital gains, and stock performance with interactive charts. "
     #     "Stay in control of your RSU strategy and maximize your financial outcomes—all in one place."
     #     "Data is stored in the browser session so no data is sent back to server."
-    #     "All values are assumed in a single currency.\n\n"
+    #     "Values are in AUD unless a grant names another currency; load FX rates to convert them.\n\n"
     #     "As always, use at your own risk and this is not a financial advice at all."
     # )
     # https://buymeacoffee.com/binaryzer0
 
+    # Portfolios kept in a local SQLite file, when one is configured
+    store = open_store()
+    if store is not None:
+        add_store_section(store)
+
     # Add a button to load sample data
     st.sidebar.header("Try it")
     if st.sidebar.button("Load Sample Data"):
@@ -637,11 +760,35 @@ def main():
     
     # Export/Import functionality
     st.sidebar.header("Export/Import Data")
-    export_data(st.session_state["grants"])
+    export_data(st.session_state["portfolio"])
     imported_data = import_data()
     if imported_data:
-        st.session_state["grants"] = imported_data
+        set_portfolio(imported_data)
         st.session_state["data_loaded"] = True
+    # Vest and sale activity from broker CSV exports
+    imported_statements = import_broker_statements()
+    if imported_statements:
+        set_portfolio(imported_statements)
+
+    # Local price history, used to fill in missing vest and sale prices
+    st.sidebar.header("Price History")
+    price_store = import_price_history()
+    if price_store is not None and st.sidebar.button("Fill Missing Prices"):
+        portfolio, vests_filled, sales_filled = backfill_prices(st.session_state["portfolio"], price_store)
+        set_portfolio(portfolio)
+        st.sidebar.success(f"Filled {vests_filled} vest and {sales_filled} sale prices from the price history.")
+
+    # Local FX rates: prices of grants in other currencies are converted to AUD before any tax is calculated
+    st.sidebar.header("FX Rates")
+    fx_store = import_fx_rates()
+    if fx_store is not st.session_state["portfolio"].fx:
+        # Saves the recalculated taxes; not recorded, as loading rates is no edit to undo (undo keeps the rates)
+        set_portfolio(st.session_state["portfolio"].with_fx(fx_store), record=False)
+    if st.session_state["portfolio"]:
+        missing = missing_fx_rates(st.session_state["portfolio"].lot_tables())
+        if missing:
+            examples = ", ".join(f"{currency} on {day}" for currency, day in missing[:3])
+            st.sidebar.warning(f"No FX rate for {len(missing)} lot date(s) ({examples}{', ...' if len(missing) > 3 else ''}). Their taxes are left blank.")
     
     st.sidebar.markdown("### ☕ Support This Project")
     st.sidebar.markdown(
@@ -656,6 +803,7 @@ def main():
     )
 
     # Add Grant, Vest, and Sale forms
+    add_history_controls()
     add_grant_form()
     add_vest_form()
     add_sale_form()
@@ -663,44 +811,29 @@ def main():
     # Add Summary section
     add_summary_section()
 
+    # Unsold shares and what-if sales
+    add_what_if_section()
+
     # Display graphs
     st.header("Visualizations")
-
-    # Tax Breakdown
-    tax_breakdown_fig = plot_tax_breakdown(st.session_state.get("grants", []))
-    if tax_breakdown_fig:
-        st.plotly_chart(tax_breakdown_fig)
-        tax_breakdown_table = generate_tax_breakdown_table(st.session_state.get("grants", []))
-        if tax_breakdown_table is not None:
-            st.write("**Tax type breakdown by Australian Financial year table**")
-            st.dataframe(tax_breakdown_table)
-
-    # Capital Gains by Vest
-    capital_gains_fig = plot_capital_gains_by_vest(st.session_state.get("grants", []))
-    if capital_gains_fig:
-        st.plotly_chart(capital_gains_fig)
-        capital_gains_table = generate_capital_gains_table(st.session_state.get("grants", []))
-        if capital_gains_table is not None:
-            st.write("**Capital Gains/Loss Table by Australian Financial year table**")
-            st.dataframe(capital_gains_table)
-
-    # Net Gains
-    net_gains_fig = plot_net_gains(st.session_state.get("grants", []))
-    if net_gains_fig:
-        st.plotly_chart(net_gains_fig)
-        net_gains_table = generate_net_gains_table(st.session_state.get("grants", []))
-        if net_gains_table is not None:
-            st.write("**Gains vs Taxes by Australian Financial year Table**")
-            st.dataframe(net_gains_table)
-
-    # Stock Performance
-    stock_performance_fig = plot_stock_performance(st.session_state.get("grants", []))
-    if stock_performance_fig:
-        st.plotly_chart(stock_performance_fig)
-        stock_performance_table = generate_stock_performance_table(st.session_state.get("grants", []))
-        if stock_performance_table is not None:
-            st.write("**Stock Performance (Vest Price vs. Sale Price) table**")
-            st.dataframe(stock_performance_table)
+    # Figures and tables are rebuilt only when the portfolio content changes
+    cache = view_cache()
+    portfolio = st.session_state["portfolio"]
+    # Like tabs, but only the open view is built
+    view = st.radio("View", options=list(VISUALIZATIONS), horizontal=True, key="visualization", label_visibility="collapsed")
+    VISUALIZATIONS[view](cache, portfolio)
+
+    # Keep the session within its memory budget
+    history = edit_history()
+    freed = enforce_budget(portfolio, history, _megabytes(SESSION_MAX_MB_ENV, DEFAULT_SESSION_MAX_BYTES))
+
+    # Cache counters and stage timings, shown when the app is opened with ?debug=1
+    if debug:
+        with st.sidebar.expander("Cache statistics"):
+            st.json({"views": cache.stats(), "portfolios": shared_portfolios().stats()})
+        with st.sidebar.expander("Session memory"):
+            st.json({**session_footprint(portfolio, history), "freed": freed})
+        display_stage_timings(profiling.stop())
 
 if __name__ == "__main__":
     main()
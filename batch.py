@@ -0,0 +1,122 @@
+# batch.py
+# Headless batch runner: computes taxes for many portfolio files (JSON or Parquet
+# exports) across a process pool, without streamlit.
+#
+# Writes to the output directory:
+#   file_tax_years.<fmt>  totals per file and Australian financial year
+#   tax_years.<fmt>       the same totals summed over all files
+#   summaries/<file>.<fmt> the Summary sales table of each file (with --summaries)
+#   stats.json            files/lots processed, failures and throughput
+#
+# Usage: python batch.py portfolios/*.json --out results [--format parquet] [--workers 8]
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from utils.facts import lot_facts, build_summary_table, tax_year_totals
+from utils.portfolio import Portfolio
+from utils.serialization import iter_file_grants
+
+OUTPUT_FORMATS = ("csv", "parquet")
+
+
+def write_table(df, path, output_format):
+    if output_format == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+def process_file(path, out_dir=None, output_format="csv"):
+    """Compute one portfolio file. Returns (per-tax-year totals, number of lots, error message).
+
+    If `out_dir` is given, the file's Summary sales table is written there.
+    """
+    try:
+        with open(path, "rb") as f:
+            # No with_derived_fields(): the fact table derives every tax from the inputs itself
+            portfolio = Portfolio.from_grants(iter_file_grants(f))
+        facts = lot_facts(portfolio)
+        if out_dir is not None:
+            name = os.path.splitext(os.path.basename(path))[0]
+            write_table(build_summary_table(facts), os.path.join(out_dir, f"{name}.{output_format}"), output_format)
+        totals = tax_year_totals(portfolio).reset_index()
+        totals.insert(0, "file", path)
+        return totals, len(facts), None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        # One bad file should not stop the nightly run
+        return None, 0, f"{type(e).__name__}: {e}"
+
+def _process(args):
+    return process_file(*args)
+
+def run(paths, out_dir, output_format="csv", workers=None, summaries=False):
+    """Process `paths` across `workers` processes and write the results to `out_dir`. Returns the stats dict."""
+    os.makedirs(out_dir, exist_ok=True)
+    summaries_dir = os.path.join(out_dir, "summaries") if summaries else None
+    if summaries_dir:
+        os.makedirs(summaries_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    tasks = [(path, summaries_dir, output_format) for path in paths]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = list(map(_process, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Hand out files in batches so small portfolios don't pay one round trip each
+            chunksize = max(1, len(tasks) // (workers * 4))
+            results = list(pool.map(_process, tasks, chunksize=chunksize))
+
+    file_totals = [totals for totals, _, _ in results if totals is not None]
+    if file_totals:
+        file_tax_years = pd.concat(file_totals, ignore_index=True)
+        tax_years = file_tax_years.drop(columns="file").groupby("tax_year", as_index=False).sum()
+    else:
+        file_tax_years = tax_years = pd.DataFrame(columns=["file", "tax_year"])
+    write_table(file_tax_years, os.path.join(out_dir, f"file_tax_years.{output_format}"), output_format)
+    write_table(tax_years, os.path.join(out_dir, f"tax_years.{output_format}"), output_format)
+    seconds = time.perf_counter() - start
+
+    lots = sum(num_lots for _, num_lots, _ in results)
+    errors = [{"file": path, "error": error} for path, (_, _, error) in zip(paths, results) if error]
+    stats = {
+        "files": len(paths),
+        "failed": len(errors),
+        "lots": lots,
+        "workers": workers,
+        "seconds": round(seconds, 3),
+        "files_per_second": round(len(paths) / seconds, 1) if seconds else None,
+        "lots_per_second": round(lots / seconds, 1) if seconds else None,
+        "errors": errors,
+    }
+    with open(os.path.join(out_dir, "stats.json"), "w") as f:
+        json.dump(stats, f, indent=2)
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute RSU taxes for many portfolio files.")
+    parser.add_argument("paths", nargs="+", help="Portfolio exports (JSON or Parquet)")
+    parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv", dest="output_format")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--summaries", action="store_true", help="Also write each file's Summary sales table")
+    args = parser.parse_args(argv)
+
+    stats = run(args.paths, args.out, args.output_format, args.workers, args.summaries)
+    print(
+        f"{stats['files']} files ({stats['failed']} failed), {stats['lots']} lots in {stats['seconds']:.2f}s: "
+        f"{stats['files_per_second']} files/s, {stats['lots_per_second']} lots/s"
+    )
+    for error in stats["errors"]:
+        print(f"  {error['file']}: {error['error']}", file=sys.stderr)
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
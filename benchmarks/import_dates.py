@@ -0,0 +1,92 @@
+# import_dates.py
+# Import benchmark: the old json.load + strptime + key-removal passes against
+# the streaming importer with memoized ISO date parsing.
+#
+# Usage: python benchmarks/import_dates.py [--grants N] [--repeat R]
+
+import argparse
+import copy
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.serialization import iter_grants, parse_iso_date  # noqa: E402
+
+
+def synthetic_export(num_grants):
+    """JSON bytes of `num_grants` grants, cycling through the grants of sample.json with fresh IDs."""
+    with open(os.path.join(ROOT, "sample.json")) as f:
+        sample = json.load(f)
+    grants = []
+    for i in range(num_grants):
+        grant = copy.deepcopy(sample[i % len(sample)])
+        grant["grant_id"] = f"G{i:07d}"
+        grants.append(grant)
+    return json.dumps(grants, indent=2).encode()
+
+def strptime_import(raw):
+    # The import path before the streaming importer
+    def convert_strings_to_dates(obj):
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                if key.endswith("_date") and isinstance(value, str):
+                    obj[key] = datetime.strptime(value, "%Y-%m-%d").date()
+                elif isinstance(value, (dict, list)):
+                    convert_strings_to_dates(value)
+        elif isinstance(obj, list):
+            for item in obj:
+                convert_strings_to_dates(item)
+        return obj
+
+    def remove_calculatable_keys(obj):
+        if isinstance(obj, dict):
+            for key, value in list(obj.items()):
+                if key in ["capital_gains_tax", "tax_at_vest"]:
+                    del obj[key]
+                elif isinstance(value, (dict, list)):
+                    remove_calculatable_keys(value)
+        elif isinstance(obj, list):
+            for item in obj:
+                remove_calculatable_keys(item)
+        return obj
+
+    return remove_calculatable_keys(convert_strings_to_dates(json.load(io.BytesIO(raw))))
+
+def streaming_import(raw):
+    return list(iter_grants(io.BytesIO(raw)))
+
+def best_time(func, raw, repeat):
+    times = []
+    for _ in range(repeat):
+        parse_iso_date.cache_clear()
+        start = time.perf_counter()
+        result = func(raw)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON import and date parsing.")
+    parser.add_argument("--grants", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    raw = synthetic_export(args.grants)
+    old_time, old_result = best_time(strptime_import, raw, args.repeat)
+    new_time, new_result = best_time(streaming_import, raw, args.repeat)
+    assert old_result == new_result, "importers disagree"
+
+    print(f"{args.grants} grants, {len(raw) / 1e6:.1f} MB")
+    print(f"json.load + strptime:   {old_time * 1000:8.1f} ms")
+    print(f"streaming + ISO memo:   {new_time * 1000:8.1f} ms  ({old_time / new_time:.1f}x)")
+    info = parse_iso_date.cache_info()
+    print(f"date cache: {info.hits} hits, {info.misses} misses")
+
+
+if __name__ == "__main__":
+    main()
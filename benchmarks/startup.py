@@ -0,0 +1,68 @@
+# startup.py
+# Import-time benchmark: a worker that only computes taxes imports the pure core
+# modules; the UI additionally pulls in streamlit and plotly.
+#
+# Usage: python benchmarks/startup.py [--repeat N]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CORE_MODULES = [
+    "utils.calculations",
+    "utils.portfolio",
+    "utils.facts",
+    "utils.reports",
+    "utils.serialization",
+    "utils.cache",
+    "utils.changes",
+    "utils.validation",
+]
+# Modules that must not be loaded by the core
+UI_MODULES = ["streamlit", "plotly"]
+
+SCENARIOS = {
+    "core": "import " + ", ".join(CORE_MODULES),
+    "batch": "import batch",
+    "core + streamlit + plotly": "import " + ", ".join(CORE_MODULES + ["streamlit", "plotly.express"]),
+    "ui (utils.visualization, utils.data_handling)": "import utils.visualization, utils.data_handling, plotly.express",
+}
+
+
+def import_seconds(statement):
+    # A fresh interpreter per run, so nothing is already imported
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "print(time.perf_counter() - start)\n"
+        f"print(','.join(m for m in {UI_MODULES!r} if m in sys.modules))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True).stdout.split("\n")
+    return float(output[0]), output[1]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark module import times.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    for name, statement in SCENARIOS.items():
+        runs = [import_seconds(statement) for _ in range(args.repeat)]
+        results[name] = statistics.median(seconds for seconds, _ in runs)
+        loaded = runs[-1][1]
+        print(f"{name:<48} {results[name] * 1000:8.1f} ms   ui modules loaded: {loaded or '-'}")
+        if name in ("core", "batch") and loaded:
+            sys.exit(f"{name} imports {loaded}")
+
+    ui = results["ui (utils.visualization, utils.data_handling)"]
+    print(f"core import takes {results['core'] / ui:.0%} of the UI import time")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# suite.py
+# Benchmark suite: times every hot path of the app on seeded synthetic portfolios
+# (benchmarks/synthetic.py) from a few lots up to millions, and writes the results
+# as JSON so runs on different commits can be compared.
+#
+# Stages, timed in this order on the same portfolio (best of --repeat runs):
+#   import.json, import.parquet     exports parsed into a Portfolio
+#   import.broker                   the same lots as a generic broker CSV statement
+#   validate.grants/vests/sales     editor validation over all grants/vests/sales
+#   derived_fields                  Portfolio.with_derived_fields
+#   lot_facts, tax_year_totals      the shared derived tables (built uncached)
+#   summary                         the Summary section's sales table
+#   table.*, plot.*                 each generate_*_table and plot_* figure
+#   export.json, export.parquet     portfolio_to_json / portfolio_to_parquet
+#
+# Usage: python benchmarks/suite.py [--lots 10 1000 100000 1000000] [--vests-per-grant 4]
+#        [--sales-per-vest 1] [--seed 0] [--repeat 3] [--no-plots] [--out results.json]
+#        [--compare previous.json [--threshold 1.25]]
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import synthetic_json  # noqa: E402
+from utils.broker import BROKER_PROFILES, read_statements, statements_to_portfolio  # noqa: E402
+from utils.facts import lot_facts, build_lot_facts, build_grant_year_totals, build_summary_table, tax_year_totals  # noqa: E402
+from utils.portfolio import Portfolio  # noqa: E402
+from utils.reports import (  # noqa: E402
+    generate_tax_breakdown_table,
+    generate_capital_gains_table,
+    generate_net_gains_table,
+    generate_stock_performance_table,
+)
+from utils.serialization import iter_grants, iter_file_grants, portfolio_to_json, portfolio_to_parquet  # noqa: E402
+from utils.validation import validate_grants, validate_vests, validate_sales  # noqa: E402
+
+DEFAULT_LOTS = [10, 1000, 10000, 100000]
+
+
+def _editor_tables(portfolio):
+    # All grants, vests and sales in the layout of the app's editors, as if in one editor each
+    grants_df, vests_df, sales_df = portfolio.tables()
+    grants = pd.DataFrame({
+        "Grant ID": grants_df["grant_id"],
+        "Grant Date": grants_df["grant_date"],
+        "Symbol": grants_df["symbol"],
+        "Number of Stocks": grants_df["num_stocks"],
+    })
+    vests = pd.DataFrame({
+        "Vest ID": vests_df["grant_id"] + "/" + vests_df["vest_id"],
+        "Vest Date": vests_df["vest_date"],
+        "Shares Vested": vests_df["shares_vested"],
+        "Vest Price": vests_df["vest_price"],
+        "Tax Rate at Vest (%)": vests_df["tax_rate_vest"] * 100,
+    })
+    sales = pd.DataFrame({
+        "Sale ID": sales_df["grant_id"] + "/" + sales_df["sale_id"],
+        "Sale Date": sales_df["sale_date"],
+        "Shares Sold": sales_df["shares_sold"],
+        "Sale Price": sales_df["sale_price"],
+        "Tax Rate at Sale (%)": sales_df["tax_rate_sale"] * 100,
+    })
+    earliest_vest = vests_df["vest_date"].min() if len(vests_df) else None
+    return grants, vests, sales, earliest_vest
+
+def _broker_csv(portfolio):
+    # Every vest and sale as rows of a generic broker statement (sales without a grant ID)
+    grants_df, vests_df, sales_df = portfolio.tables()
+    symbols = grants_df.set_index("grant_id")["symbol"]
+    statement = pd.concat([
+        pd.DataFrame({"Type": "Vest", "Date": vests_df["vest_date"], "Symbol": vests_df["grant_id"].map(symbols), "Grant ID": vests_df["grant_id"], "Quantity": vests_df["shares_vested"], "Price": vests_df["vest_price"]}),
+        pd.DataFrame({"Type": "Sale", "Date": sales_df["sale_date"], "Symbol": sales_df["grant_id"].map(symbols), "Grant ID": "", "Quantity": sales_df["shares_sold"], "Price": sales_df["sale_price"]}),
+    ], ignore_index=True)
+    return statement.to_csv(index=False).encode()
+
+def stages(raw, include_plots=True):
+    """(name, function) pairs in run order; each function takes the shared state dict."""
+    def import_json(state):
+        state["portfolio"] = Portfolio.from_grants(iter_grants(io.BytesIO(raw)))
+
+    def import_parquet(state):
+        Portfolio.from_grants(iter_file_grants(io.BytesIO(state["parquet"])))
+
+    def import_broker(state):
+        statements_to_portfolio(read_statements([io.BytesIO(state["broker_csv"])], BROKER_PROFILES["Generic"]), 0.47)
+
+    def derived_fields(state):
+        state["portfolio"].with_derived_fields()
+
+    def prime(state):
+        # The views read the derived tables cached on the portfolio, as in the app
+        lot_facts(state["portfolio"])
+        tax_year_totals(state["portfolio"])
+
+    result = [
+        ("import.json", import_json),
+        ("import.parquet", import_parquet),
+        ("import.broker", import_broker),
+        ("validate.grants", lambda state: validate_grants(state["editors"][0], state["editors"][0])),
+        ("validate.vests", lambda state: validate_vests(state["editors"][1], state["editors"][1], "")),
+        ("validate.sales", lambda state: validate_sales(state["editors"][2], state["editors"][2], "", "", state["editors"][3])),
+        ("derived_fields", derived_fields),
+        ("lot_facts", lambda state: build_lot_facts(state["portfolio"])),
+        ("tax_year_totals", lambda state: build_grant_year_totals(state["portfolio"]).groupby(level="tax_year").sum()),
+        ("summary", lambda state: build_summary_table(lot_facts(state["portfolio"]))),
+        ("table.tax_breakdown", lambda state: generate_tax_breakdown_table(state["portfolio"])),
+        ("table.capital_gains", lambda state: generate_capital_gains_table(state["portfolio"])),
+        ("table.net_gains", lambda state: generate_net_gains_table(state["portfolio"])),
+        ("table.stock_performance", lambda state: generate_stock_performance_table(state["portfolio"])),
+    ]
+    if include_plots:
+        # Imported here: the figures need plotly, the rest of the suite does not
+        from utils.visualization import plot_tax_breakdown, plot_capital_gains_by_vest, plot_net_gains, plot_stock_performance
+        result += [
+            ("plot.tax_breakdown", lambda state: plot_tax_breakdown(state["portfolio"])),
+            ("plot.capital_gains", lambda state: plot_capital_gains_by_vest(state["portfolio"])),
+            ("plot.net_gains", lambda state: plot_net_gains(state["portfolio"])),
+            ("plot.stock_performance", lambda state: plot_stock_performance(state["portfolio"])),
+        ]
+    result += [
+        ("export.json", lambda state: portfolio_to_json(state["portfolio"])),
+        ("export.parquet", lambda state: portfolio_to_parquet(state["portfolio"])),
+    ]
+    return result, prime
+
+def run_size(num_lots, vests_per_grant, sales_per_vest, seed, repeat, include_plots):
+    """Time every stage on one synthetic portfolio. Returns its result dict."""
+    raw = synthetic_json(num_lots, vests_per_grant, sales_per_vest, seed)
+    state = {}
+    timed, prime = stages(raw, include_plots)
+    seconds = {}
+    for name, stage in timed:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            stage(state)
+            times.append(time.perf_counter() - start)
+        seconds[name] = min(times)
+        if name == "import.json":
+            state["parquet"] = portfolio_to_parquet(state["portfolio"])
+            state["broker_csv"] = _broker_csv(state["portfolio"])
+            state["editors"] = _editor_tables(state["portfolio"])
+        elif name == "tax_year_totals":
+            prime(state)
+
+    portfolio = state["portfolio"]
+    lots = sum(len(vests) for vests in portfolio.vests.values()) + sum(len(sales) for sales in portfolio.sales.values())
+    return {
+        "requested_lots": num_lots,
+        "lots": lots,
+        "grants": len(portfolio.grants),
+        "json_bytes": len(raw),
+        "parquet_bytes": len(state["parquet"]),
+        "seconds": {name: round(value, 6) for name, value in seconds.items()},
+        "lots_per_second": {name: round(lots / value) if value else None for name, value in seconds.items()},
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, previous, threshold):
+    """Stages at least `threshold` times slower than in `previous` (matched on lots): list of (lots, stage, ratio)."""
+    before = {run["requested_lots"]: run["seconds"] for run in previous["runs"]}
+    slower = []
+    for run in results["runs"]:
+        for name, seconds in run["seconds"].items():
+            old = before.get(run["requested_lots"], {}).get(name)
+            if old and seconds / old >= threshold:
+                slower.append((run["requested_lots"], name, seconds / old))
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every hot path on synthetic portfolios.")
+    parser.add_argument("--lots", type=int, nargs="+", default=DEFAULT_LOTS)
+    parser.add_argument("--vests-per-grant", type=int, default=4)
+    parser.add_argument("--sales-per-vest", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-plots", action="store_true", help="Skip the plotly figure builds")
+    parser.add_argument("--out", default="-", help="Results JSON file (default: stdout)")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    results = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "vests_per_grant": args.vests_per_grant,
+            "sales_per_vest": args.sales_per_vest,
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "runs": [],
+    }
+    for num_lots in args.lots:
+        run = run_size(num_lots, args.vests_per_grant, args.sales_per_vest, args.seed, args.repeat, not args.no_plots)
+        results["runs"].append(run)
+        # Progress and a readable table on stderr; stdout may be the JSON
+        print(f"{run['lots']} lots, {run['grants']} grants", file=sys.stderr)
+        for name, seconds in run["seconds"].items():
+            print(f"  {name:<26} {seconds * 1000:10.1f} ms", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.out == "-":
+        print(output)
+    else:
+        with open(args.out, "w") as f:
+            f.write(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f), args.threshold)
+        for num_lots, name, ratio in slower:
+            print(f"regression: {name} at {num_lots} lots is {ratio:.2f}x slower", file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# synthetic.py
+# Seeded synthetic portfolios in the sample.json schema, for benchmarks.
+# Every grant has the same number of vests, vested quarterly from a year after the
+# grant, and every vest is sold in the same number of sales (part of its shares),
+# some within 30 days and some after more than a year, at gains and at losses.
+#
+# Usage: python benchmarks/synthetic.py --lots 100000 [--vests-per-grant 4] [--sales-per-vest 1] [--seed 0] > portfolio.json
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+SYMBOLS = ["AMZN", "MSFT", "GOOG", "AAPL", "META", "NVDA", "CRM", "ADBE"]
+# Marginal rates including the Medicare levy
+TAX_RATES = [0.21, 0.345, 0.39, 0.47]
+FIRST_GRANT_DATE = np.datetime64("2015-01-01")
+
+
+def _iso(days):
+    return (FIRST_GRANT_DATE + days.astype("timedelta64[D]")).astype(str).tolist()
+
+def synthetic_grants(num_lots, vests_per_grant=4, sales_per_vest=1, seed=0):
+    """About `num_lots` vests and sales as grant dicts in the sample.json schema (ISO date strings).
+
+    The same arguments always give the same portfolio.
+    """
+    rng = np.random.default_rng(seed)
+    num_grants = max(1, round(num_lots / (vests_per_grant * (1 + sales_per_vest))))
+    num_vests = num_grants * vests_per_grant
+    num_sales = num_vests * sales_per_vest
+
+    grant_days = rng.integers(0, 6 * 365, num_grants)
+    symbols = rng.choice(SYMBOLS, num_grants)
+    tax_rates = rng.choice(TAX_RATES, num_grants)
+
+    vest_grant = np.repeat(np.arange(num_grants), vests_per_grant)
+    vest_days = grant_days[vest_grant] + 365 + 91 * np.tile(np.arange(vests_per_grant), num_grants)
+    shares_vested = rng.integers(max(10, sales_per_vest), 500, num_vests)
+    vest_prices = np.round(rng.lognormal(np.log(150), 0.4, num_vests), 2)
+
+    # Each vest sells between sales_per_vest and all of its shares, split evenly
+    sale_vest = np.repeat(np.arange(num_vests), sales_per_vest)
+    sold = rng.integers(sales_per_vest, shares_vested + 1) if sales_per_vest else np.zeros(num_vests, dtype=int)
+    shares_sold = np.repeat(sold // max(sales_per_vest, 1), sales_per_vest)
+    if sales_per_vest:
+        shares_sold[sales_per_vest - 1::sales_per_vest] += sold % sales_per_vest
+    # One sale in five within 30 days of vesting, the rest up to about three years later
+    holding_days = np.where(rng.random(num_sales) < 0.2, rng.integers(1, 31, num_sales), rng.integers(31, 1200, num_sales))
+    sale_days = vest_days[sale_vest] + holding_days
+    sale_prices = np.round(vest_prices[sale_vest] * rng.lognormal(0.0, 0.25, num_sales), 2)
+
+    grant_dates, vest_dates, sale_dates = _iso(grant_days), _iso(vest_days), _iso(sale_days)
+    shares_vested, vest_prices = shares_vested.tolist(), vest_prices.tolist()
+    shares_sold, sale_prices = shares_sold.tolist(), sale_prices.tolist()
+    tax_rates = tax_rates.tolist()
+
+    grants = []
+    for g in range(num_grants):
+        vest_ids = range(g * vests_per_grant, (g + 1) * vests_per_grant)
+        vests = [
+            {
+                "vest_id": str(v - g * vests_per_grant + 1),
+                "vest_date": vest_dates[v],
+                "shares_vested": shares_vested[v],
+                "vest_price": vest_prices[v],
+                "tax_rate_vest": tax_rates[g],
+            }
+            for v in vest_ids
+        ]
+        sales = [
+            {
+                "sale_id": str(s - g * vests_per_grant * sales_per_vest + 1),
+                "vest_id": str(s // max(sales_per_vest, 1) - g * vests_per_grant + 1),
+                "sale_date": sale_dates[s],
+                "shares_sold": shares_sold[s],
+                "sale_price": sale_prices[s],
+                "tax_rate_sale": tax_rates[g],
+            }
+            for s in range(vest_ids.start * sales_per_vest, vest_ids.stop * sales_per_vest)
+        ]
+        grants.append({
+            "grant_id": f"G{g:07d}",
+            "grant_date": grant_dates[g],
+            "symbol": str(symbols[g]),
+            "num_stocks": sum(vest["shares_vested"] for vest in vests),
+            "vests": vests,
+            "sales": sales,
+        })
+    return grants
+
+def synthetic_json(num_lots, vests_per_grant=4, sales_per_vest=1, seed=0):
+    """synthetic_grants as the bytes of a JSON export."""
+    return json.dumps(synthetic_grants(num_lots, vests_per_grant, sales_per_vest, seed)).encode()
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a seeded synthetic portfolio as JSON to stdout.")
+    parser.add_argument("--lots", type=int, default=1000)
+    parser.add_argument("--vests-per-grant", type=int, default=4)
+    parser.add_argument("--sales-per-vest", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.stdout.buffer.write(synthetic_json(args.lots, args.vests_per_grant, args.sales_per_vest, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# test_batch.py
+# The headless batch runner.
+
+import json
+import os
+import subprocess
+import sys
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import batch
+from utils.facts import tax_year_totals
+from utils.portfolio import Portfolio
+from utils.serialization import portfolio_to_json, portfolio_to_parquet
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _portfolio(grant_id, vest_price):
+    return Portfolio.from_grants([{
+        "grant_id": grant_id, "grant_date": date(2021, 1, 1), "symbol": "ABC", "num_stocks": 100,
+        "vests": [
+            {"vest_id": "V1", "vest_date": date(2021, 8, 1), "shares_vested": 50, "vest_price": vest_price, "tax_rate_vest": 0.47},
+            {"vest_id": "V2", "vest_date": date(2022, 8, 1), "shares_vested": 50, "vest_price": vest_price + 1, "tax_rate_vest": 0.47},
+        ],
+        "sales": [{"sale_id": "S1", "vest_id": "V1", "sale_date": date(2023, 3, 1), "shares_sold": 20, "sale_price": 15.0, "tax_rate_sale": 0.47}],
+    }])
+
+@pytest.fixture
+def files(tmp_path):
+    json_path, parquet_path, bad_path = tmp_path / "a.json", tmp_path / "b.parquet", tmp_path / "bad.json"
+    json_path.write_text(portfolio_to_json(_portfolio("G1", 10.0)))
+    parquet_path.write_bytes(portfolio_to_parquet(_portfolio("G2", 12.0)))
+    bad_path.write_text("{not json")
+    return [str(json_path), str(parquet_path), str(bad_path)]
+
+
+def test_process_file_matches_the_app_totals(files):
+    totals, lots, error = batch.process_file(files[0])
+    assert error is None and lots == 3
+    expected = tax_year_totals(_portfolio("G1", 10.0).with_derived_fields()).reset_index()
+    pd.testing.assert_frame_equal(totals.drop(columns="file"), expected, check_dtype=False)
+    assert (totals["file"] == files[0]).all()
+
+def test_bad_files_are_reported_not_raised(files):
+    totals, lots, error = batch.process_file(files[2])
+    assert totals is None and lots == 0 and error
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_writes_per_file_and_summed_totals(files, tmp_path, workers):
+    out = tmp_path / f"out{workers}"
+    stats = batch.run(files, str(out), workers=workers, summaries=True)
+    assert (stats["files"], stats["failed"], stats["lots"]) == (3, 1, 6)
+    assert stats["errors"][0]["file"] == files[2]
+
+    per_file = pd.read_csv(out / "file_tax_years.csv")
+    summed = pd.read_csv(out / "tax_years.csv")
+    assert set(per_file["file"]) == set(files[:2])
+    pd.testing.assert_frame_equal(per_file.drop(columns="file").groupby("tax_year", as_index=False).sum(), summed)
+    assert sorted(os.listdir(out / "summaries")) == ["a.csv", "b.csv"]
+    assert json.loads((out / "stats.json").read_text())["lots"] == 6
+
+def test_main_exits_non_zero_when_a_file_fails(files, tmp_path, capsys):
+    assert batch.main(files[:2] + ["--out", str(tmp_path / "ok"), "--workers", "1", "--format", "parquet"]) == 0
+    assert os.path.exists(tmp_path / "ok" / "tax_years.parquet")
+    assert batch.main(files + ["--out", str(tmp_path / "failed"), "--workers", "1"]) == 1
+    assert "bad.json" in capsys.readouterr().err
+
+def test_batch_does_not_import_the_ui():
+    code = "import sys, batch; print(sorted(m for m in ('streamlit', 'plotly') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
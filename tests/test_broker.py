@@ -0,0 +1,99 @@
+# test_broker.py
+# Brokerage statement import: parsing, chunking and FIFO sale matching.
+
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.broker import BROKER_PROFILES, match_sales_to_vests, read_statements, statements_to_portfolio
+
+GENERIC = BROKER_PROFILES["Generic"]
+
+STATEMENT = """Type,Date,Symbol,Grant ID,Quantity,Price
+Vest,2022-01-10,abc,G1,100,10.00
+Dividend,2022-02-01,ABC,,0,1.00
+Vest,2022-07-10,ABC,G1,50,"$1,012.50"
+Sale,2022-08-01,ABC,,120,15.00
+Vest,2022-03-01,XYZ,,40,5.00
+Sale,2022-09-01,XYZ,,(10),6.00
+"""
+
+
+def _csv(text):
+    return io.BytesIO(text.encode())
+
+def _frame(rows):
+    return pd.DataFrame(rows, columns=["symbol", "date", "shares"]).astype({"date": "datetime64[ns]"})
+
+def _fifo(vests, sales):
+    # One share at a time, the oldest vested share of the symbol first
+    queues = {}
+    for row in np.lexsort((vests["date"].to_numpy(), vests["symbol"].to_numpy())):
+        queues.setdefault(vests["symbol"].iloc[row], []).extend([row] * int(vests["shares"].iloc[row]))
+    taken = {}
+    for row in np.lexsort((sales["date"].to_numpy(), sales["symbol"].to_numpy())):
+        queue = queues[sales["symbol"].iloc[row]]
+        for _ in range(int(sales["shares"].iloc[row])):
+            vest = queue.pop(0)
+            taken[(row, vest)] = taken.get((row, vest), 0) + 1
+    return taken
+
+
+def test_read_statements_parses_and_skips_other_activity():
+    activity = read_statements([_csv(STATEMENT)], GENERIC)
+    assert activity["event"].tolist() == ["vest", "vest", "sale", "vest", "sale"]
+    assert activity["symbol"].tolist() == ["ABC", "ABC", "ABC", "XYZ", "XYZ"]
+    # Without a grant ID the symbol is the grant
+    assert activity["grant_id"].tolist() == ["G1", "G1", "ABC", "XYZ", "XYZ"]
+    assert activity["price"].tolist() == [10.0, 1012.5, 15.0, 5.0, 6.0]
+    assert activity["shares"].tolist() == [100, 50, 120, 40, 10]
+    assert activity["line"].tolist() == [2, 4, 5, 6, 7]
+
+def test_chunked_reads_match_a_single_read():
+    whole = read_statements([_csv(STATEMENT)], GENERIC)
+    chunked = read_statements([_csv(STATEMENT)], GENERIC, chunk_rows=2)
+    pd.testing.assert_frame_equal(whole, chunked)
+
+def test_invalid_rows_are_reported_by_line():
+    text = STATEMENT + "Sale,not a date,ABC,,5,15.00\n"
+    with pytest.raises(ValueError, match="line 8"):
+        read_statements([_csv(text)], GENERIC)
+
+def test_missing_columns_are_reported():
+    with pytest.raises(ValueError, match="Price"):
+        read_statements([_csv("Type,Date,Symbol,Quantity\nVest,2022-01-10,ABC,1\n")], GENERIC)
+
+def test_sales_are_split_across_vests_first_in_first_out():
+    portfolio = statements_to_portfolio(read_statements([_csv(STATEMENT)], GENERIC), 0.47)
+    # Grants come from the vests; a sale is matched by symbol whatever grant it names
+    assert sorted(portfolio.grants) == ["G1", "XYZ"]
+    assert [(s["vest_id"], s["shares_sold"]) for s in portfolio.sales["G1"].values()] == [("1", 100), ("2", 20)]
+    assert [(s["vest_id"], s["shares_sold"]) for s in portfolio.sales["XYZ"].values()] == [("1", 10)]
+    assert portfolio.grants["G1"]["num_stocks"] == 150
+    assert all(s["tax_rate_sale"] == 0.47 for _, s in portfolio.iter_sales())
+
+def test_matching_agrees_with_share_by_share_fifo():
+    rng = np.random.default_rng(0)
+    vests = _frame([(rng.choice(["A", "B", "C"]), pd.Timestamp("2020-01-01") + pd.Timedelta(days=int(d)), int(n))
+                    for d, n in zip(rng.integers(0, 100, 40), rng.integers(1, 20, 40))])
+    # Every sale comes after every vest, so only the share counts limit it
+    sales = vests.groupby("symbol", as_index=False)["shares"].sum()
+    sales = _frame([(symbol, pd.Timestamp("2021-01-01") + pd.Timedelta(days=i), part)
+                    for symbol, total in zip(sales["symbol"], sales["shares"])
+                    for i, part in enumerate(np.diff(np.r_[0, np.sort(rng.choice(np.arange(1, total), 3, replace=False)), total]))])
+    sale_rows, vest_rows, shares = match_sales_to_vests(vests, sales)
+    assert dict(zip(zip(sale_rows.tolist(), vest_rows.tolist()), shares.tolist())) == _fifo(vests, sales)
+
+def test_overselling_is_rejected():
+    vests = _frame([("A", "2022-01-01", 10)])
+    with pytest.raises(ValueError, match="exceed the shares vested"):
+        match_sales_to_vests(vests, _frame([("A", "2022-02-01", 11)]))
+    with pytest.raises(ValueError, match="exceed the shares vested"):
+        match_sales_to_vests(vests, _frame([("B", "2022-02-01", 1)]))
+
+def test_selling_before_vesting_is_rejected():
+    vests = _frame([("A", "2022-01-01", 10), ("A", "2022-06-01", 10)])
+    with pytest.raises(ValueError, match="more shares than had vested"):
+        match_sales_to_vests(vests, _frame([("A", "2022-03-01", 15)]))
@@ -0,0 +1,32 @@
+# test_calculations.py
+# The scalar tax helpers and the column-wise rules give the same results.
+
+import numpy as np
+import pytest
+
+from utils.calculations import calculate_capital_gains_tax, capital_gains_tax_columns
+
+CASES = [
+    # sale_price, vest_price, shares_sold, tax_rate, held_over_year, holding_period
+    (15.0, 10.0, 100, 0.47, False, 200),
+    (15.0, 10.0, 100, 0.47, True, 400),
+    (8.0, 10.0, 100, 0.47, False, 200),
+    (15.0, 10.0, 100, 0.47, False, 30),
+    (15, 10, 100, 1, True, 400),
+]
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_scalar_and_column_rules_agree(case):
+    assert calculate_capital_gains_tax(*case) == capital_gains_tax_columns(*case)
+
+def test_columns_match_the_scalar_helper_per_lot():
+    columns = [np.array(values) for values in zip(*CASES)]
+    assert capital_gains_tax_columns(*columns).tolist() == [calculate_capital_gains_tax(*case) for case in CASES]
+
+def test_scalar_helper_keeps_its_return_types():
+    assert calculate_capital_gains_tax(15.0, 10.0, 100, 0.47, False, 30) == 0
+    assert type(calculate_capital_gains_tax(15.0, 10.0, 100, 0.47, False, 30)) is int
+    assert type(calculate_capital_gains_tax(8.0, 10.0, 100, 0.47, False, 200)) is int
+    assert type(calculate_capital_gains_tax(15, 10, 100, 1, False, 200)) is int
+    assert type(calculate_capital_gains_tax(15.0, 10.0, 100, 0.47, True, 400)) is float
@@ -0,0 +1,85 @@
+# test_data_handling.py
+# The sidebar importer imports each uploaded file once.
+
+import io
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from utils import data_handling
+
+GRANTS = [{"grant_id": "G1", "grant_date": "2021-01-01", "symbol": "ABC", "num_stocks": 100, "vests": [], "sales": []}]
+
+
+class _Upload(io.BytesIO):
+    def __init__(self, data, file_id):
+        super().__init__(data)
+        self.file_id = file_id
+
+
+@pytest.fixture
+def sidebar(monkeypatch):
+    # Just enough of streamlit for import_data
+    state = SimpleNamespace(upload=None, session_state={}, messages=[])
+    fake = SimpleNamespace(
+        sidebar=SimpleNamespace(file_uploader=lambda *args, **kwargs: state.upload),
+        session_state=state.session_state,
+        success=lambda msg: state.messages.append(("success", msg)),
+        error=lambda msg: state.messages.append(("error", msg)),
+    )
+    monkeypatch.setattr(data_handling, "st", fake)
+    return state
+
+
+def test_an_upload_is_imported_once(sidebar, monkeypatch):
+    sidebar.upload = _Upload(json.dumps(GRANTS).encode(), "file-1")
+    portfolio = data_handling.import_data()
+    assert list(portfolio.grants) == ["G1"]
+
+    parses = []
+    monkeypatch.setattr(data_handling, "iter_file_grants", lambda f: parses.append(f) or iter(()))
+    assert data_handling.import_data() is None
+    assert parses == []
+
+    # A new upload, even of the same content, is imported
+    sidebar.upload = _Upload(json.dumps(GRANTS).encode(), "file-2")
+    assert data_handling.import_data() is not None
+    assert len(parses) == 1
+
+def test_removing_the_upload_forgets_it(sidebar):
+    sidebar.upload = _Upload(json.dumps(GRANTS).encode(), "file-1")
+    data_handling.import_data()
+    sidebar.upload = None
+    assert data_handling.import_data() is None
+    assert "imported_file" not in sidebar.session_state
+
+def test_an_invalid_upload_keeps_its_error(sidebar):
+    sidebar.upload = _Upload(b"{not json", "file-1")
+    assert data_handling.import_data() is None
+    assert data_handling.import_data() is None
+    errors = [msg for kind, msg in sidebar.messages if kind == "error"]
+    assert len(errors) == 2 and errors[0] == errors[1]
+
+@pytest.mark.parametrize("grants, message", [
+    ([{"symbol": "X"}], "missing 'grant_id'"),
+    ([1, 2], "Expected a grant object"),
+    ([{**GRANTS[0], "vests": [{"vest_id": "V1"}]}], "A vest in Grant 'G1' is missing 'vest_date'"),
+    ([{**GRANTS[0], "sales": {}}], "Expected a list of sales"),
+])
+def test_a_malformed_upload_is_reported_once(sidebar, monkeypatch, grants, message):
+    sidebar.upload = _Upload(json.dumps(grants).encode(), "file-1")
+    assert data_handling.import_data() is None
+    errors = [msg for kind, msg in sidebar.messages if kind == "error"]
+    assert len(errors) == 1 and message in errors[0]
+
+    # Recorded, so later reruns show the error without importing again
+    monkeypatch.setattr(data_handling, "iter_file_grants", lambda f: pytest.fail("imported again"))
+    assert data_handling.import_data() is None
+    assert sidebar.session_state["imported_file"][0] == "file-1"
+
+def test_a_bad_field_value_is_reported(sidebar):
+    grants = [{**GRANTS[0], "vests": [{"vest_id": "V1", "vest_date": "2021-07-01", "shares_vested": {"count": 10}, "vest_price": 1.0, "tax_rate_vest": 0.47}]}]
+    sidebar.upload = _Upload(json.dumps(grants).encode(), "file-1")
+    assert data_handling.import_data() is None
+    assert sidebar.session_state["imported_file"][1].startswith("Invalid portfolio data: unexpected value (TypeError")
@@ -0,0 +1,100 @@
+# test_facts.py
+# The lot fact table and per-year totals, patched after edits and built in full.
+
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from utils import facts
+from utils.facts import build_lot_facts, grant_year_totals, lot_facts, tax_year_totals
+from utils.portfolio import Portfolio
+
+
+def _grant(n):
+    # Grants in two symbols, vesting and selling across several tax years, some at a loss
+    return {
+        "grant_id": f"G{n}", "grant_date": date(2020, 1, 1), "symbol": "ABC" if n % 2 else "XYZ", "num_stocks": 100,
+        "vests": [
+            {"vest_id": "V1", "vest_date": date(2020 + n % 3, 7, 1), "shares_vested": 50, "vest_price": 10.0 + n, "tax_rate_vest": 0.47},
+            {"vest_id": "V2", "vest_date": date(2022, 2, 1), "shares_vested": 50, "vest_price": 12.0, "tax_rate_vest": 0.37},
+        ],
+        "sales": [
+            {"sale_id": "S1", "vest_id": "V1", "sale_date": date(2022 + n % 2, 8, 1), "shares_sold": 10, "sale_price": 8.0 + 2 * n, "tax_rate_sale": 0.47},
+            {"sale_id": "S1", "vest_id": "V2", "sale_date": date(2023, 3, 1), "shares_sold": 5, "sale_price": 11.0, "tax_rate_sale": 0.37},
+        ],
+    }
+
+def _vest(vest_id, vest_price):
+    return {"vest_id": vest_id, "vest_date": date(2021, 9, 1), "shares_vested": 20, "vest_price": vest_price, "tax_rate_vest": 0.47}
+
+@pytest.fixture
+def portfolio():
+    # Derived tables built once, so the edited versions below patch them
+    portfolio = Portfolio.from_grants([_grant(n) for n in range(1, 7)]).with_derived_fields()
+    lot_facts(portfolio)
+    tax_year_totals(portfolio)
+    return portfolio
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = {"build": 0, "patch": []}
+    def build(portfolio):
+        calls["build"] += 1
+        return build_lot_facts(portfolio)
+    patch = facts.patch_lot_facts
+    monkeypatch.setattr(facts, "build_lot_facts", build)
+    monkeypatch.setattr(facts, "patch_lot_facts", lambda value, portfolio, changed: calls["patch"].append(set(changed)) or patch(value, portfolio, changed))
+    return calls
+
+def _assert_patched_matches_build(portfolio):
+    rebuilt = build_lot_facts(portfolio)
+    pd.testing.assert_frame_equal(lot_facts(portfolio), rebuilt)
+    pd.testing.assert_frame_equal(grant_year_totals(portfolio), facts._grant_year_totals(rebuilt))
+    pd.testing.assert_frame_equal(tax_year_totals(portfolio), facts._grant_year_totals(rebuilt).groupby(level="tax_year").sum().sort_index())
+
+def _assert_derived_fields_match_rebuild(portfolio):
+    rebuilt = Portfolio.from_grants(portfolio.to_grants()).with_derived_fields()
+    for patched, built in zip(portfolio.lot_tables(), rebuilt.lot_tables()):
+        pd.testing.assert_frame_equal(patched, built)
+
+
+def test_an_edited_vest_patches_only_its_grant(portfolio, calls):
+    edited = portfolio.with_vest_sales("G2", "V1", [{**portfolio.sales["G2"][("V1", "S1")], "sale_price": 1.0}])
+    edited = edited.with_vests("G2", [_vest("V1", 30.0), _vest("V3", 5.0)]).with_derived_fields(["G2"])
+    _assert_derived_fields_match_rebuild(edited)
+    _assert_patched_matches_build(edited)
+    assert calls == {"build": 0, "patch": [{"G2"}]}
+
+def test_an_inserted_grant(portfolio, calls):
+    added = {key: value for key, value in _grant(7).items() if key not in ("vests", "sales")}
+    edited = portfolio.with_grants([*portfolio.grants.values(), added])
+    # Several unrendered versions in between: their changes add up
+    edited = edited.with_vests("G7", [_vest("V1", 9.0)])
+    edited = edited.with_sales("G7", [_grant(7)["sales"][0]]).with_derived_fields(["G7"])
+    _assert_derived_fields_match_rebuild(edited)
+    _assert_patched_matches_build(edited)
+    assert list(lot_facts(edited)["grant_id"].unique())[-1] == "G7"
+    assert calls == {"build": 0, "patch": [{"G7"}]}
+
+def test_a_deleted_grant(portfolio, calls):
+    edited = portfolio.with_grants([row for grant_id, row in portfolio.grants.items() if grant_id != "G3"])
+    _assert_patched_matches_build(edited)
+    assert "G3" not in set(lot_facts(edited)["grant_id"])
+    assert calls == {"build": 0, "patch": [{"G3"}]}
+
+def test_reordered_grants_follow_the_new_order(portfolio, calls):
+    edited = portfolio.with_grants(list(portfolio.grants.values())[::-1])
+    _assert_patched_matches_build(edited)
+    assert list(grant_year_totals(edited).index.get_level_values("grant_id").unique()) == [f"G{n}" for n in range(6, 0, -1)]
+    assert calls == {"build": 0, "patch": [set()]}
+
+def test_editing_half_the_grants_rebuilds(portfolio, calls):
+    edited = portfolio
+    for grant_id in ["G1", "G3", "G5"]:
+        edited = edited.with_vests(grant_id, [_vest("V1", 20.0)])
+    edited = edited.with_derived_fields(["G1", "G3", "G5"])
+    _assert_derived_fields_match_rebuild(edited)
+    _assert_patched_matches_build(edited)
+    # The patch falls back to a full build at half the grants
+    assert calls["patch"] == [{"G1", "G3", "G5"}] and calls["build"] == 1
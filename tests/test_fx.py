@@ -0,0 +1,43 @@
+# test_fx.py
+# Lot currencies: a lot's own, else its grant's, else AUD.
+
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from utils.fx import lot_currencies
+from utils.portfolio import Portfolio
+
+
+def _lots(currencies):
+    return pd.DataFrame({"grant_id": ["G1"] * len(currencies), "currency": currencies})
+
+
+def test_blank_lot_currency_inherits_the_grant_currency():
+    grants = pd.DataFrame({"grant_id": ["G1"], "currency": ["USD"]})
+    currencies = lot_currencies(_lots(["", "  ", None, np.nan, " gbp "]), grants)
+    assert currencies.tolist() == ["USD", "USD", "USD", "USD", "GBP"]
+
+
+def test_blank_grant_currency_is_aud():
+    grants = pd.DataFrame({"grant_id": ["G1"], "currency": [" "]})
+    assert lot_currencies(_lots(["", "usd"]), grants).tolist() == ["AUD", "USD"]
+
+
+def test_lots_without_a_currency_column_use_the_grant_currency():
+    lots = pd.DataFrame({"grant_id": ["G1", "G2"]})
+    grants = pd.DataFrame({"grant_id": ["G1", "G2"], "currency": ["USD", None]})
+    assert lot_currencies(lots, grants).tolist() == ["USD", "AUD"]
+
+
+def test_is_foreign_treats_a_blank_currency_as_none():
+    grant = {
+        "grant_id": "G1", "grant_date": date(2021, 1, 1), "symbol": "ABC", "num_stocks": 10, "currency": "USD",
+        "vests": [{"vest_id": "V1", "vest_date": date(2021, 7, 1), "shares_vested": 10, "vest_price": 10.0,
+                   "tax_rate_vest": 0.47, "currency": ""}],
+        "sales": [],
+    }
+    assert Portfolio.from_grants([grant]).is_foreign("G1")
+    grant["currency"] = " "
+    assert not Portfolio.from_grants([grant]).is_foreign("G1")
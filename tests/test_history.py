@@ -0,0 +1,95 @@
+# test_history.py
+# Undo/redo of portfolio versions.
+
+from datetime import date
+
+from utils.facts import lot_facts
+from utils.history import History
+from utils.portfolio import Portfolio
+from utils.reconciliation import reconcile
+
+
+def _grant(grant_id):
+    return {
+        "grant_id": grant_id, "grant_date": date(2021, 1, 1), "symbol": "ABC", "num_stocks": 100,
+        "vests": [{"vest_id": "V1", "vest_date": date(2021, 7, 1), "shares_vested": 50, "vest_price": 10.0, "tax_rate_vest": 0.47}],
+        "sales": [],
+    }
+
+def _edited(portfolio, grant_id, shares):
+    vest = {**portfolio.vests[grant_id]["V1"], "shares_vested": shares}
+    return portfolio.with_vests(grant_id, [vest]).with_derived_fields([grant_id])
+
+def _shares(portfolio, grant_id="G1"):
+    return portfolio.vests[grant_id]["V1"]["shares_vested"]
+
+
+def test_undo_and_redo_step_through_versions():
+    history = History()
+    versions = [Portfolio.from_grants([_grant("G1"), _grant("G2")]).with_derived_fields()]
+    for shares in (60, 70):
+        history.record(versions[-1])
+        versions.append(_edited(versions[-1], "G1", shares))
+
+    current = versions[-1]
+    current = history.undo(current)
+    assert _shares(current) == 60 and history.can_redo()
+    current = history.undo(current)
+    assert current.fingerprint() == versions[0].fingerprint()
+    assert not history.can_undo()
+    # Nothing left to undo: the version is returned as it is
+    assert history.undo(current) is current
+
+    current = history.redo(history.redo(current))
+    assert current.fingerprint() == versions[-1].fingerprint()
+    assert not history.can_redo()
+
+def test_recording_an_edit_clears_redo():
+    history = History()
+    portfolio = Portfolio.from_grants([_grant("G1")]).with_derived_fields()
+    history.record(portfolio)
+    current = history.undo(_edited(portfolio, "G1", 60))
+    assert history.can_redo()
+    history.record(current)
+    assert not history.can_redo()
+
+def test_versions_share_untouched_partitions():
+    history = History()
+    portfolio = Portfolio.from_grants([_grant("G1"), _grant("G2")]).with_derived_fields()
+    snapshot = portfolio.snapshot()
+    assert snapshot is not portfolio and snapshot.vests["G2"] is portfolio.vests["G2"]
+
+    history.record(portfolio)
+    edited = _edited(portfolio, "G1", 60)
+    assert edited.vests["G2"] is portfolio.vests["G2"]
+    undone = history.undo(edited)
+    assert undone.vests["G1"] is portfolio.vests["G1"]
+    assert undone.vests["G2"] is portfolio.vests["G2"]
+
+def test_undone_versions_patch_derived_values():
+    history = History()
+    portfolio = Portfolio.from_grants([_grant("G1"), _grant("G2")]).with_derived_fields()
+    history.record(portfolio)
+    edited = _edited(portfolio, "G1", 200)
+    assert list(reconcile(edited)["check"]) == ["over_vested_grant"]
+    undone = history.undo(edited)
+    assert reconcile(undone).empty
+    redone = history.redo(undone)
+    assert list(reconcile(redone)["check"]) == ["over_vested_grant"]
+
+def test_the_oldest_versions_are_dropped_first():
+    history = History(limit=2)
+    portfolio = Portfolio.from_grants([_grant("G1")]).with_derived_fields()
+    for shares in (60, 70, 80):
+        history.record(portfolio)
+        portfolio = _edited(portfolio, "G1", shares)
+
+    portfolio = history.undo(portfolio)
+    assert _shares(portfolio) == 70
+    portfolio = history.undo(portfolio)
+    assert _shares(portfolio) == 60
+    # The version with 50 shares was dropped
+    assert not history.can_undo() and history.undo(portfolio) is portfolio
+
+    history.clear()
+    assert not history.can_redo()
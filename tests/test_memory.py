@@ -0,0 +1,55 @@
+# test_memory.py
+# Session accounting: versions evicted by enforce_budget are let go at once.
+
+import gc
+import weakref
+from datetime import date
+
+from utils.history import History
+from utils.memory import _step_sizes, enforce_budget, session_footprint
+from utils.portfolio import Portfolio
+
+
+def _grant(grant_id):
+    return {
+        "grant_id": grant_id, "grant_date": date(2021, 1, 1), "symbol": "ABC", "num_stocks": 100,
+        "vests": [{"vest_id": "V1", "vest_date": date(2021, 7, 1), "shares_vested": 50, "vest_price": 10.0, "tax_rate_vest": 0.47}],
+        "sales": [],
+    }
+
+def _edited(portfolio, grant_id, shares):
+    vest = {**portfolio.vests[grant_id]["V1"], "shares_vested": shares}
+    return portfolio.with_vests(grant_id, [vest])
+
+def _session(edits=5):
+    portfolio = Portfolio.from_grants([_grant("G1"), _grant("G2")])
+    history = History()
+    for shares in range(1, edits + 1):
+        history.record(portfolio)
+        portfolio = _edited(portfolio, "G1", shares)
+    return portfolio, history
+
+
+def test_footprint_charges_each_kept_version():
+    portfolio, history = _session()
+    footprint = session_footprint(portfolio, history)
+    assert footprint["history_versions"] == 5
+    assert footprint["history"] > 0
+    assert footprint["total"] == footprint["data"] + footprint["history"] + sum(footprint["cached"].values())
+
+def test_evicted_versions_are_released():
+    portfolio, history = _session()
+    session_footprint(portfolio, history)
+    oldest = weakref.ref(history.versions()[0][0])
+
+    freed = enforce_budget(portfolio, history, max_bytes=session_footprint(portfolio, history)["data"])
+    assert freed > 0
+    assert not history.can_undo()
+    assert all(version is not oldest() for version, _, _ in _step_sizes[history].values())
+    gc.collect()
+    assert oldest() is None
+
+def test_under_budget_drops_nothing():
+    portfolio, history = _session()
+    assert enforce_budget(portfolio, history, max_bytes=10**12) == 0
+    assert session_footprint(portfolio, history)["history_versions"] == 5
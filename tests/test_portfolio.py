@@ -0,0 +1,71 @@
+# test_portfolio.py
+# The indexed Portfolio model: the JSON adapter, edits and snapshots.
+
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from utils.portfolio import Portfolio
+from utils.prices import PriceStore, backfill_prices
+
+
+def _grant(grant_id="G1", sales=None):
+    return {
+        "grant_id": grant_id, "grant_date": date(2021, 1, 1), "symbol": "ABC", "num_stocks": 100,
+        "vests": [
+            {"vest_id": "V1", "vest_date": date(2021, 7, 1), "shares_vested": 50, "vest_price": 10.0, "tax_rate_vest": 0.47},
+            {"vest_id": "V2", "vest_date": date(2022, 7, 1), "shares_vested": 50, "vest_price": 11.0, "tax_rate_vest": 0.47},
+        ],
+        "sales": sales if sales is not None else [
+            {"sale_id": "S1", "vest_id": "V1", "sale_date": date(2022, 8, 1), "shares_sold": 10, "sale_price": 12.0, "tax_rate_sale": 0.47},
+            {"sale_id": "S1", "vest_id": "V2", "sale_date": date(2023, 8, 1), "shares_sold": 20, "sale_price": 13.0, "tax_rate_sale": 0.47},
+        ],
+    }
+
+
+def test_sale_ids_repeat_across_vests():
+    grants = [_grant()]
+    portfolio = Portfolio.from_grants(grants)
+    assert portfolio.to_grants() == grants
+    assert portfolio.sale("G1", "V2", "S1")["shares_sold"] == 20
+    assert [sale["shares_sold"] for sale in portfolio.sales_for_vest("G1", "V1")] == [10]
+
+def test_duplicate_ids_that_cannot_be_indexed():
+    with pytest.raises(ValueError, match="Grant ID"):
+        Portfolio.from_grants([_grant(), _grant()])
+    sale = {"sale_id": "S1", "vest_id": "V1", "sale_date": date(2022, 8, 1), "shares_sold": 1, "sale_price": 12.0, "tax_rate_sale": 0.47}
+    with pytest.raises(ValueError, match="Sale ID"):
+        Portfolio.from_grants([_grant(sales=[sale, sale])])
+
+def test_vest_sales_edit_keeps_other_vests():
+    portfolio = Portfolio.from_grants([_grant()]).with_derived_fields()
+    sale = {**portfolio.sale("G1", "V1", "S1"), "shares_sold": 5}
+    edited = portfolio.with_vest_sales("G1", "V1", [sale])
+    assert edited.sale("G1", "V1", "S1")["shares_sold"] == 5
+    assert edited.sale("G1", "V2", "S1") is portfolio.sale("G1", "V2", "S1")
+    # Untouched grants are shared, not copied
+    two = Portfolio.from_grants([_grant(), _grant("G2")])
+    assert two.with_vest_sales("G1", "V1", [sale]).sales["G2"] is two.sales["G2"]
+
+def test_derived_fields_keep_sales_of_every_vest():
+    portfolio = Portfolio.from_grants([_grant()]).with_derived_fields()
+    assert len(portfolio.sales["G1"]) == 2
+    assert all("capital_gains" in sale for sale in portfolio.sales["G1"].values())
+
+def test_backfill_fills_the_sale_of_the_right_vest():
+    grant = _grant()
+    grant["sales"][1]["sale_price"] = None
+    portfolio = Portfolio.from_grants([grant])
+    store = PriceStore.from_frame(pd.DataFrame({"symbol": ["ABC"], "date": [date(2023, 8, 1)], "close": [15.0]}))
+    filled, vests_filled, sales_filled = backfill_prices(portfolio, store)
+    assert (vests_filled, sales_filled) == (0, 1)
+    assert filled.sale("G1", "V2", "S1")["sale_price"] == 15.0
+    assert filled.sale("G1", "V1", "S1")["sale_price"] == 12.0
+
+def test_snapshot_restore_patches_only_changed_grants():
+    portfolio = Portfolio.from_grants([_grant(), _grant("G2")]).with_derived_fields()
+    edited = portfolio.with_grants([{**portfolio.grants["G1"], "num_stocks": 200}, portfolio.grants["G2"]])
+    restored = edited.restore(portfolio.snapshot())
+    assert restored.fingerprint() == portfolio.fingerprint()
+    assert restored.sales["G2"] is portfolio.sales["G2"]
@@ -0,0 +1,83 @@
+# test_profiling.py
+# Stage recording: per-thread recorders and the shared tracemalloc.
+
+import threading
+import tracemalloc
+
+import pytest
+
+from utils import profiling
+
+
+@pytest.fixture(autouse=True)
+def stopped():
+    profiling.stop()
+    yield
+    profiling.stop()
+    assert profiling._recording == 0 and profiling._tracing == 0
+
+
+def test_stages_are_recorded_only_while_started():
+    @profiling.timed
+    def work():
+        with profiling.stage("inner"):
+            return sum(range(1000))
+
+    work()
+    recorder = profiling.start()
+    work()
+    work()
+    assert profiling.stop() is recorder
+    work()
+    stages = {row["stage"]: row for row in recorder.to_dict()["stages"]}
+    assert stages["test_profiling.work"]["calls"] == 2 and stages["inner"]["calls"] == 2
+    assert stages["inner"]["peak_bytes"] is None
+    assert profiling.stop() is None
+
+def test_tracemalloc_runs_while_any_recorder_traces():
+    assert not tracemalloc.is_tracing()
+    first = threading.Event()
+    second_started = threading.Event()
+    done = threading.Event()
+
+    def session():
+        profiling.start(trace_memory=True)
+        first.set()
+        second_started.wait()
+        profiling.stop()
+        done.set()
+
+    thread = threading.Thread(target=session)
+    thread.start()
+    first.wait()
+    profiling.start(trace_memory=True)
+    second_started.set()
+    done.wait()
+    thread.join()
+    # The other session stopped; this one still traces
+    assert tracemalloc.is_tracing()
+    profiling.stop()
+    assert not tracemalloc.is_tracing()
+
+def test_tracing_started_elsewhere_is_left_on():
+    tracemalloc.start()
+    try:
+        profiling.start(trace_memory=True)
+        profiling.stop()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+def test_an_interrupted_rerun_stops_recording(monkeypatch):
+    import app
+
+    def interrupted(debug):
+        assert profiling._recording == 1 and tracemalloc.is_tracing()
+        # Streamlit stops a rerun by raising in the script thread
+        raise RuntimeError("rerun interrupted")
+
+    monkeypatch.setattr(app.st, "query_params", {"debug": "memory"})
+    monkeypatch.setattr(app, "render_app", interrupted)
+    with pytest.raises(RuntimeError):
+        app.main()
+    assert profiling._recording == 0 and not tracemalloc.is_tracing()
@@ -0,0 +1,82 @@
+# test_reconciliation.py
+# Share ledger checks, built in full and patched after edits.
+
+from datetime import date
+
+import pandas as pd
+
+from utils import reconciliation
+from utils.portfolio import Portfolio
+from utils.reconciliation import build_reconciliation, reconcile
+
+
+def _grant(grant_id, num_stocks=100, sales=()):
+    return {
+        "grant_id": grant_id, "grant_date": date(2021, 1, 1), "symbol": "ABC", "num_stocks": num_stocks,
+        "vests": [
+            {"vest_id": "V1", "vest_date": date(2021, 7, 1), "shares_vested": 50, "vest_price": 10.0, "tax_rate_vest": 0.47},
+            {"vest_id": "V2", "vest_date": date(2022, 7, 1), "shares_vested": 50, "vest_price": 11.0, "tax_rate_vest": 0.47},
+        ],
+        "sales": list(sales),
+    }
+
+def _sale(sale_id, vest_id, sale_date, shares_sold):
+    return {"sale_id": sale_id, "vest_id": vest_id, "sale_date": sale_date, "shares_sold": shares_sold, "sale_price": 12.0, "tax_rate_sale": 0.47}
+
+def _portfolio(*grants):
+    return Portfolio.from_grants(list(grants)).with_derived_fields()
+
+def _checks(issues):
+    return list(zip(issues["grant_id"], issues["vest_id"], issues["sale_id"], issues["check"]))
+
+def _assert_patched_matches_build(portfolio):
+    pd.testing.assert_frame_equal(reconcile(portfolio), build_reconciliation(portfolio))
+
+
+def test_a_consistent_ledger_has_no_issues():
+    portfolio = _portfolio(_grant("G1", sales=[_sale("S1", "V1", date(2022, 1, 1), 50), _sale("S2", "V2", date(2023, 1, 1), 10)]))
+    assert reconcile(portfolio).empty
+
+def test_each_check_is_reported_in_grant_order():
+    portfolio = _portfolio(
+        _grant("G2", sales=[_sale("S1", "V9", date(2022, 1, 1), 5)]),
+        _grant("G1", num_stocks=80, sales=[
+            _sale("S1", "V1", date(2022, 1, 1), 30),
+            _sale("S2", "V1", date(2022, 2, 1), 30),
+            _sale("S3", "V2", date(2022, 1, 1), 5),
+        ]),
+    )
+    issues = reconcile(portfolio)
+    assert _checks(issues) == [
+        ("G2", "V9", "S1", "orphan_sale"),
+        ("G1", None, None, "over_vested_grant"),
+        ("G1", "V2", "S3", "sale_before_vest"),
+        ("G1", "V1", "S2", "oversold_vest"),
+    ]
+    assert "sells 10 more shares" in issues["message"].iloc[-1]
+
+def test_edits_patch_only_the_changed_grants(monkeypatch):
+    builds, patched = [], []
+    monkeypatch.setattr(reconciliation, "build_reconciliation", lambda portfolio: builds.append(portfolio) or build_reconciliation(portfolio))
+    patch = reconciliation.patch_reconciliation
+    monkeypatch.setattr(reconciliation, "patch_reconciliation", lambda issues, portfolio, changed: patched.append(set(changed)) or patch(issues, portfolio, changed))
+
+    portfolio = _portfolio(_grant("G1"), _grant("G2", sales=[_sale("S1", "V1", date(2022, 1, 1), 50)]))
+    assert reconcile(portfolio).empty
+
+    oversold = portfolio.with_sales("G2", [_sale("S2", "V1", date(2022, 2, 1), 1)]).with_derived_fields(["G2"])
+    assert _checks(reconcile(oversold)) == [("G2", "V1", "S2", "oversold_vest")]
+    _assert_patched_matches_build(oversold)
+
+    # Fixing it clears the issue; G1 is not re-checked and keeps its (empty) result
+    fixed = oversold.with_vest_sales("G2", "V1", [_sale("S1", "V1", date(2022, 1, 1), 50)]).with_derived_fields(["G2"])
+    assert reconcile(fixed).empty
+    _assert_patched_matches_build(fixed)
+    assert len(builds) == 1 and patched == [{"G2"}, {"G2"}]
+
+def test_removed_grants_drop_their_issues():
+    portfolio = _portfolio(_grant("G1", num_stocks=10), _grant("G2"))
+    assert _checks(reconcile(portfolio)) == [("G1", None, None, "over_vested_grant")]
+    removed = portfolio.with_grants([portfolio.grants["G2"]])
+    assert reconcile(removed).empty
+    _assert_patched_matches_build(removed)
@@ -0,0 +1,136 @@
+# test_scenarios.py
+# Open lots, the what-if sale grid and the lot selection planner.
+
+from datetime import date
+from itertools import product
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import scenarios
+from utils.calculations import calculate_capital_gains_tax, calculate_tax_at_vest
+from utils.portfolio import Portfolio
+from utils.scenarios import SALE_STRATEGIES, compare_sale_strategies, open_lots, plan_sale, what_if_grid
+
+TAX_RATE = 0.47
+
+
+def _portfolio():
+    return Portfolio.from_grants([
+        {
+            "grant_id": "G1", "grant_date": date(2021, 1, 1), "symbol": "ABC", "num_stocks": 300,
+            "vests": [
+                {"vest_id": "V1", "vest_date": date(2021, 7, 1), "shares_vested": 100, "vest_price": 10.0, "tax_rate_vest": TAX_RATE},
+                {"vest_id": "V2", "vest_date": date(2022, 7, 1), "shares_vested": 100, "vest_price": 20.0, "tax_rate_vest": TAX_RATE},
+                {"vest_id": "V3", "vest_date": date(2023, 7, 1), "shares_vested": 100, "vest_price": 15.0, "tax_rate_vest": TAX_RATE},
+            ],
+            "sales": [
+                {"sale_id": "S1", "vest_id": "V1", "sale_date": date(2022, 1, 1), "shares_sold": 100, "sale_price": 12.0, "tax_rate_sale": TAX_RATE},
+                {"sale_id": "S2", "vest_id": "V2", "sale_date": date(2023, 1, 1), "shares_sold": 40, "sale_price": 18.0, "tax_rate_sale": TAX_RATE},
+            ],
+        },
+        {
+            "grant_id": "G2", "grant_date": date(2021, 1, 1), "symbol": "XYZ", "num_stocks": 50,
+            "vests": [{"vest_id": "V1", "vest_date": date(2022, 1, 1), "shares_vested": 50, "vest_price": 5.0, "tax_rate_vest": TAX_RATE}],
+            "sales": [],
+        },
+    ]).with_derived_fields()
+
+def _reference_grid(lots, sale_prices, sale_dates):
+    # One lot and one cell at a time with the scalar tax helpers
+    rows = []
+    for sale_date in sale_dates:
+        for sale_price in sale_prices:
+            row = {"shares": 0, "proceeds": 0.0, "capital_gains": 0.0, "tax": 0.0}
+            for lot in lots.itertuples():
+                holding_period = (pd.Timestamp(sale_date) - pd.Timestamp(lot.vest_date)).days
+                if holding_period < 0:
+                    continue
+                shares = lot.remaining_shares
+                if holding_period <= 30:
+                    tax = calculate_tax_at_vest(shares, sale_price, TAX_RATE)
+                else:
+                    tax = calculate_capital_gains_tax(sale_price, lot.vest_price, shares, TAX_RATE, holding_period > 365, holding_period)
+                row["shares"] += shares
+                row["proceeds"] += shares * sale_price
+                row["capital_gains"] += (sale_price - lot.vest_price) * shares
+                row["tax"] += tax
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def test_open_lots_are_the_unsold_shares():
+    lots = open_lots(_portfolio())
+    assert list(zip(lots["grant_id"], lots["vest_id"], lots["remaining_shares"])) == [("G1", "V2", 60), ("G1", "V3", 100), ("G2", "V1", 50)]
+    assert list(open_lots(_portfolio(), "XYZ")["grant_id"]) == ["G2"]
+
+def test_grid_matches_the_scalar_tax_rules():
+    lots = open_lots(_portfolio(), "ABC")
+    sale_prices = [8.0, 16.0, 30.0]
+    # Before V3 vests, within 30 days of it, and more than a year after both
+    sale_dates = [date(2023, 6, 1), date(2023, 7, 20), date(2024, 12, 1)]
+    grid = what_if_grid(lots, sale_prices, sale_dates, TAX_RATE)
+    assert list(zip(grid["sale_date"].dt.date, grid["sale_price"])) == [(d, p) for d in sale_dates for p in sale_prices]
+
+    expected = _reference_grid(lots, sale_prices, sale_dates)
+    for column in ["shares", "proceeds", "capital_gains", "tax"]:
+        np.testing.assert_allclose(grid[column].to_numpy(), expected[column].to_numpy())
+    assert (grid["net_proceeds"] == grid["proceeds"] - grid["tax"]).all()
+    assert grid.loc[grid["sale_date"].dt.date == date(2024, 12, 1), "discounted_shares"].eq(160).all()
+
+def test_chunked_grid_matches_one_pass(monkeypatch):
+    lots = open_lots(_portfolio())
+    args = (lots, [5.0, 25.0], [date(2023, 8, 1), date(2025, 1, 1)], TAX_RATE)
+    whole = what_if_grid(*args)
+    monkeypatch.setattr(scenarios, "GRID_CHUNK_CELLS", 1)
+    pd.testing.assert_frame_equal(what_if_grid(*args), whole)
+
+def test_grid_without_lots_is_all_zero():
+    grid = what_if_grid(open_lots(_portfolio(), "NONE"), [10.0], [date(2024, 1, 1)], TAX_RATE)
+    assert len(grid) == 1 and grid[["shares", "proceeds", "tax"]].eq(0).all(axis=None)
+
+def _plan(strategy, shares=80, sale_date=date(2024, 12, 1), sale_price=16.0):
+    plan = plan_sale(open_lots(_portfolio(), "ABC"), shares, sale_date, sale_price, TAX_RATE, strategy)
+    return list(zip(plan["vest_id"], plan["shares_sold"]))
+
+def test_strategies_draw_from_lots_in_their_order():
+    assert _plan("fifo") == [("V2", 60), ("V3", 20)]
+    assert _plan("lifo") == [("V3", 80)]
+    assert _plan("highest_cost") == [("V2", 60), ("V3", 20)]
+    # V2 (bought at 20) is sold at a loss, so it is untaxed and goes first
+    assert _plan("min_tax") == [("V2", 60), ("V3", 20)]
+
+def test_min_tax_beats_every_other_split():
+    lots = open_lots(_portfolio(), "ABC")
+    for sale_date, sale_price in product([date(2023, 7, 15), date(2024, 3, 1), date(2024, 12, 1)], [12.0, 18.0, 40.0]):
+        best = plan_sale(lots, 100, sale_date, sale_price, TAX_RATE, "min_tax")["tax"].sum()
+        # Every split of the 100 shares between V2 (60 left) and V3 (100 left), in steps of 10
+        for v2 in range(0, 61, 10):
+            tax = sum(
+                plan_sale(lots[lots["vest_id"] == vest_id], shares, sale_date, sale_price, TAX_RATE, "fifo")["tax"].sum()
+                for vest_id, shares in (("V2", v2), ("V3", 100 - v2)) if shares
+            )
+            assert best <= tax + 1e-9
+
+def test_plan_rows_carry_the_sale_totals():
+    plan = plan_sale(open_lots(_portfolio(), "ABC"), 80, date(2024, 12, 1), 16.0, TAX_RATE, "fifo")
+    assert list(plan.columns) == scenarios.PLAN_COLUMNS
+    assert plan["proceeds"].tolist() == [60 * 16.0, 20 * 16.0]
+    assert plan["capital_gains"].tolist() == [60 * (16.0 - 20.0), 20 * (16.0 - 15.0)]
+    assert plan["tax"].tolist() == [0.0, calculate_capital_gains_tax(16.0, 15.0, 20, TAX_RATE, True, int(plan["holding_period"].iloc[1]))]
+
+def test_lots_vesting_after_the_sale_are_not_used():
+    assert _plan("lifo", shares=60, sale_date=date(2023, 1, 1)) == [("V2", 60)]
+    with pytest.raises(ValueError, match="Only 60 shares"):
+        _plan("fifo", shares=61, sale_date=date(2023, 1, 1))
+
+def test_unknown_strategy_is_rejected():
+    with pytest.raises(ValueError, match="Unknown strategy"):
+        _plan("random")
+
+def test_comparison_has_one_row_per_strategy():
+    comparison = compare_sale_strategies(open_lots(_portfolio(), "ABC"), 80, date(2024, 12, 1), 16.0, TAX_RATE)
+    assert comparison["strategy"].tolist() == list(SALE_STRATEGIES)
+    assert comparison.set_index("strategy").loc["min_tax", "Tax"] == comparison["Tax"].min()
+    assert (comparison["Net Proceeds"] == comparison["Proceeds"] - comparison["Tax"]).all()
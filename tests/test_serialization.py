@@ -0,0 +1,44 @@
+# test_serialization.py
+# JSON and Parquet exports read back to the same portfolio.
+
+import io
+from datetime import date
+
+import pytest
+
+from utils.portfolio import Portfolio
+from utils.serialization import iter_file_grants, portfolio_to_json, portfolio_to_parquet
+
+
+def _grants(grant_ids, vest_ids, sale_ids):
+    return [
+        {
+            "grant_id": grant_id, "grant_date": date(2021, 3, 1), "symbol": "ABC", "num_stocks": 100,
+            "vests": [{"vest_id": vest_id, "vest_date": date(2021, 9, 1), "shares_vested": 25, "vest_price": 20.0, "tax_rate_vest": 0.47}],
+            "sales": [{"sale_id": sale_id, "vest_id": vest_id, "sale_date": date(2022, 10, 1), "shares_sold": 10, "sale_price": 25.0, "tax_rate_sale": 0.47}],
+        }
+        for grant_id, vest_id, sale_id in zip(grant_ids, vest_ids, sale_ids)
+    ]
+
+IDS = {
+    "int": ([1, 2], [1, 2], [1, 2]),
+    "str": (["A", "B"], ["V1", "V2"], ["S1", "S2"]),
+    "mixed": ([1, "B"], ["V1", 2], [3, "S2"]),
+}
+
+
+@pytest.mark.parametrize("export", [portfolio_to_json, portfolio_to_parquet])
+@pytest.mark.parametrize("ids", list(IDS))
+def test_round_trip(export, ids):
+    portfolio = Portfolio.from_grants(_grants(*IDS[ids])).with_derived_fields()
+    data = export(portfolio)
+    stream = io.BytesIO(data.encode() if isinstance(data, str) else data)
+    loaded = Portfolio.from_grants(iter_file_grants(stream)).with_derived_fields()
+    assert loaded.to_grants() == portfolio.to_grants()
+    assert [type(grant_id) for grant_id in loaded.grants] == [type(grant_id) for grant_id in portfolio.grants]
+
+def test_parquet_rejects_unstorable_mixed_column():
+    grants = _grants(*IDS["int"])
+    grants[0]["note"], grants[1]["note"] = 1, "text"
+    with pytest.raises(ValueError, match="note"):
+        portfolio_to_parquet(Portfolio.from_grants(grants))
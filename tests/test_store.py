@@ -0,0 +1,113 @@
+# test_store.py
+# PortfolioStore round-trips, incremental saves, partial loads and refreshes.
+
+import sqlite3
+from datetime import date
+
+import pytest
+
+from utils.facts import lot_facts
+from utils.portfolio import Portfolio
+from utils.store import PortfolioStore
+
+
+def _portfolio(grant_id=1, vest_id=1, sale_id=1):
+    return Portfolio.from_grants([{
+        "grant_id": grant_id, "grant_date": date(2022, 1, 1), "symbol": "ABC", "num_stocks": 100,
+        "vests": [{"vest_id": vest_id, "vest_date": date(2022, 7, 1), "shares_vested": 50, "vest_price": 10.0, "tax_rate_vest": 0.47}],
+        "sales": [{"sale_id": sale_id, "vest_id": vest_id, "sale_date": date(2023, 8, 1), "shares_sold": 20, "sale_price": 12.5, "tax_rate_sale": 0.47}],
+    }]).with_derived_fields()
+
+@pytest.fixture
+def store(tmp_path):
+    return PortfolioStore(str(tmp_path / "rsu.db"))
+
+
+@pytest.mark.parametrize("ids", [(1, 1, 1), ("G1", "V1", "S1"), (7, "V1", 3)])
+def test_round_trip_keeps_ids_and_lots(store, ids):
+    portfolio = _portfolio(*ids)
+    store.save(portfolio)
+    loaded = store.load()
+    assert loaded.to_grants() == portfolio.to_grants()
+    assert loaded.fingerprint() == portfolio.fingerprint()
+
+def test_save_rewrites_only_changed_grants(store):
+    portfolio = Portfolio.from_grants([
+        {**_portfolio(grant_id).to_grants()[0]} for grant_id in (1, "two", 3)
+    ])
+    assert store.save(portfolio) == 3
+    assert store.save(portfolio) == 0
+    edited = portfolio.with_grants([{**portfolio.grants[1], "num_stocks": 200}, portfolio.grants["two"], portfolio.grants[3]])
+    assert store.save(edited) == 1
+    assert store.load().grants[1]["num_stocks"] == 200
+
+def test_removed_and_reordered_grants(store):
+    portfolio = Portfolio.from_grants([_portfolio(grant_id).to_grants()[0] for grant_id in (1, 2, 3)])
+    store.save(portfolio)
+    reordered = Portfolio.from_grants([_portfolio(grant_id).to_grants()[0] for grant_id in (3, 1)])
+    assert store.save(reordered) == 0
+    assert list(store.load().grants) == [3, 1]
+    assert len(store.load().vests[1]) == 1
+
+def test_named_portfolios_are_separate(store):
+    store.save(_portfolio(1), "a")
+    store.save(_portfolio("x"), "b")
+    assert store.portfolios() == ["a", "b"]
+    store.delete("a")
+    assert store.portfolios() == ["b"]
+    assert list(store.load("b").grants) == ["x"]
+
+def _grants(*grant_ids):
+    return Portfolio.from_grants([_portfolio(grant_id).to_grants()[0] for grant_id in grant_ids])
+
+def test_partial_load_reads_only_the_given_grants(store):
+    store.save(_grants(1, "two", 3))
+    partial = store.load(grant_ids=[3, 1])
+    assert list(partial.grants) == [1, 3]
+    assert partial.to_grants() == _grants(1, 3).to_grants()
+    assert store.load(grant_ids=[]).grants == {}
+    assert list(store.grant_fingerprints()) == ["1", "two", "3"]
+
+def test_refresh_loads_only_what_another_session_saved(store, monkeypatch):
+    mine = _grants(1, 2, 3)
+    store.save(mine)
+    assert store.refresh(mine) is mine
+
+    # Another session edits grant 2, drops grant 3 and adds grant 4
+    theirs = store.load()
+    theirs = theirs.with_grants([theirs.grants[1], {**theirs.grants[2], "num_stocks": 200}, _grants(4).grants[4]])
+    store.save(theirs)
+
+    lot_facts(mine)
+    loads = []
+    load = store.load
+    monkeypatch.setattr(store, "load", lambda name="default", grant_ids=None: loads.append(grant_ids) or load(name, grant_ids))
+    refreshed = store.refresh(mine)
+    assert loads == [["2", "4"]]
+    assert refreshed.to_grants() == theirs.to_grants()
+    assert refreshed.fingerprint() == theirs.fingerprint()
+    # Untouched grants keep their rows
+    assert refreshed.vests[1] is mine.vests[1]
+    assert lot_facts(refreshed).equals(lot_facts(theirs))
+
+    # Caught up, a save of this session's edit leaves the other session's grants alone
+    edited = refreshed.with_grants([{**refreshed.grants[1], "num_stocks": 300}, refreshed.grants[2], refreshed.grants[4]])
+    assert store.save(edited) == 1
+    assert store.load().grants[2]["num_stocks"] == 200
+
+def test_files_with_the_earlier_tables_still_save(tmp_path):
+    path = str(tmp_path / "old.db")
+    with sqlite3.connect(path) as conn:
+        conn.executescript("""
+            CREATE TABLE grants (portfolio TEXT NOT NULL, grant_id TEXT NOT NULL, seq INTEGER NOT NULL, fingerprint TEXT NOT NULL,
+                grant_date TEXT, symbol TEXT, num_stocks INTEGER, data TEXT NOT NULL, PRIMARY KEY (portfolio, grant_id));
+            CREATE TABLE vests (portfolio TEXT NOT NULL, grant_id TEXT NOT NULL, vest_id TEXT NOT NULL, seq INTEGER NOT NULL,
+                vest_date TEXT, financial_year TEXT, shares_vested INTEGER, vest_price REAL, tax_at_vest REAL, data TEXT NOT NULL,
+                PRIMARY KEY (portfolio, grant_id, vest_id));
+            CREATE INDEX vests_financial_year ON vests (portfolio, financial_year);
+        """)
+    store = PortfolioStore(path)
+    store.save(_portfolio())
+    assert store.load().to_grants() == _portfolio().to_grants()
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'vests_financial_year'").fetchall() == []
@@ -0,0 +1,70 @@
+# test_validation.py
+# Editor table validation: which checks block a save and which rows are left out.
+
+import datetime
+
+import pandas as pd
+
+from utils.validation import blocking_errors, saved_rows, validate_grants, validate_sales, validate_vests
+
+VEST_DATE = datetime.date(2023, 1, 1)
+
+
+def _sales(*sale_ids):
+    return pd.DataFrame({
+        "Sale ID": list(sale_ids),
+        "Sale Date": [datetime.date(2023, 6, 1)] * len(sale_ids),
+        "Shares Sold": [10] * len(sale_ids),
+        "Sale Price": [12.5] * len(sale_ids),
+        "Tax Rate at Sale (%)": [30.0] * len(sale_ids),
+    })
+
+def _vests(*vest_ids):
+    return pd.DataFrame({
+        "Vest ID": list(vest_ids),
+        "Vest Date": [VEST_DATE] * len(vest_ids),
+        "Shares Vested": [100] * len(vest_ids),
+        "Vest Price": [10.0] * len(vest_ids),
+        "Tax Rate at Vest (%)": [30.0] * len(vest_ids),
+    })
+
+
+def test_valid_tables_have_no_errors():
+    assert validate_sales(_sales("S1"), _sales("S1", "S2"), "G1", "V1", VEST_DATE).empty
+    assert validate_vests(_vests("V1"), _vests("V1", "V2"), "G1").empty
+
+def test_sale_ids_are_only_unique_within_a_vest():
+    # Another vest's "S1" is no concern of this vest's table
+    errors = validate_sales(_sales(), _sales("S1"), "G1", "V2", VEST_DATE)
+    assert errors.empty
+
+def test_duplicate_sale_id_skips_the_row_but_not_the_save():
+    edited = _sales("S1", "S2", "S1")
+    errors = validate_sales(_sales("S1", "S2"), edited, "G1", "V1", VEST_DATE)
+    assert errors[["row", "check"]].values.tolist() == [[3, "duplicate_id"]]
+    assert blocking_errors(errors).empty
+    assert saved_rows(edited, errors)["Sale ID"].tolist() == ["S1", "S2"]
+
+def test_duplicate_vest_id_skips_the_row_but_not_the_save():
+    edited = _vests("V1", "V1")
+    errors = validate_vests(_vests("V1"), edited, "G1")
+    assert errors["check"].tolist() == ["duplicate_id"]
+    assert blocking_errors(errors).empty
+    assert saved_rows(edited, errors)["Vest ID"].tolist() == ["V1"]
+
+def test_duplicate_grant_id_blocks_the_save():
+    grants = pd.DataFrame({
+        "Grant ID": ["G1", "G1"],
+        "Grant Date": [datetime.date(2022, 1, 1)] * 2,
+        "Symbol": ["ABC"] * 2,
+        "Number of Stocks": [100, 100],
+    })
+    errors = validate_grants(grants.iloc[:1], grants)
+    assert blocking_errors(errors)["check"].tolist() == ["duplicate_id"]
+
+def test_invalid_rows_still_block():
+    edited = _sales("S1")
+    edited.loc[0, "Sale Date"] = datetime.date(2022, 6, 1)
+    errors = validate_sales(_sales(), edited, "G1", "V1", VEST_DATE)
+    assert blocking_errors(errors)["check"].tolist() == ["sale_before_vest"]
+    assert saved_rows(edited, errors) is edited
@@ -0,0 +1,208 @@
+# broker.py
+# Bulk import of brokerage CSV statements (vest/release and sale activity).
+# Files are read in chunks; a profile maps the broker's column names and activity
+# labels to ours, and dates, share counts and prices are parsed a column at a
+# time. Vests are grouped into grants, and sales (which statements don't tie to a
+# vest) are matched to vests first-in, first-out per symbol with a sorted merge of
+# the cumulative shares vested and sold.
+
+import numpy as np
+import pandas as pd
+
+from utils.portfolio import Portfolio, sale_key, vest_key
+from utils.profiling import timed
+
+CHUNK_ROWS = 100_000
+VEST, SALE = "vest", "sale"
+FIELDS = ["event", "date", "symbol", "grant_id", "shares", "price"]
+# Profiles: `columns` maps our fields to the broker's headers (grant_id is optional:
+# without it each symbol is one grant), `events` maps activity labels (any case)
+# to VEST or SALE (other activity is skipped) and `date_format` is a strptime format,
+# or None to infer it.
+BROKER_PROFILES = {
+    "Generic": {
+        "columns": {"event": "Type", "date": "Date", "symbol": "Symbol", "grant_id": "Grant ID", "shares": "Quantity", "price": "Price"},
+        "events": {"vest": VEST, "sale": SALE},
+        "date_format": "%Y-%m-%d",
+    },
+    "Award Activity (US)": {
+        "columns": {"event": "Action", "date": "Date", "symbol": "Symbol", "grant_id": "Award ID", "shares": "Quantity", "price": "Price"},
+        "events": {"release": VEST, "deposit": VEST, "sale": SALE, "sell": SALE},
+        "date_format": "%m/%d/%Y",
+    },
+}
+
+
+def _numbers(column):
+    # Plain numbers parse directly; "$1,234.50", "1 234.50" and "(12.00)" style values are cleaned first
+    values = pd.to_numeric(column, errors="coerce")
+    messy = values.isna() & column.notna()
+    if messy.any():
+        text = column[messy].str.replace(r"[$,\s]", "", regex=True)
+        negative = text.str.startswith("(") & text.str.endswith(")")
+        cleaned = pd.to_numeric(text.str.strip("()"), errors="coerce")
+        values[messy] = cleaned.where(~negative, -cleaned)
+    return values
+
+def _normalized(column, normalize):
+    # Labels repeat (a few symbols, activity types and grants), so each distinct one is normalized once
+    return column.map({value: normalize(value) for value in column.dropna().unique()})
+
+def _parse_chunk(chunk, profile, first_line):
+    columns = profile["columns"]
+    chunk = chunk.rename(columns=lambda name: str(name).strip())
+    missing = [header for field, header in columns.items() if field != "grant_id" and header not in chunk]
+    if missing:
+        raise ValueError(f"Statement has no {', '.join(missing)} column.")
+
+    labels = {label.lower(): event for label, event in profile["events"].items()}
+    events = _normalized(chunk[columns["event"]], lambda value: labels.get(value.strip().lower()))
+    keep = events.notna().to_numpy()
+    chunk = chunk[keep]
+    symbol = _normalized(chunk[columns["symbol"]], lambda value: value.strip().upper())
+    grant_header = columns.get("grant_id")
+    grant_id = _normalized(chunk[grant_header], lambda value: value.strip() or None) if grant_header in chunk else pd.Series(None, index=chunk.index, dtype=object)
+    return pd.DataFrame({
+        "event": events[keep],
+        "date": pd.to_datetime(chunk[columns["date"]], format=profile.get("date_format"), errors="coerce"),
+        "symbol": symbol,
+        "grant_id": grant_id.fillna(symbol),
+        "shares": _numbers(chunk[columns["shares"]]).abs(),
+        "price": _numbers(chunk[columns["price"]]),
+        # Line numbers of the file (the header is line 1), for error messages
+        "line": first_line + np.flatnonzero(keep),
+    })
+
+@timed
+def read_statements(sources, profile, chunk_rows=CHUNK_ROWS):
+    """Vest and sale activity of broker CSV files (paths or file objects) as one typed frame.
+
+    Columns: event, date, symbol, grant_id, shares, price, plus file and line for
+    error messages. Rows of other activity are skipped. Raises ValueError on a
+    missing column or on vest/sale rows without a valid date, shares or price.
+    """
+    frames = []
+    for source in sources:
+        name = getattr(source, "name", None) or str(source)
+        first_line = 2
+        for chunk in pd.read_csv(source, dtype=str, chunksize=chunk_rows, skipinitialspace=True):
+            frames.append(_parse_chunk(chunk, profile, first_line).assign(file=name))
+            first_line += len(chunk)
+    activity = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=FIELDS + ["line", "file"])
+
+    # Share counts must be whole, as in the editors
+    invalid = activity["date"].isna() | activity["symbol"].isna() | ~(activity["shares"] > 0) | (activity["shares"] % 1 != 0) | ~(activity["price"] >= 0)
+    if invalid.any():
+        bad = activity[invalid]
+        lines = ", ".join(f"{file} line {line}" for file, line in zip(bad["file"][:5], bad["line"][:5]))
+        raise ValueError(f"{invalid.sum()} vest or sale row(s) have a missing or invalid date, symbol, quantity or price ({lines}).")
+    return activity
+
+def match_sales_to_vests(vests, sales):
+    """Split and match sales to the vests they sold, first-in, first-out per symbol.
+
+    `vests` and `sales` have symbol, date and shares columns. The shares of each
+    symbol's vests (oldest first) and sales (earliest first) are laid end to end;
+    a sale takes the vest shares its range overlaps, found with one searchsorted
+    over both sorted ranges. Returns (sale row, vest row, shares) arrays, one entry
+    per piece of a sale, with positions into `sales` and `vests`. Raises ValueError
+    if a symbol sells more shares than have vested, or sells shares before they vest.
+    """
+    codes, symbols = pd.factorize(pd.concat([vests["symbol"], sales["symbol"]], ignore_index=True), sort=True)
+    vest_codes, sale_codes = codes[:len(vests)], codes[len(vests):]
+    vest_order = np.lexsort((vests["date"].to_numpy(), vest_codes))
+    sale_order = np.lexsort((sales["date"].to_numpy(), sale_codes))
+    vest_shares = vests["shares"].to_numpy(dtype=np.int64)[vest_order]
+    sale_shares = sales["shares"].to_numpy(dtype=np.int64)[sale_order]
+
+    # Each symbol's shares start past all shares of the symbols before it, so the
+    # ranges of every symbol fit in one sorted axis
+    stride = int(vest_shares.sum() + sale_shares.sum()) + 1
+    vest_offset = vest_codes[vest_order].astype(np.int64) * stride
+    sale_offset = sale_codes[sale_order].astype(np.int64) * stride
+    vest_end = vest_offset + _cumsum_by(vest_offset, vest_shares)
+    vest_start = vest_end - vest_shares
+    sale_end = sale_offset + _cumsum_by(sale_offset, sale_shares)
+    sale_start = sale_end - sale_shares
+
+    # First vest ending after the sale starts, last vest starting before it ends
+    first = np.searchsorted(vest_end, sale_start, side="right")
+    last = np.searchsorted(vest_start, sale_end, side="left") - 1
+    # A sale past its symbol's vested shares ends beyond the last vest of that symbol
+    covered = (last >= 0) & (vest_end[np.clip(last, 0, None)] >= sale_end) & (vest_offset[np.clip(last, 0, None)] == sale_offset) if len(vest_end) else np.zeros(len(sale_end), dtype=bool)
+    if not covered.all():
+        raise ValueError(f"Sales of {symbols[sale_codes[sale_order][np.argmin(covered)]]} exceed the shares vested.")
+
+    pieces = last - first + 1
+    sale_piece = np.repeat(np.arange(len(sale_end)), pieces)
+    # first, first + 1, ..., last for every sale
+    vest_piece = np.repeat(first, pieces) + np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    shares = np.minimum(sale_end[sale_piece], vest_end[vest_piece]) - np.maximum(sale_start[sale_piece], vest_start[vest_piece])
+
+    sale_rows, vest_rows = sale_order[sale_piece], vest_order[vest_piece]
+    early = sales["date"].to_numpy()[sale_rows] < vests["date"].to_numpy()[vest_rows]
+    if early.any():
+        row = sale_rows[np.argmax(early)]
+        raise ValueError(f"Sale of {sales['symbol'].iloc[row]} on {sales['date'].iloc[row]:%Y-%m-%d} sells more shares than had vested by then.")
+    return sale_rows, vest_rows, shares
+
+def _cumsum_by(offsets, values):
+    # Running total of `values`, restarting wherever `offsets` changes
+    totals = np.cumsum(values)
+    if not len(values):
+        return totals
+    starts = np.flatnonzero(np.append(True, offsets[1:] != offsets[:-1]))
+    return totals - np.repeat(totals[starts] - values[starts], np.diff(np.append(starts, len(values))))
+
+@timed
+def statements_to_portfolio(activity, tax_rate):
+    """Portfolio of the vests and sales in a read_statements frame.
+
+    Grants are the broker's grant/award IDs (or the symbol), with the earliest vest
+    date as grant date and the shares vested as number of stocks. Vest and sale IDs
+    are numbered per grant in date order. Broker statements carry no marginal tax
+    rate, so `tax_rate` (a fraction) is used for every vest and sale.
+    """
+    vests = activity[activity["event"] == VEST].sort_values(["grant_id", "date"], kind="mergesort", ignore_index=True)
+    if vests.empty:
+        raise ValueError("No vests found in the statements.")
+    sales = activity[activity["event"] == SALE].reset_index(drop=True)
+    vests["vest_id"] = (vests.groupby("grant_id", sort=False).cumcount() + 1).astype(str)
+
+    sale_rows, vest_rows, shares = match_sales_to_vests(vests, sales)
+    sales = pd.DataFrame({
+        "grant_id": vests["grant_id"].to_numpy()[vest_rows],
+        "vest_id": vests["vest_id"].to_numpy()[vest_rows],
+        "sale_date": sales["date"].to_numpy()[sale_rows],
+        "shares_sold": shares,
+        "sale_price": sales["price"].to_numpy()[sale_rows],
+        "tax_rate_sale": tax_rate,
+    }).sort_values(["grant_id", "sale_date"], kind="mergesort", ignore_index=True)
+    sales["sale_id"] = (sales.groupby("grant_id", sort=False).cumcount() + 1).astype(str)
+    sales["sale_date"] = sales["sale_date"].dt.date
+    sales = sales[["grant_id", "sale_id", "vest_id", "sale_date", "shares_sold", "sale_price", "tax_rate_sale"]]
+
+    grants = vests.groupby("grant_id", sort=False).agg(grant_date=("date", "min"), symbol=("symbol", "first"), num_stocks=("shares", "sum")).reset_index()
+    grants["grant_date"] = grants["grant_date"].dt.date
+    grants["num_stocks"] = grants["num_stocks"].astype(int)
+    vests = pd.DataFrame({
+        "grant_id": vests["grant_id"],
+        "vest_id": vests["vest_id"],
+        "vest_date": vests["date"].dt.date,
+        "shares_vested": vests["shares"].astype(int),
+        "vest_price": vests["price"],
+        "tax_rate_vest": tax_rate,
+    })
+
+    grant_rows = {row["grant_id"]: row for row in grants.to_dict("records")}
+    return Portfolio(grant_rows, _partition(vests, vest_key, grant_rows), _partition(sales, sale_key, grant_rows))
+
+def _partition(df, key, grant_rows):
+    # grant_id -> {key(row): row without grant_id}, for every grant
+    partitions = {grant_id: {} for grant_id in grant_rows}
+    fields = [column for column in df.columns if column != "grant_id"]
+    # Zipping whole columns is much faster than DataFrame.to_dict("records")
+    for grant_id, values in zip(df["grant_id"].tolist(), zip(*(df[field].tolist() for field in fields))):
+        row = dict(zip(fields, values))
+        partitions[grant_id][key(row)] = row
+    return partitions
@@ -0,0 +1,134 @@
+# cache.py
+# Size-bounded LRU cache for computed charts and tables.
+# Entries are keyed by (view name, portfolio fingerprint), so a rerun where the
+# data has not changed reuses the figure/table objects built earlier. Keys are
+# content addresses and cached values are never modified, so one cache can be
+# shared by every session of the process.
+
+import threading
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# For a cache shared by every session of the process
+SHARED_MAX_BYTES = 256 * 1024 * 1024
+
+
+def estimate_size(value):
+    """Approximate in-memory size of a cached value in bytes."""
+    if value is None:
+        return 0
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if hasattr(value, "to_json"):
+        # Plotly figures: the serialized spec is what dominates their footprint
+        return len(value.to_json())
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_size(item) for item in value)
+    return 64
+
+
+class ResultCache:
+    """LRU cache evicting the least recently used entries once `max_bytes` is exceeded.
+
+    Keeps hit/miss/eviction counters; see `stats()`. Safe to share between
+    threads: values are built outside the lock, so two threads missing the same
+    key at once may both build it (the last one is kept).
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_build(self, key, build):
+        """Return the cached value for `key`, calling `build()` to create it on a miss."""
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            self.misses += 1
+
+        value = build()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        size = estimate_size(value)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return  # Too large to ever fit; hand it back uncached
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class InternPool:
+    """One shared instance per content key, held weakly.
+
+    `intern(key, value)` returns the instance already registered under `key` if
+    one is still alive, else registers `value`. Sessions holding equal immutable
+    objects (e.g. the same portfolio) then hold one copy, along with everything
+    cached on it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._instances = weakref.WeakValueDictionary()
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._instances)
+
+    def intern(self, key, value):
+        with self._lock:
+            shared = self._instances.get(key)
+            if shared is not None:
+                if shared is not value:
+                    self.hits += 1
+                return shared
+            self._instances[key] = value
+            return value
+
+    def stats(self):
+        return {"instances": len(self._instances), "hits": self.hits}
+
+
+def cached_view(cache, builder, portfolio, *args):
+    """`builder(portfolio, *args)`, reused from `cache` while the portfolio content is unchanged."""
+    return cache.get_or_build((builder.__name__, portfolio.fingerprint(), *args), lambda: builder(portfolio, *args))
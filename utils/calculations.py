@@ -1,19 +1,35 @@
 # calculations.py
 # Changes:
-# 1. No changes made. All functionality remains the same.
+# 1. Added a columnar tax engine (calculate_vest_taxes, calculate_sale_taxes,
+#    calculate_lot_taxes) that works on whole vests/sales tables at once.
+# 2. The scalar helpers are kept as they were (same results and return types);
+#    the column-wise rules apply the same arithmetic in the same order.
+
+import numpy as np
+import pandas as pd
+
+# Sales made within this many days of vesting are taxed as income at vest.
+WITHIN_30_DAYS = 30
+# Assets held longer than this many days get the 50% CGT discount.
+CGT_DISCOUNT_DAYS = 365
+CGT_DISCOUNT = 0.5
+
+VEST_COLUMNS = ["grant_id", "vest_id", "vest_date", "shares_vested", "vest_price", "tax_rate_vest"]
+SALE_COLUMNS = ["grant_id", "sale_id", "vest_id", "sale_date", "shares_sold", "sale_price", "tax_rate_sale"]
+
 
 def calculate_tax_at_vest(shares_vested, vest_price, tax_rate):
     return shares_vested * vest_price * tax_rate
 
 def calculate_capital_gains_tax(sale_price, vest_price, shares_sold, tax_rate, held_over_year, days_between_vest_and_sale):
-    if days_between_vest_and_sale <= 30:
+    if days_between_vest_and_sale <= WITHIN_30_DAYS:
         capital_gains_tax = 0
     else:
-        capital_gains = (sale_price - vest_price) * shares_sold
+        capital_gains = calculate_gains_at_sale(sale_price, vest_price, shares_sold)
         if capital_gains > 0:
             capital_gains_tax = capital_gains * tax_rate
             if held_over_year:
-                capital_gains_tax *= 0.5
+                capital_gains_tax *= CGT_DISCOUNT
         else:
             capital_gains_tax = 0
     return capital_gains_tax
@@ -21,3 +37,77 @@ def calculate_capital_gains_tax(sale_price, vest_price, shares_sold, tax_rate, h
 def calculate_gains_at_sale(sale_price, vest_price, shares_sold):
     capital_gains_at_sale = (sale_price - vest_price) * shares_sold
     return capital_gains_at_sale
+
+
+# --- Column-wise rules ---
+# Each rule accepts scalars, NumPy arrays or pandas Series and applies the
+# arithmetic in the same order as the scalar helpers, so per-lot results are
+# bit-for-bit identical.
+
+def capital_gains_tax_columns(sale_price, vest_price, shares_sold, tax_rate, held_over_year, holding_period):
+    capital_gains = calculate_gains_at_sale(np.asarray(sale_price, dtype=float), np.asarray(vest_price, dtype=float), np.asarray(shares_sold))
+    tax = np.where(capital_gains > 0, capital_gains * np.asarray(tax_rate, dtype=float), 0.0)
+    tax = np.where(np.asarray(held_over_year, dtype=bool), tax * CGT_DISCOUNT, tax)
+    return np.where(np.asarray(holding_period) <= WITHIN_30_DAYS, 0.0, tax)
+
+def holding_period_days(sale_date, vest_date):
+    """Days between vest and sale for date-like scalars or columns."""
+    delta = pd.to_datetime(pd.Series(sale_date)) - pd.to_datetime(pd.Series(vest_date))
+    return delta.dt.days.to_numpy()
+
+
+# --- Batch engine ---
+
+def calculate_vest_taxes(vests):
+    """Return a copy of the vests table with a `tax_at_vest` column."""
+    vests = vests.copy()
+    vests["tax_at_vest"] = calculate_tax_at_vest(
+        vests["shares_vested"].to_numpy(dtype=float),
+        vests["vest_price"].to_numpy(dtype=float),
+        vests["tax_rate_vest"].to_numpy(dtype=float),
+    )
+    return vests
+
+def calculate_sale_taxes(sales, vests):
+    """Join every sale to its vest and add the derived tax columns.
+
+    Added columns: vest_date, vest_price, vest_found, holding_period,
+    held_over_year, capital_gains, capital_gains_tax, tax_within_30_days
+    (NaN unless sold within 30 days) and tax_at_sale, the tax that actually
+    applies to the sale. Sales whose vest is missing keep NaN derived values
+    and have vest_found set to False.
+    """
+    vest_keys = vests[["grant_id", "vest_id", "vest_date", "vest_price"]].assign(vest_found=True)
+    sales = sales.drop(columns=["vest_date", "vest_price", "vest_found"], errors="ignore")
+    sales = sales.merge(vest_keys, how="left", on=["grant_id", "vest_id"], validate="many_to_one")
+    sales["vest_found"] = sales["vest_found"].notna()
+
+    sale_price = sales["sale_price"].to_numpy(dtype=float)
+    vest_price = sales["vest_price"].to_numpy(dtype=float)
+    shares_sold = sales["shares_sold"].to_numpy(dtype=float)
+    tax_rate = sales["tax_rate_sale"].to_numpy(dtype=float)
+    holding_period = holding_period_days(sales["sale_date"], sales["vest_date"]) if len(sales) else np.empty(0)
+    within_30_days = holding_period <= WITHIN_30_DAYS
+    held_over_year = holding_period > CGT_DISCOUNT_DAYS
+
+    sales["holding_period"] = holding_period
+    sales["held_over_year"] = held_over_year
+    sales["capital_gains"] = calculate_gains_at_sale(sale_price, vest_price, shares_sold)
+    sales["capital_gains_tax"] = capital_gains_tax_columns(sale_price, vest_price, shares_sold, tax_rate, held_over_year, holding_period)
+    sales["tax_within_30_days"] = np.where(within_30_days, calculate_tax_at_vest(shares_sold, sale_price, tax_rate), np.nan)
+    sales["tax_at_sale"] = np.where(within_30_days, sales["tax_within_30_days"], sales["capital_gains_tax"])
+
+    missing = ~sales["vest_found"].to_numpy()
+    derived = ["holding_period", "capital_gains", "capital_gains_tax", "tax_within_30_days", "tax_at_sale"]
+    sales.loc[missing, derived] = np.nan
+    return sales
+
+def calculate_lot_taxes(vests, sales):
+    """Compute the derived tax fields for every vest and sale lot in one call.
+
+    `vests` needs the VEST_COLUMNS and `sales` the SALE_COLUMNS; extra columns
+    are carried through. Returns the (vests, sales) tables with derived
+    columns added.
+    """
+    vests = calculate_vest_taxes(vests)
+    return vests, calculate_sale_taxes(sales, vests)
@@ -0,0 +1,103 @@
+# changes.py
+# Change tracking for the data_editor tables.
+# An edited table is diffed against the frame the editor was given, so only
+# inserted/updated lots get their derived fields recalculated and unchanged
+# rows keep the stored dicts (and derived values) they already had.
+
+from collections import namedtuple
+
+import pandas as pd
+
+from utils.calculations import calculate_vest_taxes, calculate_sale_taxes
+from utils.profiling import timed
+
+EditorChanges = namedtuple("EditorChanges", ["inserted", "updated", "deleted"])
+
+
+def as_date(value):
+    # data_editor may hand dates back as Timestamps
+    return value.date() if isinstance(value, pd.Timestamp) else value
+
+def date_column(column):
+    """A column of dates as `datetime.date` objects, whatever the editor returned."""
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column.dt.date
+    return column.map(as_date) if column.dtype == object else column
+
+def _comparable(df):
+    # Compare dates as dates
+    df = df.copy()
+    for column in df.columns:
+        df[column] = date_column(df[column])
+    return df
+
+@timed
+def diff_editor_rows(original_df, edited_df):
+    """Diff a data_editor result against the frame it was given.
+
+    Rows are matched by index label: st.data_editor keeps the labels of existing
+    rows and gives added rows new ones. Returns EditorChanges of index labels:
+    `inserted` and `updated` from `edited_df`, `deleted` from `original_df`.
+    """
+    is_existing = edited_df.index.isin(original_df.index)
+    existing = edited_df.index[is_existing]
+    inserted = list(edited_df.index[~is_existing])
+    deleted = list(original_df.index[~original_df.index.isin(edited_df.index)])
+
+    if len(existing) and len(original_df.columns):
+        before = _comparable(original_df.loc[existing, original_df.columns])
+        after = _comparable(edited_df.loc[existing, original_df.columns])
+        differs = (before != after) & ~(before.isna() & after.isna())
+        updated = list(existing[differs.any(axis=1).to_numpy()])
+    else:
+        updated = []
+    return EditorChanges(inserted, updated, deleted)
+
+def has_changes(changes):
+    return bool(changes.inserted or changes.updated or changes.deleted)
+
+@timed
+def editor_rows(edited_df, changes, original_rows, build):
+    """Rows of an edited table, in table order.
+
+    Unchanged rows reuse `original_rows[label]`. Inserted/updated rows are built in one
+    batch by `build(changed_df)`, which returns one row dict per row of `changed_df`.
+    """
+    changed_df = edited_df[edited_df.index.isin(changes.inserted + changes.updated)]
+    built = dict(zip(changed_df.index, build(changed_df))) if len(changed_df) else {}
+    return [built[label] if label in built else original_rows[label] for label in edited_df.index]
+
+
+# --- Derived fields for the changed lots only ---
+
+def derive_vest_fields(vest_rows):
+    """Return copies of `vest_rows` with tax_at_vest calculated in one batch."""
+    if not vest_rows:
+        return []
+    taxes = calculate_vest_taxes(pd.DataFrame(vest_rows))["tax_at_vest"].tolist()
+    return [{**row, "tax_at_vest": tax_at_vest} for row, tax_at_vest in zip(vest_rows, taxes)]
+
+def derive_sale_fields(grant_id, sale_rows, vests):
+    """Return copies of `sale_rows` with capital gains, CGT and the 30-day rule calculated in one batch.
+
+    `vests` maps vest_id -> vest row for (at least) the vests the sales were drawn from.
+    Sales whose vest is missing are returned unchanged.
+    """
+    if not sale_rows:
+        return []
+    vest_rows = [{**vests[vest_id], "grant_id": grant_id} for vest_id in {row["vest_id"] for row in sale_rows} if vest_id in vests]
+    if not vest_rows:
+        return list(sale_rows)
+    sales_df = pd.DataFrame(sale_rows).assign(grant_id=grant_id)
+    derived = calculate_sale_taxes(sales_df, pd.DataFrame(vest_rows))
+    derived = derived[["vest_found", "capital_gains", "capital_gains_tax", "tax_within_30_days"]].to_dict("records")
+
+    result = []
+    for row, fields in zip(sale_rows, derived):
+        row = dict(row)
+        if fields.pop("vest_found"):
+            row.pop("tax_within_30_days", None)
+            # Note: Using sale price as per original logic if sold within 30 days
+            row.update((k, v) for k, v in fields.items() if not pd.isna(v))
+        result.append(row)
+    return result
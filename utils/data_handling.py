@@ -1,71 +1,166 @@
 # data_handling.py
-# Changes:
-# 1. Added session state flag "data_loaded" to track if data is imported via JSON.
-# 2. No other changes to core functionality.
+# Sidebar import and export: portfolio files (JSON or Parquet), broker statements,
+# closing prices and FX rates. Parsing lives in utils/serialization.py,
+# utils/broker.py and the price and FX stores; this module adds the streamlit
+# widgets and turns parse failures into messages.
 
 import json
-from datetime import datetime, date
 import streamlit as st
+from utils.broker import BROKER_PROFILES, read_statements, statements_to_portfolio
+from utils.fx import FxStore
+from utils.portfolio import Portfolio
+from utils.prices import PriceStore
+from utils.profiling import timed
+# The date converters live with the rest of the (streamlit-free) serialization code
+from utils.serialization import (
+    convert_dates_to_strings,
+    convert_strings_to_dates,
+    iter_file_grants,
+    portfolio_to_json,
+    portfolio_to_parquet,
+)
 
-def convert_dates_to_strings(obj):
-    if isinstance(obj, date):
-        return obj.isoformat()
-    elif isinstance(obj, dict):
-        return {key: convert_dates_to_strings(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_dates_to_strings(item) for item in obj]
-    return obj
+# Export formats: file name and MIME type. JSON is the default for compatibility;
+# Parquet files are much smaller and faster to read and write.
+EXPORT_FORMATS = {
+    "JSON": ("rsu_data.json", "application/json"),
+    "Parquet": ("rsu_data.parquet", "application/vnd.apache.parquet"),
+}
 
-def convert_strings_to_dates(obj):
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            if key.endswith("_date") and isinstance(value, str):
-                obj[key] = datetime.strptime(value, "%Y-%m-%d").date()
-            elif isinstance(value, (dict, list)):
-                convert_strings_to_dates(value)
-    elif isinstance(obj, list):
-        for item in obj:
-            convert_strings_to_dates(item)
-    return obj
+# Larger portfolios are serialized when an export is asked for, not on every rerun
+EAGER_EXPORT_GRANTS = 200
 
-def export_data(grants):
-    if not grants:
+@timed
+def export_data(portfolio):
+    if not portfolio:
         st.warning("No data to export.")
         return
 
-    grants_serializable = convert_dates_to_strings(grants)
+    export_format = st.sidebar.selectbox("Export Format", options=list(EXPORT_FORMATS), key="export_format")
+    file_name, mime = EXPORT_FORMATS[export_format]
+    # The last export is kept until the data or the format changes
+    key = (portfolio.fingerprint(), export_format)
+    cached = st.session_state.get("export_cache")
+    if cached is None or cached[0] != key:
+        if len(portfolio.grants) > EAGER_EXPORT_GRANTS and not st.sidebar.button("Prepare Export"):
+            return
+        try:
+            data = portfolio_to_parquet(portfolio) if export_format == "Parquet" else portfolio_to_json(portfolio)
+        except ValueError as e:
+            st.sidebar.error(f"Export failed: {e}")
+            return
+        cached = st.session_state["export_cache"] = (key, data)
+    data = cached[1]
 
     st.sidebar.download_button(
         label="Export Data",
-        data=json.dumps(grants_serializable, indent=2),
-        file_name="rsu_data.json",
-        mime="application/json",
+        data=data,
+        file_name=file_name,
+        mime=mime,
     )
 
+@timed
 def import_data():
-    uploaded_file = st.sidebar.file_uploader("Import Data", type=["json"])
-    if uploaded_file:
+    """Sidebar importer for exported data. Returns the imported Portfolio, or None.
+
+    Each upload is imported once: the uploader keeps the file across reruns, and
+    importing it again would replace any edits made since.
+    """
+    uploaded_file = st.sidebar.file_uploader("Import Data", type=["json", "parquet"])
+    if not uploaded_file:
+        st.session_state.pop("imported_file", None)
+        return None
+    imported = st.session_state.get("imported_file")
+    if imported is not None and imported[0] == uploaded_file.file_id:
+        # Already imported; a file that failed keeps showing why
+        if imported[1]:
+            st.error(imported[1])
+        return None
+
+    error = None
+    try:
+        # Grants are decoded and indexed one at a time (dates parsed, derived keys dropped);
+        # JSON or Parquet is detected from the file content
+        portfolio = Portfolio.from_grants(iter_file_grants(uploaded_file)).with_derived_fields()
+    except json.JSONDecodeError:
+        error = "Invalid JSON file. Please upload a valid JSON file."
+    except ValueError as e:
+        error = f"Invalid portfolio data: {e}"
+    except (KeyError, TypeError) as e:
+        # A field of the wrong type, found while deriving; recorded like any other failure
+        error = f"Invalid portfolio data: unexpected value ({type(e).__name__}: {e})."
+    st.session_state["imported_file"] = (uploaded_file.file_id, error)
+    if error:
+        st.error(error)
+        return None
+    st.success("Data imported successfully!")
+    st.session_state["data_loaded"] = True
+    return portfolio
+
+@timed
+def import_broker_statements():
+    """Sidebar importer for brokerage CSV statements. Returns the Portfolio built from them, or None."""
+    uploaded_files = st.sidebar.file_uploader("Import Broker Statements (CSV)", type=["csv"], accept_multiple_files=True, key="broker_files")
+    if not uploaded_files:
+        return None
+    profile = st.sidebar.selectbox("Statement Format", options=list(BROKER_PROFILES), key="broker_profile")
+    tax_rate = st.sidebar.number_input(
+        "Tax Rate (%)", min_value=0.0, max_value=100.0, value=47.0, key="broker_tax_rate",
+        help="Statements don't include your marginal tax rate; this one is used for every vest and sale (edit lots afterwards if it changed).",
+    )
+    if not st.sidebar.button("Import Statements"):
+        return None
+    try:
+        for uploaded_file in uploaded_files:
+            uploaded_file.seek(0)
+        activity = read_statements(uploaded_files, BROKER_PROFILES[profile])
+        portfolio = statements_to_portfolio(activity, tax_rate / 100.0).with_derived_fields()
+        st.success(f"Imported {len(portfolio.grants)} grants from {len(activity)} statement rows.")
+        st.session_state["data_loaded"] = True
+        return portfolio
+    except ValueError as e:
+        st.error(f"Invalid broker statement: {e}")
+    return None
+
+def _import_store(label, help_text, state_key, store_class, error_label):
+    # Sidebar loader of CSV files into a store kept in session_state[state_key];
+    # the store is rebuilt only when the set of uploaded files changes
+    uploaded_files = st.sidebar.file_uploader(label, type=["csv"], accept_multiple_files=True, help=help_text)
+    files_state_key = f"{state_key}_files"
+    if not uploaded_files:
+        st.session_state.pop(state_key, None)
+        st.session_state.pop(files_state_key, None)
+        return None
+
+    files_key = tuple((f.name, f.size) for f in uploaded_files)
+    if st.session_state.get(files_state_key) != files_key:
         try:
-            data = json.load(uploaded_file)
-            data = convert_strings_to_dates(data)
+            st.session_state[state_key] = store_class.from_csv(uploaded_files)
+            st.session_state[files_state_key] = files_key
+        except (ValueError, KeyError) as e:
+            st.session_state.pop(state_key, None)
+            st.session_state.pop(files_state_key, None)
+            st.sidebar.error(f"Invalid {error_label} file: {e}")
+            return None
+    return st.session_state[state_key]
 
-            def remove_calculatable_keys(obj):
-                if isinstance(obj, dict):
-                    for key, value in list(obj.items()):
-                        if key in ["capital_gains_tax", "tax_at_vest"]:
-                            del obj[key]
-                        elif isinstance(value, (dict, list)):
-                            remove_calculatable_keys(value)
-                elif isinstance(obj, list):
-                    for item in obj:
-                        remove_calculatable_keys(item)
-                return obj
+@timed
+def import_price_history():
+    """Sidebar loader for local daily price CSVs. Returns the PriceStore, or None if no files are loaded.
 
-            data = remove_calculatable_keys(data)
+    The store is rebuilt only when the set of uploaded files changes.
+    """
+    return _import_store(
+        "Price History (CSV)",
+        "Daily closes as 'symbol,date,close' rows, or 'date,close' rows in a file named after the symbol (e.g. AMZN.csv).",
+        "price_store", PriceStore, "price",
+    )
 
-            st.success("Data imported successfully!")
-            st.session_state["data_loaded"] = True
-            return data
-        except json.JSONDecodeError:
-            st.error("Invalid JSON file. Please upload a valid JSON file.")
-    return None
\ No newline at end of file
+@timed
+def import_fx_rates():
+    """Sidebar loader for local daily FX rate CSVs. Returns the FxStore, or None if no files are loaded."""
+    return _import_store(
+        "FX Rates (CSV)",
+        "Daily rates in AUD per unit of the currency, as 'currency,date,rate' rows, or 'date,rate' rows in a file named after the currency (e.g. USD.csv).",
+        "fx_store", FxStore, "FX rate",
+    )
@@ -0,0 +1,194 @@
+# facts.py
+# Derived "lot facts" table shared by the summary, charts and tables.
+# Every vest and sale is enriched once per portfolio version (tax year, matched
+# vest, derived taxes in AUD) and the views select or group rows of this one table
+# instead of walking the portfolio themselves. After an edit, the table and the
+# per-tax-year totals are patched for the edited grants only.
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from utils.calculations import calculate_lot_taxes
+from utils.profiling import timed
+
+VEST_EVENT = "Vest"
+SALE_EVENT = "Sale"
+SHARE_COLUMNS = ["shares_vested", "shares_sold"]
+
+
+@lru_cache(maxsize=None)
+def tax_year_label(start_year):
+    """ "YYYY-YYYY" label of the financial year starting 1 July `start_year` (built once per year)."""
+    return f"{start_year}-{start_year + 1}"
+
+def australian_tax_year_columns(dates):
+    """Vectorized get_australian_tax_year: "YYYY-YYYY" for a column of dates."""
+    dates = pd.to_datetime(pd.Series(dates))
+    start = (dates.dt.year - (dates.dt.month < 7).astype(int)).to_numpy()
+    # Only a handful of distinct years: label each once and index into them
+    years, codes = np.unique(start, return_inverse=True)
+    labels = np.array([tax_year_label(int(year)) for year in years], dtype=object)
+    return pd.Series(labels[codes], index=dates.index)
+
+def _fact_rows(portfolio):
+    # Enriched vest and sale rows of a portfolio, not yet in display order
+    vests, sales = calculate_lot_taxes(*portfolio.lot_tables())
+
+    vest_seq = vests.groupby("grant_id", sort=False).cumcount()
+    vests = vests.assign(event=VEST_EVENT, event_seq=0, date=vests["vest_date"], vest_found=True, vest_seq=vest_seq)
+    vest_fields = ["vest_seq", "shares_vested", "tax_rate_vest", "tax_at_vest"]
+    sales = sales.drop(columns=vest_fields, errors="ignore").merge(
+        vests[["grant_id", "vest_id"] + vest_fields], how="left", on=["grant_id", "vest_id"]
+    )
+    sales = sales.assign(event=SALE_EVENT, event_seq=1, date=sales["sale_date"])
+
+    facts = pd.concat([vests, sales], ignore_index=True)
+    facts["tax_year"] = australian_tax_year_columns(facts["date"])
+    return facts
+
+def _in_grant_order(facts, portfolio):
+    # Per grant (in portfolio order): its vests, then its sales; also refreshes the grant fields
+    grants = portfolio.tables()[0].set_index("grant_id")
+    facts = facts.assign(
+        grant_seq=facts["grant_id"].map({grant_id: seq for seq, grant_id in enumerate(grants.index)}),
+        grant_date=facts["grant_id"].map(grants["grant_date"]),
+        symbol=facts["grant_id"].map(grants["symbol"]),
+    )
+    return facts.sort_values(["grant_seq", "event_seq"], kind="mergesort", ignore_index=True)
+
+@timed
+def build_lot_facts(portfolio):
+    """Build the per-lot fact table of a portfolio.
+
+    One row per vest ("Vest" event) and per sale ("Sale" event), ordered per grant
+    with its vests first, then its sales. Sale rows carry the fields of the vest
+    they were drawn from; sales whose vest is missing have vest_found False.
+    """
+    return _in_grant_order(_fact_rows(portfolio), portfolio)
+
+@timed
+def patch_lot_facts(facts, portfolio, changed_grant_ids):
+    """Update the fact table of an earlier version for the grants changed since then."""
+    if 2 * len(changed_grant_ids) >= len(portfolio.grants):
+        return build_lot_facts(portfolio)
+    kept = facts[~facts["grant_id"].isin(changed_grant_ids)]
+    fresh = _fact_rows(portfolio.subset(changed_grant_ids))
+    if not fresh.empty:
+        kept = pd.concat([kept, fresh], ignore_index=True)
+    return _in_grant_order(kept, portfolio)
+
+def lot_facts(portfolio):
+    """The fact table of a portfolio, built once per portfolio version."""
+    return portfolio.derived("lot_facts", build_lot_facts, patch_lot_facts)
+
+
+# --- Per-tax-year totals ---
+# Kept per (grant, symbol, tax year) so an edit only re-aggregates the edited
+# grants; the per-year and per-symbol totals are then a small group-by over
+# those partial sums.
+
+def _grant_year_totals(facts):
+    lots = facts[facts["vest_found"]]
+    is_vest = (lots["event"] == VEST_EVENT).to_numpy()
+    is_sale = ~is_vest
+    capital_gains = lots["capital_gains"].to_numpy()
+    is_gain = is_sale & (capital_gains >= 0)
+    is_loss = is_sale & (capital_gains < 0)
+    sale_tax = np.where(is_sale, lots["tax_at_sale"], 0.0)
+    totals = pd.DataFrame({
+        "grant_id": lots["grant_id"],
+        "symbol": lots["symbol"],
+        "tax_year": lots["tax_year"],
+        "vest_tax": np.where(is_vest, lots["tax_at_vest"], 0.0),
+        "sale_tax": sale_tax,
+        "capital_gains": np.where(is_gain, capital_gains, 0.0),
+        "capital_losses": np.where(is_loss, capital_gains, 0.0),
+        "net_gain": np.where(is_sale, lots["sale_price"] * lots["shares_sold"] - lots["tax_at_sale"], 0.0),
+        "taxes_paid": np.where(is_sale, lots["tax_at_sale"] + lots["tax_at_vest"], 0.0),
+        "sales": is_sale.astype(int),
+        "gain_sales": is_gain.astype(int),
+        "loss_sales": is_loss.astype(int),
+    })
+    return totals.groupby(["grant_id", "symbol", "tax_year"], sort=False).sum()
+
+@timed
+def build_grant_year_totals(portfolio):
+    return _grant_year_totals(lot_facts(portfolio))
+
+@timed
+def patch_grant_year_totals(totals, portfolio, changed_grant_ids):
+    kept = totals[~totals.index.get_level_values("grant_id").isin(changed_grant_ids)]
+    facts = lot_facts(portfolio)
+    fresh = _grant_year_totals(facts[facts["grant_id"].isin(changed_grant_ids)])
+    totals = pd.concat([kept, fresh]) if not fresh.empty else kept
+    # Back in grant order, as built: edited grants were appended and grants may have been reordered
+    grant_seq = totals.index.get_level_values("grant_id").map({grant_id: seq for seq, grant_id in enumerate(portfolio.grants)})
+    return totals.iloc[np.argsort(grant_seq.to_numpy(), kind="stable")]
+
+def grant_year_totals(portfolio):
+    """Totals per (grant_id, symbol, tax_year): vest/sale tax, gains, losses, net gain and taxes paid."""
+    return portfolio.derived("grant_year_totals", build_grant_year_totals, patch_grant_year_totals)
+
+def tax_year_totals(portfolio):
+    """Totals per Australian financial year, sorted by year."""
+    return portfolio.derived("tax_year_totals", lambda p: grant_year_totals(p).groupby(level="tax_year").sum().sort_index())
+
+def symbol_year_totals(portfolio):
+    """Totals per (symbol, tax_year), sorted."""
+    return portfolio.derived("symbol_year_totals", lambda p: grant_year_totals(p).groupby(level=["symbol", "tax_year"]).sum().sort_index())
+
+
+# --- Views ---
+
+def _with_int_shares(lots):
+    # Concatenating vests and sales turns the share counts into floats; restore them
+    for column in SHARE_COLUMNS:
+        if lots[column].notna().all():
+            lots = lots.astype({column: "int64"})
+    return lots
+
+def vest_lots(facts):
+    return _with_int_shares(facts[facts["event"] == VEST_EVENT])
+
+def sale_lots(facts):
+    """Sales whose vest exists, with the fields of that vest."""
+    return _with_int_shares(facts[(facts["event"] == SALE_EVENT) & facts["vest_found"]])
+
+def matched_lots(facts):
+    """Vests plus the sales whose vest exists, in fact table order."""
+    return facts[facts["vest_found"]]
+
+def orphan_sales(facts):
+    """Sales whose vest no longer exists."""
+    return facts[(facts["event"] == SALE_EVENT) & ~facts["vest_found"]]
+
+@timed
+def build_summary_table(facts):
+    """The Summary section's sales table: one row per sale with its vest and taxes."""
+    lots = sale_lots(facts)
+    if lots.empty:
+        return pd.DataFrame()
+
+    vest_proceeds = lots["vest_price"] * lots["shares_sold"]
+    return pd.DataFrame({
+        "Grant ID": lots["grant_id"],
+        "Grant Date": lots["grant_date"],
+        "Vest ID": lots["vest_id"],
+        "Vest Date": lots["vest_date"],
+        "Vest Price": lots["vest_price"],
+        "Tax Rate at Vest (%)": lots["tax_rate_vest"] * 100,
+        "Total vest proceeds" : vest_proceeds,
+        "Tax at Vest": lots["tax_at_vest"],
+        "Vest proceeds after taxes" : vest_proceeds - lots["tax_at_vest"],
+        "Sale ID": lots["sale_id"],
+        "Sale Date": lots["sale_date"],
+        "Shares Sold": lots["shares_sold"],
+        "Sale Price": lots["sale_price"],
+        "Tax Rate at Sale (%)": lots["tax_rate_sale"] * 100,
+        "Total sale proceeds": lots["capital_gains"],
+        "Tax at Sale": lots["tax_at_sale"],
+        "Sale proceeds after taxes": lots["capital_gains"] - lots["tax_at_sale"],
+        "Net Gain" : (vest_proceeds - lots["tax_at_vest"]) + (lots["capital_gains"] - lots["tax_at_sale"]),
+    }).reset_index(drop=True)
@@ -0,0 +1,111 @@
+# fx.py
+# Currency conversion of lot prices to AUD, the currency tax is assessed in.
+# A grant may name the currency its shares are priced in ("currency", e.g. "USD")
+# and a vest or sale may override it; lots without one are in AUD. Daily rates come
+# from local CSV files into an FxStore, which looks rates up like the PriceStore
+# looks up closes: the rate on the date, or on the last business day before it.
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.prices import PriceStore, PRICE_COLUMNS
+
+BASE_CURRENCY = "AUD"
+FX_COLUMNS = ["currency", "date", "rate"]
+# A rate older than this (e.g. over a long holiday) is treated as missing
+FX_MAX_AGE_DAYS = 7
+
+
+def _read_fx_csv(source, name=None):
+    # "currency,date,rate" rows, rate in AUD per unit; files without a currency
+    # column (one currency each) take it from the file name ("USD.csv")
+    df = pd.read_csv(source)
+    df.columns = [str(column).strip().lower() for column in df.columns]
+    if "currency" not in df.columns:
+        name = name or getattr(source, "name", None) or str(source)
+        df["currency"] = os.path.splitext(os.path.basename(name))[0]
+    missing = [column for column in FX_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"FX rate file {name or source} has no {', '.join(missing)} column.")
+    return df[FX_COLUMNS].rename(columns={"currency": "symbol", "rate": "close"})
+
+
+class FxStore(PriceStore):
+    """Daily AUD rates per currency (AUD for one unit of the currency), looked up as of a date."""
+
+    @classmethod
+    def from_csv(cls, sources):
+        """Build a store from CSV files (paths or file objects) of currency, date and rate."""
+        frames = [_read_fx_csv(source) for source in sources]
+        return cls.from_frame(pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=PRICE_COLUMNS))
+
+    def fingerprint(self):
+        """Content hash of the rates, so anything converted with them can be cached on it."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr(sorted(self.symbols.items())).encode())
+        digest.update(np.ascontiguousarray(self.keys).tobytes())
+        digest.update(np.ascontiguousarray(self.closes).tobytes())
+        return digest.hexdigest()
+
+
+def _currency_codes(column):
+    # Upper-case codes; blank (an emptied editor cell) counts as missing
+    codes = column.astype(object).str.strip().str.upper()
+    return codes.where(codes != "")
+
+def lot_currencies(lots, grants_df):
+    """Currency of every lot: its own "currency", else its grant's, else AUD. Blank counts as none."""
+    currency = _currency_codes(lots["currency"]) if "currency" in lots else pd.Series(np.nan, index=lots.index, dtype=object)
+    if "currency" in grants_df:
+        grant_currency = lots["grant_id"].map(_currency_codes(grants_df.set_index("grant_id")["currency"]))
+        currency = currency.where(currency.notna(), grant_currency)
+    return currency.fillna(BASE_CURRENCY)
+
+def aud_rates(currencies, dates, fx):
+    """AUD per unit for each (currency, date): 1.0 for AUD, NaN where no rate is known."""
+    currencies = pd.Series(currencies).reset_index(drop=True)
+    rates = np.ones(len(currencies))
+    foreign = (currencies != BASE_CURRENCY).to_numpy()
+    if foreign.any():
+        rates[foreign] = fx.lookup(currencies[foreign], np.asarray(dates, dtype=object)[foreign], FX_MAX_AGE_DAYS) if fx is not None else np.nan
+    return rates
+
+def has_foreign_lots(grants_df, vests_df, sales_df):
+    """Whether any lot is priced in a currency other than AUD."""
+    return any(
+        (lot_currencies(df, grants_df) != BASE_CURRENCY).any()
+        for df in (vests_df, sales_df)
+        if "currency" in df or "currency" in grants_df
+    )
+
+def convert_lot_tables(grants_df, vests_df, sales_df, fx):
+    """Vests and sales tables with vest_price/sale_price converted to AUD.
+
+    Each price is converted at the rate of its own date (vest prices at the vest
+    date, sale prices at the sale date), all lots of a table in one lookup. Adds
+    currency, fx_rate and the original vest_price_local/sale_price_local. Prices
+    without a known rate become NaN, and so do the taxes calculated from them.
+    """
+    converted = []
+    for df, price, date in [(vests_df, "vest_price", "vest_date"), (sales_df, "sale_price", "sale_date")]:
+        currency = lot_currencies(df, grants_df)
+        rates = aud_rates(currency, df[date], fx)
+        converted.append(df.assign(**{
+            "currency": currency.to_numpy(),
+            "fx_rate": rates,
+            f"{price}_local": df[price],
+            price: pd.to_numeric(df[price], errors="coerce").to_numpy(dtype=float) * rates,
+        }))
+    return tuple(converted)
+
+def missing_fx_rates(lot_tables):
+    """(currency, date) pairs of the converted lot tables that have no rate, sorted."""
+    missing = set()
+    for df, date in zip(lot_tables, ["vest_date", "sale_date"]):
+        if "fx_rate" in df:
+            rows = df[np.isnan(df["fx_rate"].to_numpy(dtype=float))]
+            missing.update(zip(rows["currency"], pd.to_datetime(rows[date]).dt.date))
+    return sorted(missing)
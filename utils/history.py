@@ -0,0 +1,61 @@
+# history.py
+# Undo/redo of portfolio edits.
+# Portfolios are immutable and every edit shares the grants it did not touch with
+# the version before it, so the history keeps whole versions (snapshots without
+# their cached tables) rather than copies or diffs: a step costs the grant index
+# of one version plus the partitions its edit replaced, and undo/redo only move
+# a version between two stacks.
+
+from collections import deque
+
+# Versions kept for undo; the oldest are dropped first
+HISTORY_LIMIT = 50
+
+
+class History:
+    """Undo and redo stacks of portfolio versions."""
+
+    def __init__(self, limit=HISTORY_LIMIT):
+        self._undo = deque(maxlen=limit)
+        self._redo = []
+
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    def record(self, previous):
+        """Remember `previous`, the version an edit was made to. Clears the redo stack."""
+        self._undo.append(previous.snapshot())
+        self._redo.clear()
+
+    def undo(self, current):
+        """The version before `current` (restored onto it), or `current` if there is none."""
+        if not self._undo:
+            return current
+        self._redo.append(current.snapshot())
+        return current.restore(self._undo.pop())
+
+    def redo(self, current):
+        """The version undone last (restored onto `current`), or `current` if there is none."""
+        if not self._redo:
+            return current
+        self._undo.append(current.snapshot())
+        return current.restore(self._redo.pop())
+
+    def versions(self):
+        """(undo versions, oldest first; redo versions, the next one to redo last)."""
+        return list(self._undo), list(self._redo)
+
+    def drop_oldest(self):
+        """Forget the oldest undo version (or, with none left, the last redo one). Returns it, or None."""
+        if self._undo:
+            return self._undo.popleft()
+        if self._redo:
+            return self._redo.pop(0)
+        return None
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
@@ -0,0 +1,199 @@
+# memory.py
+# Per-session memory accounting and budget eviction.
+# A session holds its portfolio, the versions kept for undo and the tables cached
+# on its portfolio. Versions share every grant an edit did not touch, so each one
+# is charged only the partitions it doesn't share with its neighbour towards the
+# live version. Rows are sized from a sample row per table and frames from their
+# buffers plus a sample of their object values, and every size is remembered, so
+# accounting a rerun without edits is a few lookups. Over the budget, what is
+# least likely to be needed again goes first.
+
+import sys
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from utils.cache import estimate_size
+from utils.profiling import timed
+
+DEFAULT_SESSION_MAX_BYTES = 256 * 1024 * 1024
+# Cached on every portfolio and needed on every rerun, so never evicted
+KEEP_CACHED = {"fingerprint"}
+# Object values sized per frame column
+SAMPLE_VALUES = 1000
+
+# portfolio -> bytes of its rows
+_data_sizes = weakref.WeakKeyDictionary()
+# portfolio -> {name: (value, [(piece, bytes), ...])}; holding the value keeps the
+# ids of its pieces unique until the entry is pruned
+_cached_sizes = weakref.WeakKeyDictionary()
+# history -> {(id(version), id(neighbour)): (version, neighbour, bytes of the partitions only version holds)}
+_step_sizes = weakref.WeakKeyDictionary()
+# Sessions run on their own threads and may share portfolios (and so the memos above)
+_lock = threading.RLock()
+
+
+def _row_bytes(row):
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row.values())
+
+def _lots_bytes(partitions):
+    # Lots of a table are alike, so one row is measured for all of them
+    count = sum(len(rows) for rows in partitions)
+    sample = next((rows for rows in partitions if rows), None)
+    return sum(sys.getsizeof(rows) for rows in partitions) + (count * _row_bytes(next(iter(sample.values()))) if sample else 0)
+
+def _data_bytes(portfolio):
+    if portfolio not in _data_sizes:
+        grants = list(portfolio.grants.values())
+        size = sys.getsizeof(portfolio.grants) + sys.getsizeof(portfolio.vests) + sys.getsizeof(portfolio.sales)
+        size += len(grants) * _row_bytes(grants[0]) if grants else 0
+        size += _lots_bytes(portfolio.vests.values()) + _lots_bytes(portfolio.sales.values())
+        _data_sizes[portfolio] = size
+    return _data_sizes[portfolio]
+
+def _step_bytes(steps, version, neighbour):
+    # Rows of `version` in partitions it doesn't share with `neighbour`
+    key = (id(version), id(neighbour))
+    if key not in steps:
+        grants, vests, sales = [], [], []
+        for grant_id, grant in version.grants.items():
+            if neighbour.grants.get(grant_id) is not grant:
+                grants.append(grant)
+            for lots, neighbour_lots, own in ((version.vests, neighbour.vests, vests), (version.sales, neighbour.sales, sales)):
+                rows = lots.get(grant_id)
+                if rows is not None and neighbour_lots.get(grant_id) is not rows:
+                    own.append(rows)
+        size = sys.getsizeof(version.grants) + sys.getsizeof(version.vests) + sys.getsizeof(version.sales)
+        size += sum(_row_bytes(grant) for grant in grants) + _lots_bytes(vests) + _lots_bytes(sales)
+        steps[key] = (version, neighbour, size)
+    return steps[key][2]
+
+def _chain(portfolio, history):
+    # Versions in edit order with the live one among them: undo versions, live, redo versions
+    if history is None:
+        return [portfolio], 0
+    undo, redo = history.versions()
+    return undo + [portfolio] + redo[::-1], len(undo)
+
+def _history_bytes(history, chain, live):
+    # Bytes each kept version adds, in chain order (the live version's own rows excluded)
+    if history is None:
+        return []
+    memo = _step_sizes.setdefault(history, {})
+    neighbours = [(chain[i], chain[i + 1]) for i in range(live)] + [(chain[i], chain[i - 1]) for i in range(live + 1, len(chain))]
+    steps = [_step_bytes(memo, version, neighbour) for version, neighbour in neighbours]
+    pairs = {(id(version), id(neighbour)) for version, neighbour in neighbours}
+    for key in [key for key in memo if key not in pairs]:
+        del memo[key]
+    return steps
+
+def _frame_bytes(df):
+    # Buffers, plus object values sized from a sample (deep memory_usage visits every value)
+    size = int(df.memory_usage(index=True, deep=False).sum())
+    for column in df.columns[(df.dtypes == object).to_numpy()]:
+        values = df[column].to_numpy()
+        if len(values):
+            sample = values[np.linspace(0, len(values) - 1, min(len(values), SAMPLE_VALUES)).astype(int)]
+            size += int(len(values) * sum(sys.getsizeof(value) for value in sample) / len(sample))
+    return size
+
+def _pieces(value):
+    # Frames and other leaves of a cached value (tuples of frames, dicts of results)
+    if isinstance(value, (tuple, list)):
+        for item in value:
+            yield from _pieces(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _pieces(item)
+    else:
+        yield value
+
+def _cached_bytes(portfolio):
+    # name -> bytes of the values cached on `portfolio`, each measured once; pieces
+    # shared by several values (lot_tables without FX are the tables) are counted once
+    measured = _cached_sizes.setdefault(portfolio, {})
+    cached = portfolio.cached_values()
+    for name in [name for name, (value, _) in measured.items() if cached.get(name) is not value]:
+        del measured[name]
+    for name, value in cached.items():
+        if name not in measured:
+            measured[name] = (value, [(piece, _frame_bytes(piece) if isinstance(piece, pd.DataFrame) else estimate_size(piece)) for piece in _pieces(value)])
+    seen = set()
+    sizes = {}
+    for name, (_, pieces) in measured.items():
+        sizes[name] = sum(size for piece, size in pieces if id(piece) not in seen)
+        seen.update(id(piece) for piece, _ in pieces)
+    return sizes
+
+
+def _evict(portfolio, history, max_bytes):
+    # enforce_budget without the lock
+    footprint = session_footprint(portfolio, history)
+    total = footprint["total"]
+    if total <= max_bytes:
+        return 0
+    start = total
+    cached = footprint["cached"]
+
+    bases = [name for name in cached if name.startswith("base:")]
+    portfolio.drop_cached(bases)
+    total -= sum(cached.pop(name) for name in bases)
+
+    if total > max_bytes and history is not None:
+        chain, live = _chain(portfolio, history)
+        steps = _history_bytes(history, chain, live)
+        undo, redo = steps[:live], steps[live:]
+        # Dropping the farthest version leaves the next one's step unchanged
+        while total > max_bytes and (undo or redo):
+            history.drop_oldest()
+            total -= undo.pop(0) if undo else redo.pop()
+        if len(undo) + len(redo) < len(steps):
+            # Lets go of the dropped versions the step memo still holds
+            _history_bytes(history, *_chain(portfolio, history))
+
+    for name in sorted(cached, key=cached.get, reverse=True):
+        if total <= max_bytes:
+            break
+        if name not in KEEP_CACHED:
+            portfolio.drop_cached([name])
+            total -= cached[name]
+    # Lets go of the dropped values the size memo still holds
+    _cached_bytes(portfolio)
+    return start - total
+
+
+@timed
+def session_footprint(portfolio, history=None):
+    """Approximate bytes held by one session.
+
+    Returns a dict: data (rows of the portfolio), history (rows only the
+    versions kept for undo/redo hold) and history_versions, cached (tables and
+    derived values cached on the portfolio, by name) and total. A portfolio
+    shared with other sessions is counted in each of them.
+    """
+    with _lock:
+        chain, live = _chain(portfolio, history)
+        data = _data_bytes(portfolio)
+        history_bytes = sum(_history_bytes(history, chain, live))
+        cached = _cached_bytes(portfolio)
+    return {
+        "data": data,
+        "history": history_bytes,
+        "history_versions": len(chain) - 1,
+        "cached": cached,
+        "total": data + history_bytes + sum(cached.values()),
+    }
+
+@timed
+def enforce_budget(portfolio, history=None, max_bytes=DEFAULT_SESSION_MAX_BYTES):
+    """Bring a session under `max_bytes`, returning the bytes freed (0 if it was under).
+
+    In order, until the session fits: values of earlier versions kept for
+    patching, the oldest versions in the history (redo versions once no undo is
+    left), then the largest tables and derived values cached on the portfolio
+    (rebuilt when next used). The portfolio's own rows are never dropped.
+    """
+    with _lock:
+        return _evict(portfolio, history, max_bytes)
@@ -0,0 +1,374 @@
+# portfolio.py
+# Normalized, indexed portfolio model used in place of the nested grant dicts.
+# Grants, vests and sales are kept as flat per-grant tables keyed by
+# (grant_id, vest_id) and (grant_id, vest_id, sale_id), with a lossless adapter
+# to and from the nested JSON shape used by import/export.
+# Lots may be priced in another currency; with an FxStore attached, the tax
+# calculations read lot tables converted to AUD (lot_tables).
+
+import hashlib
+import json
+
+import pandas as pd
+
+from utils.calculations import VEST_COLUMNS, SALE_COLUMNS, calculate_lot_taxes
+from utils.fx import BASE_CURRENCY, convert_lot_tables, has_foreign_lots
+from utils.profiling import timed
+
+GRANT_COLUMNS = ["grant_id", "grant_date", "symbol", "num_stocks"]
+# Fields computed from the inputs of a lot, never entered by the user
+DERIVED_VEST_FIELDS = ["tax_at_vest"]
+DERIVED_SALE_FIELDS = ["capital_gains", "capital_gains_tax", "tax_within_30_days"]
+
+
+class Portfolio:
+    """Grants, vests and sales of one user, indexed by ID.
+
+    `grants` maps grant_id -> grant row, `vests` maps grant_id -> {vest_id: vest row}
+    and `sales` maps grant_id -> {(vest_id, sale_id): sale row}, since sale IDs are
+    only unique per vest. Rows are plain dicts using the same field names as the
+    JSON format, without the nested "vests"/"sales" lists.
+
+    A Portfolio is never modified in place: the `with_*` methods return a new
+    portfolio that shares every untouched grant partition (and row) with this one.
+    `fx` is the FxStore lots in other currencies are converted with (None: no rates).
+    """
+
+    def __init__(self, grants=None, vests=None, sales=None, fx=None):
+        self.grants = grants if grants is not None else {}
+        self.vests = vests if vests is not None else {}
+        self.sales = sales if sales is not None else {}
+        self.fx = fx
+        self._tables = None
+        self._sales_by_vest = {}
+        self._derived = {}
+        self._patchable = set()
+        # name -> (value derived from an earlier version, grant IDs changed since then)
+        self._base = {}
+        self._grant_fingerprints = {}
+
+    # --- JSON adapter ---
+
+    @classmethod
+    def from_grants(cls, grants):
+        """Build a portfolio from the nested list-of-grants shape.
+
+        Raises ValueError on duplicate grant IDs, vest IDs within a grant or
+        sale IDs within a vest, since those cannot be indexed.
+        """
+        grant_rows, vests, sales = {}, {}, {}
+        for grant in grants:
+            grant_id = grant["grant_id"]
+            if grant_id in grant_rows:
+                raise ValueError(f"Duplicate Grant ID '{grant_id}'.")
+            grant_rows[grant_id] = {k: v for k, v in grant.items() if k not in ("vests", "sales")}
+            vests[grant_id] = _index_rows(grant.get("vests", []), vest_key, f"Vest ID in Grant '{grant_id}'")
+            sales[grant_id] = _index_rows(grant.get("sales", []), sale_key, f"Sale ID in Grant '{grant_id}'")
+        return cls(grant_rows, vests, sales)
+
+    def to_grants(self):
+        """Return the nested list-of-grants shape (new dicts, safe to mutate)."""
+        return [
+            {
+                **grant,
+                "vests": [dict(vest) for vest in self.vests.get(grant_id, {}).values()],
+                "sales": [dict(sale) for sale in self.sales.get(grant_id, {}).values()],
+            }
+            for grant_id, grant in self.grants.items()
+        ]
+
+    # --- Lookups ---
+
+    def __bool__(self):
+        return bool(self.grants)
+
+    def grant(self, grant_id):
+        return self.grants.get(grant_id)
+
+    def vest(self, grant_id, vest_id):
+        return self.vests.get(grant_id, {}).get(vest_id)
+
+    def sale(self, grant_id, vest_id, sale_id):
+        return self.sales.get(grant_id, {}).get((vest_id, sale_id))
+
+    def vest_for_sale(self, grant_id, sale):
+        """The vest a sale was drawn from, or None if it no longer exists."""
+        return self.vest(grant_id, sale.get("vest_id"))
+
+    def sales_for_vest(self, grant_id, vest_id):
+        if grant_id not in self._sales_by_vest:
+            by_vest = {}
+            for sale in self.sales.get(grant_id, {}).values():
+                by_vest.setdefault(sale.get("vest_id"), []).append(sale)
+            self._sales_by_vest[grant_id] = by_vest
+        return self._sales_by_vest[grant_id].get(vest_id, [])
+
+    def iter_vests(self):
+        """Yield (grant_id, vest) for every vest, grouped by grant."""
+        for grant_id in self.grants:
+            for vest in self.vests.get(grant_id, {}).values():
+                yield grant_id, vest
+
+    def iter_sales(self):
+        """Yield (grant_id, sale) for every sale, grouped by grant."""
+        for grant_id in self.grants:
+            for sale in self.sales.get(grant_id, {}).values():
+                yield grant_id, sale
+
+    def tables(self):
+        """Flat (grants, vests, sales) DataFrames with a grant_id column on every table.
+
+        Built once per portfolio; treat the returned frames as read-only.
+        """
+        if self._tables is None:
+            grants_df = _frame(self.grants.values(), GRANT_COLUMNS)
+            vests_df = _frame(({**vest, "grant_id": grant_id} for grant_id, vest in self.iter_vests()), VEST_COLUMNS)
+            sales_df = _frame(({**sale, "grant_id": grant_id} for grant_id, sale in self.iter_sales()), SALE_COLUMNS)
+            self._tables = (grants_df, vests_df, sales_df)
+        return self._tables
+
+    def lot_tables(self):
+        """(vests, sales) tables with vest_price and sale_price in AUD, for the tax calculations.
+
+        Lots in other currencies are converted in one join per table (see
+        fx.convert_lot_tables); without any, these are the frames of tables().
+        Built once per portfolio; treat the returned frames as read-only.
+        """
+        return self.derived("lot_tables", _build_lot_tables)
+
+    def is_foreign(self, grant_id):
+        """Whether any lot of a grant is priced in a currency other than AUD."""
+        # A blank currency is none, as in lot_currencies
+        grant_currency = str(self.grants[grant_id].get("currency") or "").strip() or BASE_CURRENCY
+        lots = list(self.vests.get(grant_id, {}).values()) + list(self.sales.get(grant_id, {}).values())
+        return any((str(lot.get("currency") or "").strip() or grant_currency).upper() != BASE_CURRENCY for lot in lots)
+
+    def derived(self, name, build, patch=None):
+        """Return `build(self)`, computed once per portfolio and cached under `name`.
+
+        Portfolios are immutable, so anything derived from one stays valid for its lifetime.
+        If `patch` is given and this portfolio was made by editing one that had already
+        built `name`, the value is `patch(previous_value, self, changed_grant_ids)`
+        instead, so an edit only pays for the grants it touched.
+        """
+        if name not in self._derived:
+            base = self._base.pop(name, None) if patch is not None else None
+            if patch is not None:
+                self._patchable.add(name)
+            if base is not None:
+                self._derived[name] = patch(base[0], self, base[1])
+            else:
+                self._derived[name] = build(self)
+        return self._derived[name]
+
+    def fingerprint(self):
+        """Stable content hash of the portfolio; equal data gives an equal fingerprint.
+
+        Hashes are kept per grant and carried over by the `with_*` methods, so only
+        the grants touched by an edit are hashed again.
+        """
+        return self.derived("fingerprint", _portfolio_fingerprint)
+
+    def grant_fingerprint(self, grant_id):
+        if grant_id not in self._grant_fingerprints:
+            partition = [self.grants[grant_id], list(self.vests.get(grant_id, {}).values()), list(self.sales.get(grant_id, {}).values())]
+            self._grant_fingerprints[grant_id] = _hash(partition)
+        return self._grant_fingerprints[grant_id]
+
+    def cached_values(self):
+        """Values cached on this version, by name: its tables(), derived values, and
+        ("base:" + name) the values of an earlier version kept for patching."""
+        values = dict(self._derived)
+        if self._tables is not None:
+            values["tables"] = self._tables
+        values.update((f"base:{name}", value) for name, (value, _) in self._base.items())
+        return values
+
+    def drop_cached(self, names):
+        """Free cached values (names as in cached_values()); they are rebuilt when next needed.
+
+        A dropped derived value built by patching is rebuilt in full.
+        """
+        for name in names:
+            if name == "tables":
+                self._tables = None
+            elif name.startswith("base:"):
+                self._base.pop(name[len("base:"):], None)
+            else:
+                self._derived.pop(name, None)
+
+    # --- Edits ---
+
+    def subset(self, grant_ids):
+        """Portfolio holding only the given grants (partitions are shared, not copied)."""
+        wanted = set(grant_ids)
+        grant_ids = [grant_id for grant_id in self.grants if grant_id in wanted]
+        return Portfolio(
+            {grant_id: self.grants[grant_id] for grant_id in grant_ids},
+            {grant_id: self.vests.get(grant_id, {}) for grant_id in grant_ids},
+            {grant_id: self.sales.get(grant_id, {}) for grant_id in grant_ids},
+            self.fx,
+        )
+
+    def _replace(self, grants, vests, sales, changed_grant_ids):
+        # New version sharing the fingerprints of every grant it did not touch and
+        # remembering what changed, so patchable derived values can be updated in place
+        changed = set(changed_grant_ids) | (set(self.grants) - set(grants))
+        portfolio = Portfolio(grants, vests, sales, self.fx)
+        portfolio._grant_fingerprints = {
+            grant_id: fingerprint
+            for grant_id, fingerprint in self._grant_fingerprints.items()
+            if grant_id in grants and grant_id not in changed
+        }
+        portfolio._base = {name: (value, changed_before | changed) for name, (value, changed_before) in self._base.items()}
+        portfolio._base.update((name, (self._derived[name], changed)) for name in self._patchable if name in self._derived)
+        return portfolio
+
+    def with_grants(self, grant_rows):
+        """Replace the grants table. Grants that are kept keep their vests and sales."""
+        grants = {row["grant_id"]: row for row in grant_rows}
+        vests = {grant_id: self.vests.get(grant_id, {}) for grant_id in grants}
+        sales = {grant_id: self.sales.get(grant_id, {}) for grant_id in grants}
+        changed = {grant_id for grant_id, row in grants.items() if self.grants.get(grant_id) != row}
+        return self._replace(grants, vests, sales, changed)
+
+    def with_vests(self, grant_id, vest_rows):
+        """Replace all vests of one grant."""
+        vests = dict(self.vests)
+        vests[grant_id] = {row["vest_id"]: row for row in vest_rows}
+        return self._replace(self.grants, vests, self.sales, {grant_id})
+
+    def with_sales(self, grant_id, sale_rows):
+        """Insert or replace individual sales of one grant, keyed by vest_id and sale_id."""
+        grant_sales = dict(self.sales.get(grant_id, {}))
+        grant_sales.update((sale_key(row), row) for row in sale_rows)
+        sales = dict(self.sales)
+        sales[grant_id] = grant_sales
+        return self._replace(self.grants, self.vests, sales, {grant_id})
+
+    def with_vest_sales(self, grant_id, vest_id, sale_rows):
+        """Replace the sales drawn from one vest, keeping the grant's other sales."""
+        grant_sales = {key: sale for key, sale in self.sales.get(grant_id, {}).items() if sale.get("vest_id") != vest_id}
+        grant_sales.update((sale_key(row), row) for row in sale_rows)
+        sales = dict(self.sales)
+        sales[grant_id] = grant_sales
+        return self._replace(self.grants, self.vests, sales, {grant_id})
+
+    def with_lots(self, vest_rows=None, sale_rows=None):
+        """Insert or replace individual vests and sales of several grants in one new version.
+
+        `vest_rows` and `sale_rows` map grant_id -> rows, keyed as in `vests` and `sales`.
+        """
+        vest_rows, sale_rows = vest_rows or {}, sale_rows or {}
+        vests, sales = dict(self.vests), dict(self.sales)
+        for grant_id, rows in vest_rows.items():
+            vests[grant_id] = {**self.vests.get(grant_id, {}), **{row["vest_id"]: row for row in rows}}
+        for grant_id, rows in sale_rows.items():
+            sales[grant_id] = {**self.sales.get(grant_id, {}), **{sale_key(row): row for row in rows}}
+        return self._replace(self.grants, vests, sales, set(vest_rows) | set(sale_rows))
+
+    def snapshot(self):
+        """This version without its cached tables and derived values, for keeping in an edit history.
+
+        Shares the grant, vest and sale partitions (and per-grant fingerprints) with this portfolio.
+        """
+        portfolio = Portfolio(self.grants, self.vests, self.sales, self.fx)
+        portfolio._grant_fingerprints = self._grant_fingerprints
+        return portfolio
+
+    def restore(self, version):
+        """Another version of this portfolio (e.g. a snapshot) as a new version of this one.
+
+        Grants whose partitions `version` shares with this portfolio count as unchanged,
+        so patchable derived values are only updated for the grants that differ.
+        The FX store of this portfolio is kept.
+        """
+        changed = {
+            grant_id for grant_id in set(self.grants) | set(version.grants)
+            if self.grants.get(grant_id) is not version.grants.get(grant_id)
+            or self.vests.get(grant_id) is not version.vests.get(grant_id)
+            or self.sales.get(grant_id) is not version.sales.get(grant_id)
+        }
+        portfolio = self._replace(version.grants, version.vests, version.sales, changed)
+        portfolio._grant_fingerprints.update((grant_id, fingerprint) for grant_id, fingerprint in version._grant_fingerprints.items() if grant_id in changed)
+        return portfolio
+
+    def with_fx(self, fx):
+        """Use another FxStore. The stored taxes of grants with lots in other currencies are recalculated."""
+        if fx is self.fx:
+            return self
+        portfolio = Portfolio(self.grants, self.vests, self.sales, fx)
+        # The grants are unchanged; only what is derived from converted prices is not
+        portfolio._grant_fingerprints = dict(self._grant_fingerprints)
+        foreign = [grant_id for grant_id in self.grants if self.is_foreign(grant_id)]
+        return portfolio.with_derived_fields(foreign) if foreign else portfolio
+
+    @timed
+    def with_derived_fields(self, grant_ids=None):
+        """Recalculate the derived tax fields (in AUD) of every lot in one batch.
+
+        With `grant_ids`, only the lots of those grants are recalculated and the
+        other grants are shared with this portfolio.
+        """
+        if grant_ids is not None:
+            recalculated = self.subset(grant_ids).with_derived_fields()
+            return self.with_lots(
+                {grant_id: list(vests.values()) for grant_id, vests in recalculated.vests.items()},
+                {grant_id: list(sales.values()) for grant_id, sales in recalculated.sales.items()},
+            )
+        vests_df, sales_df = calculate_lot_taxes(*self.lot_tables())
+
+        vests = {grant_id: {} for grant_id in self.grants}
+        for (grant_id, vest), tax_at_vest in zip(self.iter_vests(), vests_df["tax_at_vest"].tolist()):
+            vests[grant_id][vest["vest_id"]] = {**vest, "tax_at_vest": tax_at_vest}
+
+        sales = {grant_id: {} for grant_id in self.grants}
+        derived = sales_df[["vest_found"] + DERIVED_SALE_FIELDS].to_dict("records")
+        for (grant_id, sale), fields in zip(self.iter_sales(), derived):
+            sale = dict(sale)
+            if fields.pop("vest_found"):
+                sale.pop("tax_within_30_days", None)
+                sale.update((k, v) for k, v in fields.items() if not pd.isna(v))
+            sales[grant_id][sale_key(sale)] = sale
+        return Portfolio(self.grants, vests, sales, self.fx)
+
+
+def _hash(obj):
+    encoded = json.dumps(obj, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+@timed
+def _portfolio_fingerprint(portfolio):
+    partitions = [[grant_id, portfolio.grant_fingerprint(grant_id)] for grant_id in portfolio.grants]
+    if portfolio.fx is not None:
+        # Converted values depend on the rates too
+        partitions.append(["fx", portfolio.fx.fingerprint()])
+    return _hash(partitions)
+
+@timed
+def _build_lot_tables(portfolio):
+    grants_df, vests_df, sales_df = portfolio.tables()
+    if not has_foreign_lots(grants_df, vests_df, sales_df):
+        return vests_df, sales_df
+    return convert_lot_tables(grants_df, vests_df, sales_df, portfolio.fx)
+
+def vest_key(vest):
+    """Key of a vest row within its grant's vests."""
+    return vest["vest_id"]
+
+def sale_key(sale):
+    """Key of a sale row within its grant's sales: (vest_id, sale_id)."""
+    return sale.get("vest_id"), sale["sale_id"]
+
+def _index_rows(rows, key, label):
+    indexed = {}
+    for row in rows:
+        row_key = key(row)
+        if row_key in indexed:
+            raise ValueError(f"Duplicate {label}: '{row_key[-1] if isinstance(row_key, tuple) else row_key}'.")
+        indexed[row_key] = dict(row)
+    return indexed
+
+def _frame(rows, columns):
+    df = pd.DataFrame.from_records(list(rows))
+    return df.reindex(columns=list(dict.fromkeys(columns + list(df.columns))))
@@ -0,0 +1,184 @@
+# prices.py
+# Local price history used to fill in missing vest and sale prices.
+# Daily closes of every symbol are kept as flat columnar arrays sorted by
+# (symbol, date), so a lookup for any mix of symbols and dates is one binary
+# search (np.searchsorted) over the whole store. Prices come from local CSV files
+# only; a saved store can be memory-mapped instead of parsed again.
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.profiling import timed
+
+# Keys are symbol_code * KEY_STRIDE + days since 1970-01-01
+KEY_STRIDE = 1 << 32
+PRICE_COLUMNS = ["symbol", "date", "close"]
+
+
+def _days(dates):
+    return pd.to_datetime(pd.Series(dates), errors="coerce").to_numpy("datetime64[D]").astype(np.int64)
+
+def _read_price_csv(source, name=None):
+    # "symbol,date,close" rows; files without a symbol column (e.g. broker or Yahoo
+    # exports of one ticker) take the symbol from the file name ("AMZN.csv")
+    df = pd.read_csv(source)
+    df.columns = [str(column).strip().lower() for column in df.columns]
+    if "symbol" not in df.columns:
+        name = name or getattr(source, "name", None) or str(source)
+        df["symbol"] = os.path.splitext(os.path.basename(name))[0]
+    missing = [column for column in PRICE_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"Price file {name or source} has no {', '.join(missing)} column.")
+    return df[PRICE_COLUMNS]
+
+
+class PriceStore:
+    """Daily closing prices per symbol, with a vectorized as-of-date lookup.
+
+    `keys` (sorted) and `closes` are parallel arrays; `symbols` maps a symbol to
+    the code used in its keys.
+    """
+
+    def __init__(self, symbols, keys, closes):
+        self.symbols = symbols
+        self.keys = keys
+        self.closes = closes
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build a store from a frame with symbol, date and close columns (later rows win on duplicates)."""
+        df = pd.DataFrame({
+            "symbol": df["symbol"].astype(str).str.strip().str.upper(),
+            "day": _days(df["date"]),
+            "close": pd.to_numeric(df["close"], errors="coerce").to_numpy(),
+        })
+        df = df[(df["day"] != np.iinfo(np.int64).min) & df["close"].notna()]
+        symbols = {symbol: code for code, symbol in enumerate(sorted(df["symbol"].unique()))}
+        keys = df["symbol"].map(symbols).to_numpy(np.int64) * KEY_STRIDE + df["day"].to_numpy(np.int64)
+        # Stable sort, then keep the last row of each key
+        order = np.argsort(keys, kind="stable")
+        keys, closes = keys[order], df["close"].to_numpy(np.float64)[order]
+        last = np.append(keys[1:] != keys[:-1], True) if len(keys) else np.array([], dtype=bool)
+        return cls(symbols, keys[last], closes[last])
+
+    @classmethod
+    def from_csv(cls, sources):
+        """Build a store from CSV files (paths or file objects)."""
+        frames = [_read_price_csv(source) for source in sources]
+        return cls.from_frame(pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=PRICE_COLUMNS))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "keys.npy"), self.keys)
+        np.save(os.path.join(directory, "closes.npy"), self.closes)
+        with open(os.path.join(directory, "symbols.json"), "w") as f:
+            json.dump(self.symbols, f)
+
+    @classmethod
+    def load(cls, directory):
+        """Open a saved store; the price arrays are memory-mapped, not read."""
+        with open(os.path.join(directory, "symbols.json")) as f:
+            symbols = json.load(f)
+        keys = np.load(os.path.join(directory, "keys.npy"), mmap_mode="r")
+        closes = np.load(os.path.join(directory, "closes.npy"), mmap_mode="r")
+        return cls(symbols, keys, closes)
+
+    def lookup(self, symbols, dates, max_age_days=None):
+        """Close of each (symbol, date) on that date or the last trading day before it.
+
+        Returns a float array; NaN where the symbol is unknown, the date is before its
+        history, or the last close is more than `max_age_days` old.
+        """
+        codes = pd.Series(symbols, dtype=object).astype(str).str.strip().str.upper().map(self.symbols).to_numpy(np.float64)
+        days = _days(dates)
+        known = ~np.isnan(codes) & (days != np.iinfo(np.int64).min)
+        prices = np.full(len(codes), np.nan)
+        if not known.any() or not len(self.keys):
+            return prices
+
+        codes = codes[known].astype(np.int64)
+        days = days[known]
+        wanted = codes * KEY_STRIDE + days
+        # Last key <= wanted; it must belong to the same symbol
+        position = np.searchsorted(self.keys, wanted, side="right") - 1
+        found = position >= 0
+        position = np.where(found, position, 0)
+        found &= (self.keys[position] // KEY_STRIDE) == codes
+        if max_age_days is not None:
+            found &= (wanted - self.keys[position]) <= max_age_days
+        prices[np.flatnonzero(known)[found]] = self.closes[position[found]]
+        return prices
+
+    def fill_missing(self, prices, symbols, dates, max_age_days=None):
+        """`prices` with its missing values looked up. Returns (prices, mask of filled values)."""
+        prices = pd.to_numeric(pd.Series(prices), errors="coerce").to_numpy(np.float64).copy()
+        missing = np.isnan(prices)
+        if missing.any():
+            symbols = np.broadcast_to(np.asarray(symbols, dtype=object), prices.shape)
+            looked_up = self.lookup(symbols[missing], np.asarray(dates, dtype=object)[missing], max_age_days)
+            prices[missing] = looked_up
+            missing[missing] = ~np.isnan(looked_up)
+        return prices, missing
+
+
+@timed
+def fill_editor_prices(edited_df, price_column, date_column, symbol, store):
+    """Editor table with blank prices filled from the store (rows not found stay blank)."""
+    if edited_df.empty or price_column not in edited_df:
+        return edited_df
+    prices, filled = store.fill_missing(edited_df[price_column], symbol, edited_df[date_column].to_numpy(dtype=object))
+    if not filled.any():
+        return edited_df
+    edited_df = edited_df.copy()
+    edited_df[price_column] = prices
+    return edited_df
+
+@timed
+def backfill_prices(portfolio, store, max_age_days=None):
+    """Fill missing vest_price/sale_price of every lot from the store in one lookup per table.
+
+    Returns (portfolio, number of vest prices filled, number of sale prices filled). The
+    derived taxes of the grants that changed are recalculated.
+    """
+    # Imported here: portfolio.py imports this module (through fx.py)
+    from utils.portfolio import sale_key, vest_key
+
+    grants_df, vests_df, sales_df = portfolio.tables()
+    symbols = grants_df.set_index("grant_id")["symbol"]
+
+    filled_lots = {}  # (table, grant_id) -> that grant's lots with the filled prices
+    counts = []
+    for table, df, price_field, date_field, key, lots in [
+        ("vests", vests_df, "vest_price", "vest_date", vest_key, portfolio.vests),
+        ("sales", sales_df, "sale_price", "sale_date", sale_key, portfolio.sales),
+    ]:
+        rows = df[df[price_field].isna()]
+        if rows.empty:
+            counts.append(0)
+            continue
+        prices, filled = store.fill_missing(
+            rows[price_field],
+            rows["grant_id"].map(symbols).to_numpy(dtype=object),
+            rows[date_field].to_numpy(dtype=object),
+            max_age_days,
+        )
+        rows = rows[filled]
+        for grant_id, row, price in zip(rows["grant_id"], rows.to_dict("records"), prices[filled].tolist()):
+            grant_lots = filled_lots.setdefault((table, grant_id), dict(lots[grant_id]))
+            grant_lots[key(row)] = {**grant_lots[key(row)], price_field: price}
+        counts.append(len(rows))
+
+    changed = {grant_id for _, grant_id in filled_lots}
+    if changed:
+        # Recalculate the derived taxes of the changed grants in one batch
+        portfolio = portfolio.with_lots(
+            {grant_id: list(lots.values()) for (table, grant_id), lots in filled_lots.items() if table == "vests"},
+            {grant_id: list(lots.values()) for (table, grant_id), lots in filled_lots.items() if table == "sales"},
+        ).with_derived_fields(changed)
+    return portfolio, counts[0], counts[1]
@@ -0,0 +1,141 @@
+# profiling.py
+# Opt-in per-stage instrumentation: wall time, call counts and (optionally) peak
+# allocations of the app's stages during one rerun.
+# Stages are marked with the @timed decorator or the stage() context manager.
+# While no thread is recording they return after checking one module global, so
+# the instrumentation costs a function call per stage when it is off.
+
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+class _Local(threading.local):
+    # Each streamlit session runs its script on its own thread, so each records its own rerun
+    recorder = None
+
+_local = _Local()
+# Threads with a recorder; the thread-local is only looked at while any are recording
+_recording = 0
+# Recorders tracing memory; tracemalloc runs while any are, unless it was already on
+_tracing = 0
+_started_tracemalloc = False
+_recording_lock = threading.Lock()
+
+
+class StageRecorder:
+    """Totals per stage name: calls, seconds (inclusive of nested stages) and peak_bytes.
+
+    Peaks come from tracemalloc, whose traced memory and peak are process-wide: while
+    other sessions trace too, their allocations count towards this one's stages and
+    their stage changes reset the peak, so peaks are approximate then.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.started = time.perf_counter()
+        self.seconds = None
+        # Open stages: [name, start time, allocated bytes at start, highest allocation seen]
+        self._open = []
+
+    def enter(self, name):
+        allocated = 0
+        if self.trace_memory:
+            allocated, peak = tracemalloc.get_traced_memory()
+            if self._open:
+                self._open[-1][3] = max(self._open[-1][3], peak)
+            tracemalloc.reset_peak()
+        self._open.append([name, time.perf_counter(), allocated, allocated])
+
+    def exit(self):
+        name, start, allocated, highest = self._open.pop()
+        seconds = time.perf_counter() - start
+        if self.trace_memory:
+            highest = max(highest, tracemalloc.get_traced_memory()[1])
+            if self._open:
+                # The enclosing stage's peak includes this one's
+                self._open[-1][3] = max(self._open[-1][3], highest)
+        totals = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "peak_bytes": None})
+        totals["calls"] += 1
+        totals["seconds"] += seconds
+        if self.trace_memory:
+            totals["peak_bytes"] = max(totals["peak_bytes"] or 0, highest - allocated)
+
+    def to_dict(self):
+        """The recorded stages, slowest first, as a JSON-ready dict."""
+        stages = [{"stage": name, **totals} for name, totals in self.stages.items()]
+        stages.sort(key=lambda row: row["seconds"], reverse=True)
+        return {"seconds": self.seconds, "trace_memory": self.trace_memory, "stages": stages}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+
+def start(trace_memory=False):
+    """Record the stages run on this thread from now on. Returns the recorder.
+
+    Every start() needs a stop() on the same thread, even if the run raises.
+    """
+    global _recording, _tracing, _started_tracemalloc
+    stop()
+    with _recording_lock:
+        if trace_memory:
+            if _tracing == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _started_tracemalloc = True
+            _tracing += 1
+        _recording += 1
+    recorder = _local.recorder = StageRecorder(trace_memory)
+    return recorder
+
+def stop():
+    """Stop recording on this thread. Returns the recorder, or None if none was started.
+
+    tracemalloc is stopped with the last recorder tracing memory.
+    """
+    global _recording, _tracing, _started_tracemalloc
+    recorder = _local.recorder
+    _local.recorder = None
+    if recorder is not None:
+        recorder.seconds = time.perf_counter() - recorder.started
+        with _recording_lock:
+            _recording -= 1
+            if recorder.trace_memory:
+                _tracing -= 1
+                if _tracing == 0 and _started_tracemalloc:
+                    tracemalloc.stop()
+                    _started_tracemalloc = False
+    return recorder
+
+@contextmanager
+def stage(name):
+    """Record the enclosed block as stage `name`."""
+    recorder = _local.recorder if _recording else None
+    if recorder is None:
+        yield
+        return
+    recorder.enter(name)
+    try:
+        yield
+    finally:
+        recorder.exit()
+
+def timed(func):
+    """Record every call of `func` as the stage "<module>.<function>"."""
+    module = func.__module__.rsplit(".", 1)[-1]
+    name = f"{'app' if module == '__main__' else module}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        recorder = _local.recorder if _recording else None
+        if recorder is None:
+            return func(*args, **kwargs)
+        recorder.enter(name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            recorder.exit()
+    return wrapper
@@ -0,0 +1,101 @@
+# reconciliation.py
+# Share ledger checks: every sale draws on a vest that exists and had vested,
+# no vest sells more shares than it vested, and no grant vests more shares than
+# it granted. Sales are replayed per vest in date order from the lot facts (a
+# sort, then running totals), and since every check stays within one grant, an
+# edit only re-checks the grants it touched.
+
+import numpy as np
+import pandas as pd
+
+from utils.facts import SALE_EVENT, VEST_EVENT, lot_facts
+from utils.profiling import timed
+
+ISSUE_COLUMNS = ["grant_id", "vest_id", "sale_id", "check", "message"]
+# Checks, in the order a grant's issues are listed
+CHECKS = ["over_vested_grant", "orphan_sale", "sale_before_vest", "oversold_vest"]
+
+
+def _issues(rows, check, messages):
+    return pd.DataFrame({
+        "grant_id": rows["grant_id"].to_numpy(),
+        "vest_id": rows["vest_id"].to_numpy() if "vest_id" in rows else None,
+        "sale_id": rows["sale_id"].to_numpy() if "sale_id" in rows else None,
+        "check": check,
+        "message": list(messages),
+    })
+
+def _reconcile(facts, num_stocks):
+    # Issues of the grants in `facts`; `num_stocks` maps their grant IDs to the number granted
+    vests = facts[(facts["event"] == VEST_EVENT).to_numpy()]
+    sales = facts[(facts["event"] == SALE_EVENT).to_numpy()]
+    orphans = sales[~sales["vest_found"].to_numpy(dtype=bool)]
+    sales = sales[sales["vest_found"].to_numpy(dtype=bool)]
+
+    vested = vests.groupby("grant_id", sort=False)["shares_vested"].sum()
+    granted = vested.index.map(num_stocks)
+    over_vested = vested[vested.to_numpy() > np.asarray(granted, dtype=float)].reset_index()
+    over_vested["num_stocks"] = over_vested["grant_id"].map(num_stocks)
+
+    before_vest = sales[sales["holding_period"].to_numpy() < 0]
+
+    # The ledger: each vest's sales in date order (ties in entry order), with the
+    # shares the vest has left after each one
+    ledger = sales.sort_values(["grant_id", "vest_id", "sale_date"], kind="mergesort")
+    sold = ledger.groupby(["grant_id", "vest_id"], sort=False)["shares_sold"].cumsum()
+    remaining = ledger["shares_vested"] - sold
+    oversold = ledger[(remaining < 0).to_numpy()]
+    excess = np.minimum(-remaining[(remaining < 0).to_numpy()], oversold["shares_sold"]).astype(int)
+
+    frames = [
+        _issues(over_vested, "over_vested_grant", (
+            f"Data inconsistency: Grant '{row.grant_id}' has {int(row.shares_vested)} shares vested, more than its {int(row.num_stocks)} stocks."
+            for row in over_vested.itertuples()
+        )),
+        _issues(orphans, "orphan_sale", (
+            f"Data inconsistency: Vest ID '{row.vest_id}' not found for Sale ID '{row.sale_id}' in Grant '{row.grant_id}'. Skipping this sale in summary."
+            for row in orphans.itertuples()
+        )),
+        _issues(before_vest, "sale_before_vest", (
+            f"Data inconsistency: Sale ID '{row.sale_id}' in Grant '{row.grant_id}' is dated {row.sale_date}, before Vest '{row.vest_id}' vested on {row.vest_date}."
+            for row in before_vest.itertuples()
+        )),
+        _issues(oversold, "oversold_vest", (
+            f"Data inconsistency: Sale ID '{row.sale_id}' in Grant '{row.grant_id}' sells {count} more shares than Vest '{row.vest_id}' has left ({int(row.shares_vested)} vested)."
+            for row, count in zip(oversold.itertuples(), excess.tolist())
+        )),
+    ]
+    frames = [frame for frame in frames if not frame.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=ISSUE_COLUMNS)
+
+def _in_grant_order(issues, portfolio):
+    # Grants in portfolio order, each with its issues in CHECKS order
+    grant_seq = {grant_id: seq for seq, grant_id in enumerate(portfolio.grants)}
+    order = np.lexsort((issues["check"].map(CHECKS.index).to_numpy(), issues["grant_id"].map(grant_seq).to_numpy()))
+    return issues.iloc[order].reset_index(drop=True)
+
+@timed
+def build_reconciliation(portfolio):
+    grants_df = portfolio.tables()[0]
+    num_stocks = pd.to_numeric(grants_df.set_index("grant_id")["num_stocks"], errors="coerce")
+    return _in_grant_order(_reconcile(lot_facts(portfolio), num_stocks), portfolio)
+
+@timed
+def patch_reconciliation(issues, portfolio, changed_grant_ids):
+    """Re-check only the grants changed since an earlier version's issues were found."""
+    changed = [grant_id for grant_id in changed_grant_ids if grant_id in portfolio.grants]
+    facts = lot_facts(portfolio)
+    num_stocks = pd.to_numeric(pd.Series({grant_id: portfolio.grants[grant_id]["num_stocks"] for grant_id in changed}, dtype=object), errors="coerce")
+    fresh = _reconcile(facts[facts["grant_id"].isin(changed)], num_stocks)
+    kept = issues[~issues["grant_id"].isin(changed_grant_ids)]
+    return _in_grant_order(pd.concat([kept, fresh], ignore_index=True) if not fresh.empty else kept, portfolio)
+
+def reconcile(portfolio):
+    """Share ledger issues of a portfolio: one row per problem, in grant order (ISSUE_COLUMNS).
+
+    Checks (CHECKS): grants vesting more shares than num_stocks, sales whose vest
+    is missing, sales dated before their vest, and sales that take a vest's
+    running balance below zero (each such sale, with the shares it oversells).
+    Found once per portfolio version; after an edit only the changed grants are re-checked.
+    """
+    return portfolio.derived("reconciliation", build_reconciliation, patch_reconciliation)
@@ -0,0 +1,319 @@
+# reports.py
+# The data behind every chart and table of the app, without any rendering.
+# visualization.py turns these frames into plotly figures and streamlit output;
+# batch jobs and tests can use them without importing either.
+
+import numpy as np
+import pandas as pd
+
+from utils.facts import lot_facts, vest_lots, sale_lots, matched_lots, tax_year_label, grant_year_totals, tax_year_totals, symbol_year_totals
+from utils.profiling import timed
+
+def get_australian_tax_year(date_obj):
+    if date_obj.month < 7:
+        return tax_year_label(date_obj.year - 1)
+    return tax_year_label(date_obj.year)
+
+
+# --- RSU details and totals ---
+
+def rsu_details(portfolio, grant_ids=None):
+    """Yield (grant, vests table or None, sales table or None, totals table) per grant (or per grant in `grant_ids`)."""
+    facts = lot_facts(portfolio)
+    if grant_ids is not None:
+        facts = facts[facts["grant_id"].isin(grant_ids)]
+    vests_by_grant = dict(tuple(vest_lots(facts).groupby("grant_id", sort=False)))
+    sales_by_grant = dict(tuple(sale_lots(facts).groupby("grant_id", sort=False)))
+    for grant_id in (portfolio.grants if grant_ids is None else grant_ids):
+        grant = portfolio.grants[grant_id]
+        vests = vests_by_grant.get(grant_id)
+        sales = sales_by_grant.get(grant_id)
+        vests_table = sales_table = None
+
+        if vests is not None:
+            vests_table = pd.DataFrame({
+                "Vest ID": vests["vest_id"],
+                "Vest Date": vests["vest_date"],
+                "Shares Vested": vests["shares_vested"],
+                "Vest Price": vests["vest_price"].map(lambda v: f"${v}"),
+                "Tax at Vest": vests["tax_at_vest"].map(lambda v: f"${v}"),
+            }).reset_index(drop=True)
+
+        if sales is not None:
+            sales_table = pd.DataFrame({
+                "Sale ID": sales["sale_id"],
+                "Sale Date": sales["sale_date"],
+                "Shares Sold": sales["shares_sold"],
+                "Sale Price": sales["sale_price"].map(lambda v: f"${v}"),
+                "Tax at Sale": sales["tax_at_sale"].map(lambda v: f"${v}"),
+            }).reset_index(drop=True)
+
+        total_tax_at_vest = vests["tax_at_vest"].sum() if vests is not None else 0
+        total_capital_gains_tax = sales["tax_at_sale"].sum() if sales is not None else 0
+        totals_table = pd.DataFrame([{
+            "Type": "Totals",
+            "Tax at Vest": f"${total_tax_at_vest:,.2f}",
+            "Tax at Sale": f"${total_capital_gains_tax:,.2f}",
+        }])
+        yield grant, vests_table, sales_table, totals_table
+
+@timed
+def rsu_details_page(portfolio, page, page_size):
+    """The rsu_details of the grants on one page (0-based) of `page_size` grants, as a list."""
+    grant_ids = list(portfolio.grants)[page * page_size:(page + 1) * page_size]
+    return list(rsu_details(portfolio, grant_ids))
+
+def portfolio_totals(portfolio):
+    """(total tax at vest, total tax at sale) over all lots."""
+    facts = lot_facts(portfolio)
+    return vest_lots(facts)["tax_at_vest"].sum(), sale_lots(facts)["tax_at_sale"].sum()
+
+
+# --- Financial year summary ---
+
+YEAR_SUMMARY_COLUMNS = {
+    "vest_tax": "Tax at Vest",
+    "sale_tax": "Tax at Sale",
+    "capital_gains": "Capital Gains",
+    "capital_losses": "Capital Losses",
+    "net_gain": "Net Gain",
+    "sales": "Sales",
+}
+
+def tax_years(portfolio):
+    """Financial years with any vest or sale, oldest first."""
+    return list(tax_year_totals(portfolio).index)
+
+@timed
+def tax_year_summary(portfolio, tax_year, by="grant_id"):
+    """(totals of `tax_year`, its totals per grant or per symbol), read from the rollups."""
+    totals = tax_year_totals(portfolio)
+    year_totals = totals.loc[tax_year, list(YEAR_SUMMARY_COLUMNS)] if tax_year in totals.index else pd.Series(0.0, index=list(YEAR_SUMMARY_COLUMNS))
+    if by == "symbol":
+        rows = symbol_year_totals(portfolio).xs(tax_year, level="tax_year")
+        label = "Symbol"
+    else:
+        rows = grant_year_totals(portfolio).xs(tax_year, level="tax_year").droplevel("symbol")
+        label = "Grant ID"
+    table = rows[list(YEAR_SUMMARY_COLUMNS)].rename(columns=YEAR_SUMMARY_COLUMNS).rename_axis(label).reset_index()
+    return year_totals.rename(YEAR_SUMMARY_COLUMNS), table
+
+
+# --- Chart data ---
+# Charts draw one bar per vest/sale only up to CHART_DETAIL_LIMIT rows. Past that
+# the rows are aggregated here, keeping the CHART_TOP_N largest grants and grouping
+# the rest as "Other", so a figure stays the same size however many lots there are.
+# Drilling down into one year or grant shows its detail again.
+
+CHART_DETAIL_LIMIT = 500
+CHART_TOP_N = 10
+OTHER = "Other"
+
+def chart_rows(portfolio):
+    """Number of rows the per-event charts would draw without aggregation."""
+    return len(matched_lots(lot_facts(portfolio)))
+
+def _top_n(keys, weights, n=CHART_TOP_N):
+    # `keys` with all but the n keys of largest total weight replaced by OTHER
+    totals = weights.groupby(keys).sum()
+    if len(totals) <= n:
+        return keys
+    return keys.where(keys.isin(totals.nlargest(n).index), OTHER)
+
+def _aggregate_tax_events(df):
+    # One bar segment per (year, tax type, grant), with the number of events in it
+    df = df.assign(**{"Grant ID": _top_n(df["Grant ID"], df["Amount"])})
+    df = df.groupby(["Tax Year", "Type", "Grant ID"], sort=True).agg(Amount=("Amount", "sum"), events=("Amount", "size")).reset_index()
+    df["Event ID"] = df["events"].astype(str) + " events"
+    df = df[["Tax Year", "Type", "Amount", "Event ID", "Grant ID"]]
+    df.attrs["detail"] = f"largest {CHART_TOP_N} grants, others grouped"
+    return df
+
+def _aggregate_prices(vest_df, sale_df, grant_id=None):
+    # Average vest and sale price per grant (largest CHART_TOP_N by vests), or for one
+    # grant per run of consecutive vests, with at most CHART_DETAIL_LIMIT / 2 runs
+    if grant_id is None:
+        groups = _top_n(vest_df["Grant ID"], pd.Series(1, index=vest_df.index))
+        group_of_vest = dict(zip(zip(vest_df["Grant ID"], vest_df["Vest ID"]), groups))
+        detail = f"average per grant, largest {CHART_TOP_N} grants, others grouped"
+    else:
+        runs = np.arange(len(vest_df)) * (CHART_DETAIL_LIMIT // 2) // len(vest_df)
+        vest_ids = vest_df["Vest ID"].astype(str).to_numpy()
+        first = pd.Series(vest_ids).groupby(runs).transform("first").to_numpy()
+        last = pd.Series(vest_ids).groupby(runs).transform("last").to_numpy()
+        labels = np.where(first == last, first, first + ".." + last)
+        groups = pd.Series(grant_id + " - " + labels, index=vest_df.index)
+        group_of_vest = dict(zip(zip(vest_df["Grant ID"], vest_df["Vest ID"]), groups))
+        detail = "average per run of vests"
+
+    combined_df = pd.concat([vest_df, sale_df], ignore_index=True)
+    combined_df["Grant_Vest"] = [group_of_vest.get(key, OTHER) for key in zip(combined_df["Grant ID"], combined_df["Vest ID"])]
+    combined_df = combined_df.groupby(["Grant_Vest", "Type"], sort=False)["Price"].mean().reset_index()
+    combined_df.insert(0, "Grant ID", grant_id if grant_id is not None else combined_df["Grant_Vest"])
+    combined_df.insert(1, "Vest ID", "")
+    combined_df.attrs["detail"] = detail
+    return combined_df
+
+def _tax_events(portfolio):
+    # Vesting tax and tax at sale of every lot, per grant in vest-then-sale order
+    events = matched_lots(lot_facts(portfolio))
+    is_vest = events["event"] == "Vest"
+    return events, is_vest.to_numpy()
+
+def _net_gains_rows(portfolio):
+    # One "Net Gain" and one "Taxes Paid" row per sale (all net gains first, then all taxes)
+    sales = sale_lots(lot_facts(portfolio))
+    net_gains = pd.DataFrame({
+        "Tax Year": sales["tax_year"],
+        "Sale ID": sales["sale_id"],
+        "Type": "Net Gain",
+        "Amount": (sales["sale_price"] * sales["shares_sold"]) - sales["tax_at_sale"],
+        "Grant ID": sales["grant_id"],
+    })
+    taxes = pd.DataFrame({
+        "Tax Year": sales["tax_year"],
+        "Sale ID": sales["sale_id"],
+        "Type": "Taxes Paid",
+        "Amount": sales["tax_at_sale"] + sales["tax_at_vest"],
+        "Grant ID": sales["grant_id"],
+    })
+    return pd.concat([net_gains, taxes], ignore_index=True)
+
+def _stock_performance_rows(portfolio):
+    # Vest price of every vest, and the sale prices of its sales grouped by vest
+    facts = lot_facts(portfolio)
+    vests = vest_lots(facts)
+    sales = sale_lots(facts).sort_values(["grant_seq", "vest_seq"], kind="mergesort")
+    vest_df = pd.DataFrame({
+        "Grant ID": vests["grant_id"],
+        "Vest ID": vests["vest_id"],
+        "Price": vests["vest_price"],
+        "Type": "Vest Price",
+    }).reset_index(drop=True)
+    sale_df = pd.DataFrame({
+        "Grant ID": sales["grant_id"],
+        "Vest ID": sales["vest_id"],
+        "Price": sales["sale_price"],
+        "Type": "Sale Price",
+    }).reset_index(drop=True)
+    return vest_df, sale_df
+
+@timed
+def tax_breakdown_chart_data(portfolio, tax_year=None):
+    """One row per vest/sale tax, or per (year, type, grant) past CHART_DETAIL_LIMIT rows."""
+    events, is_vest = _tax_events(portfolio)
+    if tax_year is not None:
+        in_year = (events["tax_year"] == tax_year).to_numpy()
+        events, is_vest = events[in_year], is_vest[in_year]
+    if events.empty:
+        return None
+
+    df = pd.DataFrame({
+        "Tax Year": events["tax_year"],
+        "Type": np.where(is_vest, "Vesting Tax", "Tax at Sale"),
+        "Amount": np.where(is_vest, events["tax_at_vest"], events["tax_at_sale"]),
+        "Event ID": np.where(is_vest, "Vest: " + events["vest_id"].astype(str), "Sale: " + events["sale_id"].astype(str)),
+        "Grant ID": events["grant_id"],
+    }).reset_index(drop=True)
+    if len(df) > CHART_DETAIL_LIMIT:
+        df = _aggregate_tax_events(df)
+    return df
+
+@timed
+def capital_gains_chart_data(portfolio):
+    # Served from the per-tax-year totals, which are patched on edits rather than regrouped
+    totals = tax_year_totals(portfolio)
+    if not totals["sales"].any():
+        return None
+
+    df = pd.concat([
+        pd.DataFrame({"Tax Year": totals.index, "Type": "Gain", "Capital Gains/Losses": totals["capital_gains"].to_numpy(), "count": totals["gain_sales"].to_numpy()}),
+        pd.DataFrame({"Tax Year": totals.index, "Type": "Loss", "Capital Gains/Losses": totals["capital_losses"].to_numpy(), "count": totals["loss_sales"].to_numpy()}),
+    ])
+    return df[df["count"] > 0].sort_values(["Tax Year", "Type"], ignore_index=True).drop(columns="count")
+
+@timed
+def net_gains_chart_data(portfolio):
+    # Served from the per-tax-year totals, which are patched on edits rather than regrouped
+    totals = tax_year_totals(portfolio)
+    totals = totals[totals["sales"] > 0]
+    if totals.empty:
+        return None
+
+    df = pd.concat([
+        pd.DataFrame({"Tax Year": totals.index, "Type": "Net Gain", "Amount": totals["net_gain"].to_numpy()}),
+        pd.DataFrame({"Tax Year": totals.index, "Type": "Taxes Paid", "Amount": totals["taxes_paid"].to_numpy()}),
+    ])
+    return df.sort_values(["Tax Year", "Type"], ignore_index=True)
+
+@timed
+def stock_performance_chart_data(portfolio, grant_id=None):
+    """Vest and sale price per grant-vest, or averaged past CHART_DETAIL_LIMIT rows."""
+    vest_df, sale_df = _stock_performance_rows(portfolio)
+    if grant_id is not None:
+        vest_df = vest_df[vest_df["Grant ID"] == grant_id]
+        sale_df = sale_df[sale_df["Grant ID"] == grant_id]
+    if vest_df.empty:
+        return None
+    if len(vest_df) + len(sale_df) > CHART_DETAIL_LIMIT:
+        return _aggregate_prices(vest_df, sale_df, grant_id)
+
+    combined_df = pd.concat([vest_df, sale_df])
+    combined_df["Grant_Vest"] = combined_df["Grant ID"] + " - " + combined_df["Vest ID"]
+    return combined_df
+
+
+# --- Tables ---
+
+@timed
+def generate_tax_breakdown_table(portfolio):
+    events, is_vest = _tax_events(portfolio)
+    if events.empty:
+        return None
+
+    df = pd.DataFrame({
+        "Tax Year": events["tax_year"],
+        "Type": np.where(is_vest, "Vesting Tax", "Tax at Sale"),
+        "Amount": np.where(is_vest, events["tax_at_vest"], events["tax_at_sale"]),
+        "Grant ID": events["grant_id"],
+        "Vest ID": events["vest_id"].where(is_vest),
+    }).reset_index(drop=True)
+    if not is_vest.all():
+        df["Sale ID"] = events["sale_id"].where(~is_vest).to_numpy()
+
+    return df
+
+@timed
+def generate_capital_gains_table(portfolio):
+    sales = sale_lots(lot_facts(portfolio))
+    if sales.empty:
+        return None
+
+    return pd.DataFrame({
+        "Tax Year": sales["tax_year"],
+        "Capital Gains": sales["capital_gains"],
+        "Type": np.where(sales["capital_gains"] >= 0, "Gain", "Loss"),
+        "Grant ID": sales["grant_id"],
+        "Sale ID": sales["sale_id"],
+    }).reset_index(drop=True)
+
+@timed
+def generate_net_gains_table(portfolio):
+    df = _net_gains_rows(portfolio)
+    if df.empty:
+        return None
+
+    df = df.sort_values(by=["Tax Year", "Sale ID"])
+
+    return df
+
+@timed
+def generate_stock_performance_table(portfolio):
+    vest_df, sale_df = _stock_performance_rows(portfolio)
+    if vest_df.empty:
+        return None
+
+    df = pd.concat([vest_df, sale_df])
+    df = df.sort_values(by=["Grant ID", "Vest ID"])
+
+    return df
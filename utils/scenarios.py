@@ -0,0 +1,195 @@
+# scenarios.py
+# Unrealized positions and "what-if" sales.
+# The shares of each vest that have not been sold yet are open lots; a what-if
+# grid prices selling all of them at every (sale date, sale price) pair in one
+# broadcast, and plan_sale picks which lots a planned sale should draw from,
+# both using the same tax rules as the sales themselves.
+
+import numpy as np
+import pandas as pd
+
+from utils.calculations import WITHIN_30_DAYS, CGT_DISCOUNT_DAYS, calculate_tax_at_vest, capital_gains_tax_columns
+from utils.facts import lot_facts, vest_lots, sale_lots
+from utils.profiling import timed
+
+OPEN_LOT_COLUMNS = ["grant_id", "vest_id", "symbol", "vest_date", "vest_price", "tax_rate_vest", "shares_vested", "shares_sold", "remaining_shares"]
+# Upper bound on lots x prices x dates cells evaluated at once
+GRID_CHUNK_CELLS = 4_000_000
+# Lot selection strategies for plan_sale
+SALE_STRATEGIES = {
+    "min_tax": "Lowest Tax",
+    "fifo": "First In, First Out",
+    "lifo": "Last In, First Out",
+    "highest_cost": "Highest Cost First",
+}
+PLAN_COLUMNS = ["grant_id", "vest_id", "vest_date", "vest_price", "remaining_shares", "shares_sold", "holding_period", "held_over_year", "proceeds", "capital_gains", "tax"]
+
+
+@timed
+def build_open_lots(portfolio):
+    facts = lot_facts(portfolio)
+    vests = vest_lots(facts)
+    sold = sale_lots(facts).groupby(["grant_id", "vest_id"], sort=False)["shares_sold"].sum()
+    lots = vests.join(sold.rename("sold"), on=["grant_id", "vest_id"])
+    lots = lots.assign(shares_sold=lots["sold"].fillna(0).astype("int64"))
+    lots["remaining_shares"] = lots["shares_vested"] - lots["shares_sold"]
+    return lots[OPEN_LOT_COLUMNS].reset_index(drop=True)
+
+def open_lots(portfolio, symbol=None):
+    """Every vest with its shares sold so far and remaining_shares (shares_vested - shares_sold).
+
+    Only vests with shares left are returned; optionally only those of one symbol.
+    Built once per portfolio version.
+    """
+    lots = portfolio.derived("open_lots", build_open_lots)
+    lots = lots[lots["remaining_shares"] > 0]
+    if symbol is not None:
+        lots = lots[lots["symbol"] == symbol]
+    return lots
+
+def _sale_tax(holding_period, vest_price, shares, tax_rate, sale_prices):
+    # Tax at sale as in calculate_sale_taxes: taxed on the proceeds within 30 days of
+    # vesting, otherwise on the capital gain (none on a loss), halved after a year
+    within_30_days = holding_period <= WITHIN_30_DAYS
+    held_over_year = holding_period > CGT_DISCOUNT_DAYS
+    capital_gains_tax = capital_gains_tax_columns(sale_prices, vest_price, shares, tax_rate, held_over_year, holding_period)
+    return np.where(within_30_days, calculate_tax_at_vest(shares, sale_prices, tax_rate), capital_gains_tax), held_over_year
+
+def _grid_chunk(vest_days, vest_price, shares, tax_rate, sale_days, sale_prices):
+    # Arrays shaped (lots, 1, 1), (1, prices, 1) and (1, 1, dates), broadcast to (lots, prices, dates)
+    holding_period = sale_days - vest_days
+    can_sell = holding_period >= 0
+    shares = np.where(can_sell, shares, 0)
+
+    capital_gains = (sale_prices - vest_price) * shares
+    tax, held_over_year = _sale_tax(holding_period, vest_price, shares, tax_rate, sale_prices)
+    totals = {
+        "shares": shares,
+        "proceeds": shares * sale_prices,
+        "capital_gains": capital_gains,
+        "tax": tax,
+        "discounted_shares": np.where(held_over_year, shares, 0),
+    }
+    # Share counts don't depend on the price; give every total the (prices, dates) shape
+    shape = (sale_prices.shape[1], sale_days.shape[2])
+    return {name: np.broadcast_to(values.sum(axis=0), shape) for name, values in totals.items()}
+
+@timed
+def what_if_grid(lots, sale_prices, sale_dates, tax_rate):
+    """Tax and proceeds of selling every open lot at each (sale_date, sale_price) pair.
+
+    `lots` is a frame from open_lots (usually one symbol). `tax_rate` is a fraction,
+    either one rate or one per lot. Lots that have not vested by a sale date are left
+    out of that date. Sales within 30 days of vesting are taxed on the proceeds,
+    capital gains held over a year get the CGT discount, and losses are not taxed,
+    as in calculate_sale_taxes.
+
+    Returns one row per (sale_date, sale_price) with shares, proceeds, capital_gains,
+    tax, net_proceeds (proceeds - tax) and discounted_shares.
+    """
+    sale_prices = np.asarray(sale_prices, dtype=float)
+    sale_dates = pd.to_datetime(pd.Series(sale_dates)).to_numpy("datetime64[D]")
+    vest_days = pd.to_datetime(lots["vest_date"]).to_numpy("datetime64[D]").astype(np.int64)
+    vest_price = lots["vest_price"].to_numpy(dtype=float)
+    shares = lots["remaining_shares"].to_numpy(dtype=float)
+    tax_rate = np.broadcast_to(np.asarray(tax_rate, dtype=float), vest_price.shape)
+
+    totals = {}
+    chunk = max(1, GRID_CHUNK_CELLS // max(1, len(sale_prices) * len(sale_dates)))
+    for start in range(0, len(vest_price), chunk):
+        lot = slice(start, start + chunk)
+        part = _grid_chunk(
+            vest_days[lot, None, None], vest_price[lot, None, None], shares[lot, None, None], tax_rate[lot, None, None],
+            sale_dates.astype(np.int64)[None, None, :], sale_prices[None, :, None],
+        )
+        for name, values in part.items():
+            totals[name] = totals[name] + values if name in totals else values
+
+    if not totals:
+        totals = {name: np.zeros((len(sale_prices), len(sale_dates))) for name in ["shares", "proceeds", "capital_gains", "tax", "discounted_shares"]}
+    # (prices, dates) -> rows ordered by sale date, then sale price
+    grid = pd.DataFrame({
+        "sale_date": np.tile(sale_dates, len(sale_prices)).astype("datetime64[ns]"),
+        "sale_price": np.repeat(sale_prices, len(sale_dates)),
+        **{name: values.ravel() for name, values in totals.items()},
+    })
+    grid["net_proceeds"] = grid["proceeds"] - grid["tax"]
+    grid = grid.sort_values(["sale_date", "sale_price"], kind="mergesort", ignore_index=True)
+    return grid[["sale_date", "sale_price", "shares", "proceeds", "capital_gains", "tax", "net_proceeds", "discounted_shares"]]
+
+@timed
+def plan_sale(lots, shares, sale_date, sale_price, tax_rate, strategy="min_tax"):
+    """Choose which open lots a sale of `shares` shares on `sale_date` at `sale_price` draws from.
+
+    `lots` is a frame from open_lots (usually one symbol, possibly across grants) and
+    `tax_rate` a fraction. Strategies (SALE_STRATEGIES):
+      min_tax       the allocation with the lowest total tax. Each lot is taxed on its
+                    own, so the tax is linear in the shares taken from a lot and taking
+                    shares in order of tax per share is exact. Ties go to the lot with
+                    the larger loss (or smaller gain), then the oldest.
+      fifo / lifo   oldest / newest vests first
+      highest_cost  highest vest price first (smallest gains)
+    Lots vesting after the sale date are not used.
+
+    Returns one row per lot drawn from (PLAN_COLUMNS). Raises ValueError if fewer than
+    `shares` shares are available.
+    """
+    if strategy not in SALE_STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}'. Use one of: {', '.join(SALE_STRATEGIES)}.")
+
+    sale_day = np.datetime64(pd.Timestamp(sale_date), "D").astype(np.int64)
+    vest_days = pd.to_datetime(lots["vest_date"]).to_numpy("datetime64[D]").astype(np.int64)
+    vested = vest_days <= sale_day
+    lots = lots[vested]
+    holding_period = sale_day - vest_days[vested]
+    vest_price = lots["vest_price"].to_numpy(dtype=float)
+    remaining = lots["remaining_shares"].to_numpy(dtype=np.int64)
+    available = int(remaining.sum())
+    if shares > available:
+        raise ValueError(f"Only {available} shares are available to sell on {pd.Timestamp(sale_date):%Y-%m-%d}.")
+
+    # np.lexsort sorts by the last key first; vest order (the lots' order) breaks remaining ties
+    seq = np.arange(len(lots))
+    if strategy == "min_tax":
+        tax_per_share, _ = _sale_tax(holding_period, vest_price, 1.0, tax_rate, sale_price)
+        order = np.lexsort((seq, sale_price - vest_price, tax_per_share))
+    elif strategy == "fifo":
+        order = np.lexsort((seq, -holding_period))
+    elif strategy == "lifo":
+        order = np.lexsort((seq, holding_period))
+    else:
+        order = np.lexsort((seq, -vest_price))
+
+    # Take whole lots in that order until the last one, which is taken in part
+    taken_before = np.cumsum(remaining[order]) - remaining[order]
+    taken = np.zeros(len(lots), dtype=np.int64)
+    taken[order] = np.clip(shares - taken_before, 0, remaining[order])
+
+    used = order[taken[order] > 0]
+    plan = lots.iloc[used][["grant_id", "vest_id", "vest_date", "vest_price", "remaining_shares"]].reset_index(drop=True)
+    plan["shares_sold"] = taken[used]
+    plan["holding_period"] = holding_period[used]
+    tax, held_over_year = _sale_tax(holding_period[used], vest_price[used], taken[used].astype(float), tax_rate, sale_price)
+    plan["held_over_year"] = held_over_year
+    plan["proceeds"] = plan["shares_sold"] * sale_price
+    plan["capital_gains"] = (sale_price - plan["vest_price"]) * plan["shares_sold"]
+    plan["tax"] = tax
+    return plan[PLAN_COLUMNS]
+
+@timed
+def compare_sale_strategies(lots, shares, sale_date, sale_price, tax_rate):
+    """Totals of plan_sale for every strategy: one row per strategy with proceeds, capital gains, tax and net proceeds."""
+    rows = []
+    for strategy, label in SALE_STRATEGIES.items():
+        plan = plan_sale(lots, shares, sale_date, sale_price, tax_rate, strategy)
+        rows.append({
+            "strategy": strategy,
+            "Strategy": label,
+            "Lots": len(plan),
+            "Proceeds": plan["proceeds"].sum(),
+            "Capital Gains": plan["capital_gains"].sum(),
+            "Tax": plan["tax"].sum(),
+            "Net Proceeds": plan["proceeds"].sum() - plan["tax"].sum(),
+        })
+    return pd.DataFrame(rows)
+
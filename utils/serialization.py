@@ -0,0 +1,315 @@
+# serialization.py
+# Reading and writing portfolio files without going through streamlit.
+# JSON exports are read incrementally: grants are decoded one at a time from a
+# buffered stream, with dates parsed and derived keys dropped while decoding,
+# so a large file never has to be held as one parsed document.
+# Parquet exports hold the grants, vests and sales as one typed columnar table
+# with native date columns; the format of an import is detected from its content.
+
+import codecs
+import json
+from datetime import date, datetime
+from functools import lru_cache
+
+from utils.profiling import timed
+
+# Stored by older exports but always recalculated on import
+DERIVED_KEYS = ("capital_gains_tax", "tax_at_vest")
+CHUNK_SIZE = 1024 * 1024
+# Distinct dates in a portfolio are few (vest dates repeat across grants), so this covers decades
+DATE_CACHE_SIZE = 65536
+
+PARQUET_MAGIC = b"PAR1"
+# The kind of row in a Parquet export
+RECORD_COLUMN = "record"
+GRANT_RECORD, VEST_RECORD, SALE_RECORD = "grant", "vest", "sale"
+# Fields every row of a kind has; other fields are only stored when present
+REQUIRED_FIELDS = {
+    GRANT_RECORD: ["grant_id", "grant_date", "symbol", "num_stocks"],
+    VEST_RECORD: ["vest_id", "vest_date", "shares_vested", "vest_price", "tax_rate_vest"],
+    SALE_RECORD: ["sale_id", "vest_id", "sale_date", "shares_sold", "sale_price", "tax_rate_sale"],
+}
+ID_COLUMNS = ["grant_id", "vest_id", "sale_id"]
+# Schema metadata key of the ID columns that mix ints and strings. Such a column is
+# stored as strings, with one character per row saying which values were ints
+# ("i"; "s" for strings, "-" for nulls) so the import restores them exactly.
+MIXED_IDS_KEY = b"rsu.mixed_ids"
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_iso_date(value):
+    """Parse a "YYYY-MM-DD" string to a date. Memoized, as the same dates repeat across lots."""
+    if len(value) == 10 and value[4] == "-" and value[7] == "-":
+        return date.fromisoformat(value)
+    # strptime also accepts unpadded months and days ("2024-7-1")
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+def _import_hook(obj):
+    # Called by the decoder for every JSON object, innermost first
+    for key in DERIVED_KEYS:
+        obj.pop(key, None)
+    for key, value in obj.items():
+        if key.endswith("_date") and isinstance(value, str):
+            obj[key] = parse_iso_date(value)
+    return obj
+
+
+def _check_rows(rows, record, where):
+    # Portfolio.from_grants indexes rows by their IDs; without this a malformed
+    # file fails there with a KeyError or TypeError instead of saying what is wrong
+    if not isinstance(rows, list):
+        raise ValueError(f"Expected a list of {record}s in {where}.")
+    for row in rows:
+        if not isinstance(row, dict):
+            raise ValueError(f"Expected a {record} object in {where}, got {json.dumps(row)}.")
+        missing = [field for field in REQUIRED_FIELDS[record] if field not in row]
+        if missing:
+            raise ValueError(f"A {record} in {where} is missing '{missing[0]}'.")
+
+def _check_grant(grant):
+    _check_rows([grant], GRANT_RECORD, "the file")
+    where = f"Grant '{grant['grant_id']}'"
+    _check_rows(grant.get("vests", []), VEST_RECORD, where)
+    _check_rows(grant.get("sales", []), SALE_RECORD, where)
+    return grant
+
+
+def convert_dates_to_strings(obj):
+    if isinstance(obj, date):
+        return obj.isoformat()
+    elif isinstance(obj, dict):
+        return {key: convert_dates_to_strings(value) for key, value in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_dates_to_strings(item) for item in obj]
+    return obj
+
+def convert_strings_to_dates(obj):
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if key.endswith("_date") and isinstance(value, str):
+                obj[key] = parse_iso_date(value)
+            elif isinstance(value, (dict, list)):
+                convert_strings_to_dates(value)
+    elif isinstance(obj, list):
+        for item in obj:
+            convert_strings_to_dates(item)
+    return obj
+
+
+class _TextBuffer:
+    """Text read from a (binary or text) stream in chunks, consumed from `pos` onwards."""
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Append the next chunk, dropping the consumed text. Returns False at end of stream."""
+        text = ""
+        while not text and not self.eof:
+            data = self.stream.read(self.chunk_size)
+            self.eof = not data
+            # The decoder holds back bytes of a character split across chunks
+            text = self.decoder.decode(data, final=self.eof) if isinstance(data, bytes) else data
+        if not text:
+            return False
+        self.text = self.text[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """The next non-whitespace character ("" at end of stream), without consuming it."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.text) or not self.fill():
+                return self.text[self.pos:self.pos + 1]
+
+    def decode(self, decoder):
+        """Decode the next JSON value, reading more of the stream until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, self.pos = decoder.raw_decode(self.text, self.pos)
+                return value
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                # A value spanning many chunks is retried from its start; grow the
+                # reads so the total work stays linear in its size
+                self.chunk_size *= 2
+
+    def error(self, message):
+        return json.JSONDecodeError(message, self.text, self.pos)
+
+
+def iter_grants(stream, chunk_size=CHUNK_SIZE):
+    """Yield the grants of a JSON export one at a time, ready for Portfolio.from_grants.
+
+    `stream` is a binary (UTF-8) or text file object holding a JSON list of grants.
+    "*_date" strings become dates and derived keys are dropped as each grant is
+    decoded. Raises json.JSONDecodeError on malformed JSON and ValueError if the
+    document is not a list of grants with their required fields.
+    """
+    decoder = json.JSONDecoder(object_hook=_import_hook)
+    buffer = _TextBuffer(stream, chunk_size)
+
+    if buffer.peek() != "[":
+        if buffer.peek() == "":
+            raise buffer.error("Expecting value")
+        raise ValueError("Expected a list of grants.")
+    buffer.pos += 1
+
+    if buffer.peek() == "]":
+        buffer.pos += 1
+    else:
+        while True:
+            yield _check_grant(buffer.decode(decoder))
+            separator = buffer.peek()
+            buffer.pos += 1
+            if separator == "]":
+                break
+            if separator != ",":
+                raise buffer.error("Expecting ',' delimiter")
+
+    if buffer.peek() != "":
+        raise buffer.error("Extra data")
+
+
+# --- JSON export ---
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+@timed
+def portfolio_to_json(portfolio):
+    """The JSON export of a portfolio (a list of grants with nested vests and sales)."""
+    return json.dumps(portfolio.to_grants(), indent=2, default=_json_default)
+
+
+# --- Parquet export ---
+
+@timed
+def portfolio_to_parquet(portfolio):
+    """The Parquet export of a portfolio, as bytes.
+
+    One row per grant, vest and sale, in portfolio order; RECORD_COLUMN tells them
+    apart and vest/sale rows carry their grant_id. Dates are stored as date32.
+    Raises ValueError if a column mixes value types Parquet can't hold in one
+    column (other than int and string IDs, see MIXED_IDS_KEY).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = []
+    for grant_id, grant in portfolio.grants.items():
+        rows.append({**grant, RECORD_COLUMN: GRANT_RECORD})
+        rows.extend({**vest, "grant_id": grant_id, RECORD_COLUMN: VEST_RECORD} for vest in portfolio.vests.get(grant_id, {}).values())
+        rows.extend({**sale, "grant_id": grant_id, RECORD_COLUMN: SALE_RECORD} for sale in portfolio.sales.get(grant_id, {}).values())
+    columns = list(dict.fromkeys(key for row in [{RECORD_COLUMN: None, "grant_id": None}] + rows for key in row))
+    arrays, mixed_ids = {}, {}
+    for column in columns:
+        values = [row.get(column) for row in rows]
+        if column in ID_COLUMNS and len({type(value) for value in values if value is not None}) > 1:
+            kinds = "".join("-" if value is None else "i" if type(value) is int else "s" if type(value) is str else "?" for value in values)
+            if "?" in kinds:
+                raise ValueError(f"Column '{column}' has IDs that are neither numbers nor text; export as JSON instead.")
+            mixed_ids[column] = kinds
+            values = [None if value is None else str(value) for value in values]
+        try:
+            arrays[column] = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            raise ValueError(f"Column '{column}' mixes value types and can't be exported as Parquet; export as JSON instead ({e}).") from e
+    table = pa.table(arrays)
+    if mixed_ids:
+        table = table.replace_schema_metadata({MIXED_IDS_KEY: json.dumps(mixed_ids)})
+
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, compression="zstd")
+    return sink.getvalue().to_pybytes()
+
+def _restore_ids(values, kinds, positions):
+    # Values of a mixed ID column (see MIXED_IDS_KEY) back to their original types
+    return [int(value) if kinds[position] == "i" else value for value, position in zip(values, positions)]
+
+def _parquet_rows(table, record, mixed_ids):
+    # (grant IDs, row dicts) of one kind of record, without its all-null columns
+    import pyarrow.compute as pc
+
+    mask = pc.equal(table[RECORD_COLUMN], record)
+    rows = table.filter(mask)
+    # Row numbers in the file, to look up the types of mixed ID columns
+    positions = [position for position, selected in enumerate(mask.to_pylist()) if selected] if mixed_ids else None
+    required = REQUIRED_FIELDS[record]
+    columns = [
+        column for column in rows.column_names
+        if column not in (RECORD_COLUMN, "grant_id") and column not in DERIVED_KEYS
+        and (column in required or rows[column].null_count < rows.num_rows)
+    ]
+    dense = [column for column in columns if column in required or rows[column].null_count == 0]
+    # Converting whole columns is much faster than converting row by row
+    def values(column):
+        if column in mixed_ids:
+            return _restore_ids(rows[column].to_pylist(), mixed_ids[column], positions)
+        return rows[column].to_pylist()
+
+    result = [dict(zip(dense, fields)) for fields in zip(*(values(column) for column in dense))]
+    if not dense:
+        result = [{} for _ in range(rows.num_rows)]
+    for column in columns:
+        if column not in dense:
+            for row, value in zip(result, values(column)):
+                if value is not None:
+                    row[column] = value
+    return values("grant_id"), result
+
+def iter_parquet_grants(stream):
+    """Yield the grants of a Parquet export one at a time, in the nested JSON shape.
+
+    Derived keys are dropped, as for JSON imports. A missing optional field is
+    stored as null and comes back absent.
+    """
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(stream)
+    if RECORD_COLUMN not in table.column_names or "grant_id" not in table.column_names:
+        raise ValueError("Not a portfolio export: missing the 'record' or 'grant_id' column.")
+    unknown = set(pc.unique(table[RECORD_COLUMN]).to_pylist()) - set(REQUIRED_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown record type '{sorted(unknown, key=str)[0]}'.")
+
+    mixed_ids = json.loads((table.schema.metadata or {}).get(MIXED_IDS_KEY, b"{}"))
+    lots = {}
+    for record, key in [(VEST_RECORD, "vests"), (SALE_RECORD, "sales")]:
+        for grant_id, row in zip(*_parquet_rows(table, record, mixed_ids)):
+            lots.setdefault(grant_id, {"vests": [], "sales": []})[key].append(row)
+
+    grant_ids, grants = _parquet_rows(table, GRANT_RECORD, mixed_ids)
+    for grant_id, grant in zip(grant_ids, grants):
+        yield {**grant, "grant_id": grant_id, **lots.pop(grant_id, {"vests": [], "sales": []})}
+    orphans = [grant_id for grant_id, grant_lots in lots.items() if grant_lots["vests"] or grant_lots["sales"]]
+    if orphans:
+        raise ValueError(f"Vests or sales stored without their grant: Grant '{orphans[0]}'.")
+
+
+# --- Format detection ---
+
+def is_parquet(stream):
+    """True if the (seekable, binary) stream holds a Parquet file; the position is left unchanged."""
+    position = stream.tell()
+    magic = stream.read(len(PARQUET_MAGIC))
+    stream.seek(position)
+    return magic == PARQUET_MAGIC
+
+def iter_file_grants(stream):
+    """Yield the grants of an export in either format, detected from the content."""
+    if is_parquet(stream):
+        return iter_parquet_grants(stream)
+    return iter_grants(stream)
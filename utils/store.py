@@ -0,0 +1,246 @@
+# store.py
+# Optional persistent portfolio store in a local SQLite file.
+# Several named portfolios share one file. Grants, vests and sales are rows of
+# three tables keyed by portfolio, grant and lot ID; every row keeps its full dict
+# as JSON, so IDs keep their type and any extra field (e.g. a currency) round-trips.
+# Saving writes only the grants whose content changed since the last save, found
+# by comparing the per-grant fingerprints the Portfolio already keeps, and a
+# session catches up with another one's saves by loading just the grants whose
+# stored fingerprint differs from its own.
+
+import json
+import sqlite3
+from contextlib import closing, contextmanager
+from datetime import date
+
+from utils.portfolio import Portfolio, sale_key, vest_key
+from utils.profiling import timed
+from utils.serialization import parse_iso_date
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS grants (
+    portfolio TEXT NOT NULL,
+    grant_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (portfolio, grant_id)
+);
+CREATE TABLE IF NOT EXISTS vests (
+    portfolio TEXT NOT NULL,
+    grant_id TEXT NOT NULL,
+    vest_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (portfolio, grant_id, vest_id)
+);
+CREATE TABLE IF NOT EXISTS sales (
+    portfolio TEXT NOT NULL,
+    grant_id TEXT NOT NULL,
+    vest_id TEXT,
+    sale_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (portfolio, grant_id, vest_id, sale_id)
+);
+CREATE INDEX IF NOT EXISTS grants_seq ON grants (portfolio, seq);
+-- Indexes of earlier files that nothing reads
+DROP INDEX IF EXISTS vests_date;
+DROP INDEX IF EXISTS vests_financial_year;
+DROP INDEX IF EXISTS sales_vest;
+DROP INDEX IF EXISTS sales_date;
+DROP INDEX IF EXISTS sales_financial_year;
+"""
+DEFAULT_PORTFOLIO = "default"
+# Bound on the host parameters of one statement (SQLite allows at least 999)
+MAX_PARAMETERS = 900
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        # numpy scalars from the editors' frames
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _decode_row(data):
+    row = json.loads(data)
+    for key, value in row.items():
+        if key.endswith("_date") and isinstance(value, str):
+            row[key] = parse_iso_date(value)
+    return row
+
+def _key(lot_id):
+    # An ID as the TEXT columns hold it; its original type is kept in the row's JSON
+    return None if lot_id is None else str(lot_id)
+
+def _chunks(values, size=MAX_PARAMETERS):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class PortfolioStore:
+    """Named portfolios in the SQLite file at `path`.
+
+    Each call opens its own connection, so one store can be shared by every
+    streamlit session (each runs on its own thread).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # One transaction per call: committed on success, rolled back on an exception
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn:
+            with conn:
+                yield conn
+
+    def portfolios(self):
+        """Names of the stored portfolios, sorted."""
+        with self._connect() as conn:
+            return [name for (name,) in conn.execute("SELECT DISTINCT portfolio FROM grants ORDER BY portfolio")]
+
+    def grant_fingerprints(self, name=DEFAULT_PORTFOLIO):
+        """Fingerprints of a stored portfolio's grants, by grant ID as stored (text), in portfolio order."""
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT grant_id, fingerprint FROM grants WHERE portfolio = ? ORDER BY seq", (name,)))
+
+    @timed
+    def load(self, name=DEFAULT_PORTFOLIO, grant_ids=None):
+        """A stored portfolio as a Portfolio; only the given grants if `grant_ids` is set.
+
+        Stored rows keep their derived fields, so nothing needs recalculating.
+        """
+        portfolio = Portfolio()
+        if grant_ids is None:
+            selections = [("", [])]
+        else:
+            selections = [(f" AND grant_id IN ({','.join('?' * len(chunk))})", chunk) for chunk in _chunks(map(_key, grant_ids))]
+        rows = {"grants": [], "vests": [], "sales": []}
+        with self._connect() as conn:
+            for condition, parameters in selections:
+                for table, columns in [("grants", "seq, data, fingerprint"), ("vests", "seq, grant_id, data"), ("sales", "seq, grant_id, data")]:
+                    rows[table] += conn.execute(f"SELECT {columns} FROM {table} WHERE portfolio = ?{condition}", [name, *parameters]).fetchall()
+        # Lots are numbered per grant, so their order only matters within one
+        grant_rows = sorted(rows["grants"], key=lambda row: row[0])
+        lot_rows = {table: [row[1:] for row in sorted(rows[table], key=lambda row: row[0])] for table in ("vests", "sales")}
+
+        # TEXT key -> the grant ID as saved (e.g. an int)
+        grant_ids = {}
+        for _, data, fingerprint in grant_rows:
+            grant = _decode_row(data)
+            grant_id = grant["grant_id"]
+            grant_ids[_key(grant_id)] = grant_id
+            portfolio.grants[grant_id] = grant
+            # Saved with the grant, so the next save does not hash every grant again
+            portfolio._grant_fingerprints[grant_id] = fingerprint
+            portfolio.vests[grant_id] = {}
+            portfolio.sales[grant_id] = {}
+        for table, key in [("vests", vest_key), ("sales", sale_key)]:
+            lots = getattr(portfolio, table)
+            for grant_key, data in lot_rows[table]:
+                if grant_key in grant_ids:
+                    row = _decode_row(data)
+                    lots[grant_ids[grant_key]][key(row)] = row
+        return portfolio
+
+    @timed
+    def refresh(self, portfolio, name=DEFAULT_PORTFOLIO):
+        """`portfolio` brought up to date with the one stored under `name`.
+
+        Only the grants whose stored fingerprint differs from this portfolio's are
+        loaded (another session saved them); the rest keep their rows, so derived
+        values are patched for the loaded grants only. Returns `portfolio` itself if
+        it matches the store.
+        """
+        stored = self.grant_fingerprints(name)
+        current = {_key(grant_id): grant_id for grant_id in portfolio.grants}
+        changed = [grant_key for grant_key, fingerprint in stored.items() if grant_key not in current or portfolio.grant_fingerprint(current[grant_key]) != fingerprint]
+        if not changed and list(stored) == list(current):
+            return portfolio
+
+        loaded = self.load(name, changed)
+        loaded_ids = {_key(grant_id): grant_id for grant_id in loaded.grants}
+        version = Portfolio(fx=portfolio.fx)
+        for grant_key in stored:
+            # A grant deleted since its fingerprint was read is left out
+            source = loaded if grant_key in loaded_ids else portfolio if grant_key in current else None
+            if source is None:
+                continue
+            grant_id = loaded_ids.get(grant_key, current.get(grant_key))
+            version.grants[grant_id] = source.grants[grant_id]
+            version.vests[grant_id] = source.vests.get(grant_id, {})
+            version.sales[grant_id] = source.sales.get(grant_id, {})
+        version._grant_fingerprints = loaded._grant_fingerprints
+        return portfolio.restore(version)
+
+    @timed
+    def save(self, portfolio, name=DEFAULT_PORTFOLIO):
+        """Write a portfolio under `name`, rewriting only the grants that changed since the last save.
+
+        Returns the number of grants written.
+        """
+        grant_order = list(portfolio.grants)
+        keys = {_key(grant_id) for grant_id in grant_order}
+        with self._connect() as conn:
+            stored = {
+                grant_key: (seq, fingerprint)
+                for grant_key, seq, fingerprint in conn.execute("SELECT grant_id, seq, fingerprint FROM grants WHERE portfolio = ?", (name,))
+            }
+            changed = [grant_id for grant_id in grant_order if stored.get(_key(grant_id), (None, None))[1] != portfolio.grant_fingerprint(grant_id)]
+            removed = [grant_key for grant_key in stored if grant_key not in keys]
+
+            for chunk in _chunks(changed + removed):
+                condition = f"portfolio = ? AND grant_id IN ({','.join('?' * len(chunk))})"
+                for table in ("grants", "vests", "sales"):
+                    conn.execute(f"DELETE FROM {table} WHERE {condition}", [name, *map(_key, chunk)])
+            self._insert(conn, name, portfolio, changed)
+
+            # Grants kept as they were only need their position updated
+            unchanged = set(grant_order) - set(changed)
+            moved = [
+                (seq, name, _key(grant_id)) for seq, grant_id in enumerate(grant_order)
+                if grant_id in unchanged and stored[_key(grant_id)][0] != seq
+            ]
+            conn.executemany("UPDATE grants SET seq = ? WHERE portfolio = ? AND grant_id = ?", moved)
+        return len(changed)
+
+    def _insert(self, conn, name, portfolio, grant_ids):
+        # Rows of the given grants of `portfolio`
+        if not grant_ids:
+            return
+        position = {grant_id: seq for seq, grant_id in enumerate(portfolio.grants)}
+        grants = [(grant_id, portfolio.grants[grant_id]) for grant_id in grant_ids]
+        # Columns are named, so files written with the earlier, wider tables still take these rows
+        conn.executemany(
+            "INSERT INTO grants (portfolio, grant_id, seq, fingerprint, data) VALUES (?, ?, ?, ?, ?)",
+            [
+                (name, _key(grant_id), position[grant_id], portfolio.grant_fingerprint(grant_id), json.dumps(grant, default=_json_default))
+                for grant_id, grant in grants
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO vests (portfolio, grant_id, vest_id, seq, data) VALUES (?, ?, ?, ?, ?)",
+            [
+                (name, _key(grant_id), _key(vest["vest_id"]), seq, json.dumps(vest, default=_json_default))
+                for grant_id in grant_ids for seq, vest in enumerate(portfolio.vests.get(grant_id, {}).values())
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO sales (portfolio, grant_id, vest_id, sale_id, seq, data) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (name, _key(grant_id), _key(sale.get("vest_id")), _key(sale["sale_id"]), seq, json.dumps(sale, default=_json_default))
+                for grant_id in grant_ids for seq, sale in enumerate(portfolio.sales.get(grant_id, {}).values())
+            ],
+        )
+
+    def delete(self, name=DEFAULT_PORTFOLIO):
+        with self._connect() as conn:
+            for table in ("grants", "vests", "sales"):
+                conn.execute(f"DELETE FROM {table} WHERE portfolio = ?", (name,))
@@ -0,0 +1,145 @@
+# validation.py
+# Column-wise validation of the grant, vest and sale editor tables.
+# Each check is a boolean mask over the whole table; only the failing rows are
+# turned into messages. The messages are the ones the editors have always shown.
+# As before, a duplicate Vest or Sale ID doesn't stop the rest of the table being
+# saved; the duplicate row itself is left out (lots are indexed by their IDs).
+
+import numpy as np
+import pandas as pd
+
+from utils.changes import as_date
+from utils.profiling import timed
+
+ERROR_COLUMNS = ["row", "check", "message", "blocking"]
+# Position of each check within a row, so messages come out in the same order as
+# the old row-by-row validation
+CHECK_ORDER = ["id_changed", "id_empty", "duplicate_id", "invalid_fields", "invalid_currency", "sale_before_vest"]
+
+
+def _numbers(column):
+    return pd.to_numeric(column, errors="coerce")
+
+def _whole_numbers(column):
+    # int() truncates, so 1.5 shares counts as 1
+    return np.trunc(_numbers(column))
+
+def _errors(edited_df, mask, check, format_message, blocking=True):
+    labels = edited_df.index[np.asarray(mask, dtype=bool)]
+    return pd.DataFrame({
+        "position": edited_df.index.get_indexer(labels),
+        "row": labels + 1,
+        "check": check,
+        "message": [format_message(label) for label in labels],
+        "blocking": blocking,
+    })
+
+def _collect(frames):
+    errors = pd.concat([frame for frame in frames if not frame.empty] or [pd.DataFrame(columns=["position"] + ERROR_COLUMNS)], ignore_index=True)
+    errors["order"] = errors["check"].map(CHECK_ORDER.index)
+    errors = errors.sort_values(["position", "order"], kind="mergesort", ignore_index=True)
+    errors["blocking"] = errors["blocking"].astype(bool)
+    return errors[ERROR_COLUMNS]
+
+def blocking_errors(errors):
+    """The errors that stop an editor table from being saved."""
+    return errors[errors["blocking"]]
+
+def saved_rows(edited_df, errors):
+    """`edited_df` without the rows a non-blocking check left out of the save."""
+    skipped = errors.loc[~errors["blocking"], "row"] - 1
+    return edited_df.drop(index=skipped.unique()) if len(skipped) else edited_df
+
+def _validate_ids(original_df, edited_df, id_column, noun, duplicate_message, duplicate_blocks):
+    """ID immutability, empty ID and duplicate ID checks shared by all editors.
+
+    Returns (ids, has_id, error frames). `ids` are the effective IDs: existing rows keep
+    their original ID. Rows without an ID skip every other check, as before.
+    """
+    edited_ids = edited_df[id_column]
+    is_existing = pd.Series(edited_df.index < len(original_df), index=edited_df.index)
+    original_ids = original_df[id_column].reindex(edited_df.index) if id_column in original_df else pd.Series(np.nan, index=edited_df.index)
+
+    changed = is_existing & ~((edited_ids == original_ids) & edited_ids.notna())
+    ids = original_ids.where(is_existing, edited_ids)
+    has_id = ids.notna() & (ids != "")
+    duplicate = has_id & ids.where(has_id).duplicated(keep="first")
+
+    frames = [
+        _errors(edited_df, changed, "id_changed", lambda i: f"Row {i+1}: Cannot change the {noun.title()} ID ('{original_ids[i]}' to '{edited_ids[i]}') of an existing {noun}. Delete and re-add if necessary."),
+        _errors(edited_df, ~has_id, "id_empty", lambda i: f"Row {i+1}: {noun.title()} ID cannot be empty."),
+        _errors(edited_df, duplicate, "duplicate_id", lambda i: duplicate_message(i, ids[i]), blocking=duplicate_blocks),
+    ]
+    return ids, has_id, frames
+
+@timed
+def validate_grants(original_df, edited_df):
+    """Validate the grants editor table. Returns an error frame (row, check, message, blocking)."""
+    if edited_df.empty:
+        return _collect([])
+    ids, has_id, frames = _validate_ids(
+        original_df, edited_df, "Grant ID", "grant",
+        lambda i, grant_id: f"Row {i+1}: Duplicate Grant ID '{grant_id}' found in the table. Please ensure all Grant IDs are unique.",
+        duplicate_blocks=True,
+    )
+    grant_dates = pd.to_datetime(edited_df["Grant Date"], errors="coerce")
+    num_stocks = _whole_numbers(edited_df["Number of Stocks"])
+    invalid = grant_dates.isna() | edited_df["Symbol"].isna() | num_stocks.isna() | (num_stocks < 1)
+    frames.append(_errors(edited_df, has_id & invalid, "invalid_fields", lambda i: f"Row {i+1} (Grant ID: {ids[i]}): Missing or invalid required fields (Grant Date, Symbol, Number of Stocks >= 1)."))
+    if "Currency" in edited_df:
+        # Optional; blank means AUD
+        currency = edited_df["Currency"].fillna("").astype(str).str.strip()
+        invalid_currency = (currency != "") & ~currency.str.fullmatch(r"[A-Za-z]{3}")
+        frames.append(_errors(edited_df, has_id & invalid_currency, "invalid_currency", lambda i: f"Row {i+1} (Grant ID: {ids[i]}): Currency must be a 3-letter code (e.g. USD), or blank for AUD."))
+    return _collect(frames)
+
+@timed
+def validate_vests(original_df, edited_df, grant_id):
+    """Validate the vests editor table of one grant. Returns an error frame (row, check, message, blocking).
+
+    A duplicate Vest ID doesn't block saving; the duplicate row is left out (see `saved_rows`).
+    """
+    if edited_df.empty:
+        return _collect([])
+    ids, has_id, frames = _validate_ids(
+        original_df, edited_df, "Vest ID", "vest",
+        lambda i, vest_id: f"Row {i+1}: Duplicate Vest ID '{vest_id}' found for this grant. Please ensure Vest IDs are unique within Grant '{grant_id}'. This row was not saved.",
+        duplicate_blocks=False,
+    )
+    vest_dates = pd.to_datetime(edited_df["Vest Date"], errors="coerce")
+    shares = _whole_numbers(edited_df["Shares Vested"])
+    prices = _numbers(edited_df["Vest Price"])
+    tax_rates = _numbers(edited_df["Tax Rate at Vest (%)"])
+    invalid = (
+        vest_dates.isna() | shares.isna() | (shares < 1) | prices.isna() | (prices < 0)
+        | tax_rates.isna() | (tax_rates < 0) | (tax_rates > 100)
+    )
+    frames.append(_errors(edited_df, has_id & invalid, "invalid_fields", lambda i: f"Row {i+1} (Vest ID: {ids[i]}): Missing or invalid required fields (Vest Date, Shares Vested >= 1, Vest Price >= 0, Tax Rate >= 0 and <= 100)."))
+    return _collect(frames)
+
+@timed
+def validate_sales(original_df, edited_df, grant_id, vest_id, vest_date):
+    """Validate the sales editor table of one vest. Returns an error frame (row, check, message, blocking).
+
+    A duplicate Sale ID doesn't block saving; the duplicate row is left out (see `saved_rows`).
+    """
+    if edited_df.empty:
+        return _collect([])
+    ids, has_id, frames = _validate_ids(
+        original_df, edited_df, "Sale ID", "sale",
+        lambda i, sale_id: f"Row {i+1}: Duplicate Sale ID '{sale_id}' found for this vest. Please ensure Sale IDs are unique within Grant '{grant_id}' / Vest '{vest_id}'. This row was not saved.",
+        duplicate_blocks=False,
+    )
+
+    sale_dates = pd.to_datetime(edited_df["Sale Date"], errors="coerce")
+    shares = _whole_numbers(edited_df["Shares Sold"])
+    prices = _numbers(edited_df["Sale Price"])
+    tax_rates = _numbers(edited_df["Tax Rate at Sale (%)"])
+    invalid = (
+        sale_dates.isna() | shares.isna() | (shares < 1) | prices.isna() | (prices < 0)
+        | tax_rates.isna() | (tax_rates < 0) | (tax_rates > 100)
+    )
+    before_vest = ~invalid & (sale_dates < pd.Timestamp(vest_date))
+    frames.append(_errors(edited_df, has_id & invalid, "invalid_fields", lambda i: f"Row {i+1} (Sale ID: {ids[i]}): Missing or invalid required fields (Sale Date, Shares Sold >= 1, Sale Price >= 0, Tax Rate >= 0 and <= 100)."))
+    frames.append(_errors(edited_df, has_id & before_vest, "sale_before_vest", lambda i: f"Row {i+1} (Sale ID: {ids[i]}): Sale Date ({as_date(edited_df.at[i, 'Sale Date'])}) cannot be before Vest Date ({vest_date})."))
+    return _collect(frames)
@@ -1,126 +1,86 @@
 # visualization.py
-# Changes:
-# 1. No changes made. All functionality remains the same.
+# Rendering only: the frames behind every chart and table are built in
+# utils/reports.py. plotly is imported when the first chart is drawn.
 
-import pandas as pd
-import streamlit as st
-import plotly.express as px
-
-def calculate_correct_tax(sale, vest):
-    holding_period = (sale["sale_date"] - vest["vest_date"]).days
-    if holding_period <= 30 and "tax_within_30_days" in sale:
-        return sale["tax_within_30_days"]
-    else:
-        return sale["capital_gains_tax"]
+import math
 
+import streamlit as st
 
-def display_rsu_details_table(grants):
-    if not grants:
+from utils.cache import cached_view
+from utils.fx import BASE_CURRENCY
+from utils.profiling import timed
+from utils.reports import (
+    rsu_details_page,
+    portfolio_totals,
+    tax_breakdown_chart_data,
+    capital_gains_chart_data,
+    net_gains_chart_data,
+    stock_performance_chart_data,
+)
+
+def _px():
+    # plotly.express is slow to import; only pay for it once a chart is drawn
+    import plotly.express as px
+    return px
+
+
+# Grants shown per page of the RSU Details
+RSU_DETAILS_PAGE_SIZE = 10
+
+def display_rsu_details_table(portfolio, cache=None, page_size=RSU_DETAILS_PAGE_SIZE):
+    if not portfolio:
         st.warning("No data available. Add grants, vests, and sales to see the details.")
         return
 
     st.subheader("RSU Details")
-    for grant in grants:
+    # One page of grants at a time; only the shown page is built
+    pages = math.ceil(len(portfolio.grants) / page_size)
+    page = 0
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1, key="rsu_details_page") - 1
+    if cache is not None:
+        details = cached_view(cache, rsu_details_page, portfolio, page, page_size)
+    else:
+        details = rsu_details_page(portfolio, page, page_size)
+    for grant, vests_table, sales_table, totals_table in details:
         st.write(f"**Grant ID:** {grant['grant_id']}")
         st.write(f"**Grant Date:** {grant['grant_date']}")
         st.write(f"**Symbol:** {grant['symbol']}")
         st.write(f"**Total Stocks:** {grant['num_stocks']}")
 
-        if grant.get("vests"):
+        if vests_table is not None:
             st.write("**Vests:**")
-            vest_data = []
-            for vest in grant["vests"]:
-                vest_data.append({
-                    "Vest ID": vest["vest_id"],
-                    "Vest Date": vest["vest_date"],
-                    "Shares Vested": vest["shares_vested"],
-                    "Vest Price": f"${vest['vest_price']}",
-                    "Tax at Vest": f"${vest['tax_at_vest']}",
-                })
-            st.table(pd.DataFrame(vest_data))
-
-        if grant.get("sales"):
+            st.table(vests_table)
+
+        if sales_table is not None:
             st.write("**Sales:**")
-            sale_data = []
-            for sale in grant["sales"]:
-                vest = next(v for v in grant["vests"] if v["vest_id"] == sale["vest_id"])
-                tax = calculate_correct_tax(sale, vest)
-                sale_data.append({
-                    "Sale ID": sale["sale_id"],
-                    "Sale Date": sale["sale_date"],
-                    "Shares Sold": sale["shares_sold"],
-                    "Sale Price": f"${sale['sale_price']}",
-                    "Tax at Sale": f"${tax}",
-                })
-            st.table(pd.DataFrame(sale_data))
-
-        total_tax_at_vest = sum(v["tax_at_vest"] for v in grant.get("vests", []))
-        total_capital_gains_tax = sum(calculate_correct_tax(s, next(v for v in grant["vests"] if v["vest_id"] == s["vest_id"])) for s in grant.get("sales", []))
-        totals_data = [{
-            "Type": "Totals",
-            "Tax at Vest": f"${total_tax_at_vest:,.2f}",
-            "Tax at Sale": f"${total_capital_gains_tax:,.2f}",
-        }]
-
-        st.table(pd.DataFrame(totals_data))
+            st.table(sales_table)
+
+        st.table(totals_table)
         st.write("---")
 
-def display_totals(grants):
-    total_tax_at_vest = sum(
-        v["tax_at_vest"]
-        for grant in grants
-        for v in grant.get("vests", [])
-    )
-    total_tax_at_sale = sum(
-        calculate_correct_tax(s, next(v for v in grant["vests"] if v["vest_id"] == s["vest_id"]))
-        for grant in grants
-        for s in grant.get("sales", [])
-    )
+def display_totals(portfolio):
+    total_tax_at_vest, total_tax_at_sale = portfolio_totals(portfolio)
     st.write(f"**Total Tax at Vest:** ${total_tax_at_vest:,.2f}")
     st.write(f"**Total Tax at Sale:** ${total_tax_at_sale:,.2f}")
 
-def get_australian_tax_year(date_obj):
-    year = date_obj.year
-    if date_obj.month < 7:
-        return f"{year-1}-{year}"
-    return f"{year}-{year+1}"
-
-def plot_tax_breakdown(grants):
-    tax_data = []
-    for grant in grants:
-        for vest in grant.get("vests", []):
-            tax_year = get_australian_tax_year(vest["vest_date"])
-            tax_data.append({
-                "Tax Year": tax_year,
-                "Type": "Vesting Tax",
-                "Amount": vest["tax_at_vest"],
-                "Event ID": f"Vest: {vest['vest_id']}",
-                "Grant ID": grant["grant_id"],
-            })
-        for sale in grant.get("sales", []):
-            tax_year = get_australian_tax_year(sale["sale_date"])
-            vest = next(v for v in grant["vests"] if v["vest_id"] == sale["vest_id"])
-            tax = calculate_correct_tax(sale, vest)
-            tax_data.append({
-                "Tax Year": tax_year,
-                "Type": "Tax at Sale",
-                "Amount": tax,
-                "Event ID": f"Sale: {sale['sale_id']}",
-                "Grant ID": grant["grant_id"],
-            })
-
-    if not tax_data:
-        return None
-
+def _title(title, df):
+    # Aggregated chart data says how it was aggregated
+    detail = df.attrs.get("detail")
+    return f"{title} ({detail})" if detail else title
 
-    df = pd.DataFrame(tax_data)
+@timed
+def plot_tax_breakdown(portfolio, tax_year=None):
+    df = tax_breakdown_chart_data(portfolio, tax_year)
+    if df is None:
+        return None
 
-    fig = px.bar(
+    fig = _px().bar(
         df,
         x="Tax Year",
         y="Amount",
         color="Type",
-        title="Tax Breakdown by Financial Year", # Slightly shorter title
+        title=_title("Tax Breakdown by Financial Year", df), # Slightly shorter title
         barmode="stack",
         labels={"Amount": "Tax Amount ($)", "Type": "Tax Type"}, # Updated label
         hover_data=["Grant ID", "Event ID"], # Include Event ID for detail
@@ -144,25 +104,13 @@ def plot_tax_breakdown(grants):
 
     return fig
 
-def plot_capital_gains_by_vest(grants):
-    gains_data = []
-    for grant in grants:
-        for sale in grant.get("sales", []):
-            tax_year = get_australian_tax_year(sale["sale_date"])
-            capital_gains = sale["capital_gains"]
-            gains_data.append({
-                "Tax Year": tax_year,
-                "Capital Gains/Losses": capital_gains,
-                "Type": "Gain" if capital_gains >= 0 else "Loss",
-            })
-
-    if not gains_data:
+@timed
+def plot_capital_gains_by_vest(portfolio):
+    df = capital_gains_chart_data(portfolio)
+    if df is None:
         return None
 
-    df = pd.DataFrame(gains_data)
-    df = df.groupby(["Tax Year", "Type"], as_index=False)["Capital Gains/Losses"].sum()
-
-    fig = px.bar(
+    fig = _px().bar(
         df,
         x="Tax Year",
         y="Capital Gains/Losses",
@@ -194,37 +142,13 @@ def plot_capital_gains_by_vest(grants):
 
     return fig
 
-def plot_net_gains(grants):
-    net_gains_data = []
-    taxes_data = []
-    for grant in grants:
-        total_tax_at_vest = sum(v["tax_at_vest"] for v in grant.get("vests", []))
-        for sale in grant.get("sales", []):
-            tax_year = get_australian_tax_year(sale["sale_date"])
-            vest = next(v for v in grant["vests"] if v["vest_id"] == sale["vest_id"])
-            tax = calculate_correct_tax(sale, vest)
-            net_gain = (sale["sale_price"] * sale["shares_sold"]) - tax
-            net_gains_data.append({
-                "Tax Year": tax_year,
-                "Type": "Net Gain",
-                "Amount": net_gain,
-            })
-
-            
-            total_taxes_paid = tax + vest["tax_at_vest"]
-            taxes_data.append({
-                "Tax Year": tax_year,
-                "Type": "Taxes Paid",
-                "Amount": total_taxes_paid,
-            })
-    if not net_gains_data:
+@timed
+def plot_net_gains(portfolio):
+    df = net_gains_chart_data(portfolio)
+    if df is None:
         return None
 
-
-    df = pd.DataFrame(net_gains_data + taxes_data)
-    df = df.groupby(["Tax Year", "Type"], as_index=False)["Amount"].sum()
-
-    fig = px.bar(
+    fig = _px().bar(
         df,
         x="Tax Year",
         y="Amount",
@@ -252,42 +176,19 @@ def plot_net_gains(grants):
 
     return fig
 
-def plot_stock_performance(grants):
-    vest_data = []
-    sale_data = []
-    for grant in grants:
-        for vest in grant.get("vests", []):
-            vest_data.append({
-                "Grant ID": grant["grant_id"],
-                "Vest ID": vest["vest_id"],
-                "Price": vest["vest_price"],
-                "Type": "Vest Price",
-            })
-
-            sales = [s for s in grant.get("sales", []) if s["vest_id"] == vest["vest_id"]]
-            for sale in sales:
-                sale_data.append({
-                    "Grant ID": grant["grant_id"],
-                    "Vest ID": vest["vest_id"],
-                    "Price": sale["sale_price"],
-                    "Type": "Sale Price",
-                })
-
-    if not vest_data:
+@timed
+def plot_stock_performance(portfolio, grant_id=None):
+    combined_df = stock_performance_chart_data(portfolio, grant_id)
+    if combined_df is None:
         return None
 
-    vest_df = pd.DataFrame(vest_data)
-    sale_df = pd.DataFrame(sale_data)
-    combined_df = pd.concat([vest_df, sale_df])
-    combined_df["Grant_Vest"] = combined_df["Grant ID"] + " - " + combined_df["Vest ID"]
-
-    fig = px.bar(
+    fig = _px().bar(
         combined_df,
         x="Grant_Vest",
         y="Price",
         color="Type",
         barmode="group",
-        title="Stock Performance (Vest Price vs. Sale Price)",
+        title=_title("Stock Performance (Vest Price vs. Sale Price)", combined_df),
         labels={"Price": "Share Price ($)", "Grant_Vest": "Grant ID - Vest ID"},
     )
 
@@ -300,113 +201,43 @@ def plot_stock_performance(grants):
 
     return fig
 
-def generate_tax_breakdown_table(grants):
-    tax_data = []
-    for grant in grants:
-        for vest in grant.get("vests", []):
-            tax_year = get_australian_tax_year(vest["vest_date"])
-            tax_data.append({
-                "Tax Year": tax_year,
-                "Type": "Vesting Tax",
-                "Amount": vest["tax_at_vest"],
-                "Grant ID": grant["grant_id"],
-                "Vest ID": vest["vest_id"],
-            })
-        for sale in grant.get("sales", []):
-            tax_year = get_australian_tax_year(sale["sale_date"])
-            vest = next(v for v in grant["vests"] if v["vest_id"] == sale["vest_id"])
-            tax = calculate_correct_tax(sale, vest)
-            tax_data.append({
-                "Tax Year": tax_year,
-                "Type": "Tax at Sale",
-                "Amount": tax,
-                "Grant ID": grant["grant_id"],
-                "Sale ID": sale["sale_id"],
-            })
-    if not tax_data:
-        return None
-
-
-    return pd.DataFrame(tax_data)
-
-def generate_capital_gains_table(grants):
-    gains_data = []
-    for grant in grants:
-        for sale in grant.get("sales", []):
-            tax_year = get_australian_tax_year(sale["sale_date"])
-            capital_gains = sale["capital_gains"]
-            gains_data.append({
-                "Tax Year": tax_year,
-                "Capital Gains": capital_gains,
-                "Type": "Gain" if capital_gains >= 0 else "Loss",
-                "Grant ID": grant["grant_id"],
-                "Sale ID": sale["sale_id"],
-            })
-
-    if not gains_data:
+@timed
+def plot_what_if_grid(grid, value="net_proceeds", title="What-if Sale"):
+    """Heatmap of one what-if grid column over sale date (x) and sale price (y)."""
+    if grid is None or grid.empty:
         return None
 
-    return pd.DataFrame(gains_data)
-
-def generate_net_gains_table(grants):
-    net_gains_data = []
-    taxes_data = []
-    for grant in grants:
-        total_tax_at_vest = sum(v["tax_at_vest"] for v in grant.get("vests", []))
-        for sale in grant.get("sales", []):
-            tax_year = get_australian_tax_year(sale["sale_date"])
-            vest = next(v for v in grant["vests"] if v["vest_id"] == sale["vest_id"])
-            tax = calculate_correct_tax(sale, vest)
-            net_gain = (sale["sale_price"] * sale["shares_sold"]) - tax
-            net_gains_data.append({
-                "Tax Year": tax_year,
-                "Sale ID": sale["sale_id"],
-                "Type": "Net Gain",
-                "Amount": net_gain,
-                "Grant ID": grant["grant_id"],
-            })
-            
-            total_taxes_paid = tax + vest["tax_at_vest"]
-            taxes_data.append({
-                "Tax Year": tax_year,
-                "Sale ID": sale["sale_id"],
-                "Type": "Taxes Paid",
-                "Amount": total_taxes_paid,
-                "Grant ID": grant["grant_id"],
-            })
-    if not net_gains_data:
-        return None
-
-
-    df = pd.DataFrame(net_gains_data + taxes_data)
-    df = df.sort_values(by=["Tax Year", "Sale ID"])
-
-    return df
-
-def generate_stock_performance_table(grants):
-    vest_data = []
-    sale_data = []
-    for grant in grants:
-        for vest in grant.get("vests", []):
-            vest_data.append({
-                "Grant ID": grant["grant_id"],
-                "Vest ID": vest["vest_id"],
-                "Price": vest["vest_price"],
-                "Type": "Vest Price",
-            })
-            for sale in grant.get("sales", []):
-                if sale["vest_id"] == vest["vest_id"]:
-                    sale_data.append({
-                        "Grant ID": grant["grant_id"],
-                        "Vest ID": vest["vest_id"],
-                        "Price": sale["sale_price"],
-                        "Type": "Sale Price",
-                    })
-
-    if not vest_data:
-        return None
-
-    df = pd.concat([pd.DataFrame(vest_data), pd.DataFrame(sale_data)])
-    df = df.sort_values(by=["Grant ID", "Vest ID"])
+    table = grid.pivot(index="sale_price", columns="sale_date", values=value)
+    fig = _px().imshow(
+        table.to_numpy(),
+        x=[d.strftime("%Y-%m-%d") for d in table.columns],
+        y=table.index,
+        origin="lower",
+        aspect="auto",
+        color_continuous_scale="Viridis",
+        labels={"x": "Sale Date", "y": f"Sale Price ({BASE_CURRENCY})", "color": value.replace("_", " ").title()},
+        title=title,
+    )
+    fig.update_traces(hovertemplate="Sale Date: %{x}<br>Sale Price: $%{y:,.2f}<br>Amount: $%{z:,.2f}<extra></extra>")
+    return fig
 
-    return df
+def display_stage_timings(recorder):
+    """Sidebar panel with the stages recorded during this rerun, slowest first, and a JSON download."""
+    report = recorder.to_dict()
+    with st.sidebar.expander("Stage timings", expanded=True):
+        st.write(f"**Rerun:** {report['seconds'] * 1000:,.1f} ms")
+        rows = [
+            {
+                "Stage": row["stage"],
+                "Calls": row["calls"],
+                "Time (ms)": round(row["seconds"] * 1000, 1),
+                "Peak (MB)": round(row["peak_bytes"] / 1e6, 2) if row["peak_bytes"] is not None else None,
+            }
+            for row in report["stages"]
+        ]
+        st.dataframe(rows, hide_index=True)
+        if not report["trace_memory"]:
+            st.caption("Open with ?debug=memory to also trace peak allocations.")
+        else:
+            st.caption("Peaks are process-wide: sessions tracing at the same time affect each other's.")
+        st.download_button("Download Timings (JSON)", data=recorder.to_json(), file_name="stage_timings.json", mime="application/json")